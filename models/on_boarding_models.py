@@ -1,7 +1,7 @@
 from datetime import datetime
 from sqlalchemy import (
     Column, Integer, String, DateTime, Boolean,
-    ForeignKey, UniqueConstraint
+    ForeignKey, UniqueConstraint, JSON
 )
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship, validates
@@ -469,7 +469,24 @@ class ValidationPreferences(Base, AuditMixin):
             except ValueError:
                 raise ValueError(f"Invalid validation option: {value}")
         return value
-    
+
+
+# The company's validation profile. A table of its own rather than columns on
+# validation_preferences, so Base.metadata.create_all() creates it on databases
+# that already exist.
+class ValidationProfileSettings(Base, AuditMixin):
+    __tablename__ = "validation_profile_settings"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    company_id = Column(Integer, ForeignKey("ip_main.company.id"), unique=True, nullable=False)
+
+    # NULL means the platform default (every enabled check, full ISO code lists)
+    enabled_checks = Column(JSON, nullable=True)
+    allowed_currencies = Column(JSON, nullable=True)
+    allowed_purpose_codes = Column(JSON, nullable=True)
+
+    company = relationship("Company", backref="validation_profile_settings",foreign_keys=[company_id])
+
 class ApprovalConfig(Base, AuditMixin):
     __tablename__ = "approval_config"
 
@@ -1,5 +1,197 @@
+import os
+import threading
+from itertools import islice
+
 from lxml import etree
 
+# XML_MAX_MB: largest uploaded document that is parsed, in megabytes
+# XML_MAX_DEPTH: deepest element nesting accepted
+# XML_MAX_ELEMENTS: most elements accepted in one document
+# XML_HUGE_TREE: lift libxml2's own safety limits (nesting deeper than 256,
+# text nodes over 10 MB); only for trusted senders of unusual documents
+XML_MAX_BYTES = int(os.getenv("XML_MAX_MB", 512)) * 1024 * 1024
+XML_MAX_DEPTH = int(os.getenv("XML_MAX_DEPTH", 64))
+XML_MAX_ELEMENTS = int(os.getenv("XML_MAX_ELEMENTS", 20_000_000))
+XML_HUGE_TREE = os.getenv("XML_HUGE_TREE", "false").lower() == "true"
+
+# Options of every parser that reads uploaded documents: no DTD loading, no
+# entity expansion and no network access
+PARSER_OPTIONS = {"resolve_entities": False, "no_network": True, "load_dtd": False, "huge_tree": XML_HUGE_TREE}
+PARSE_CHUNK_BYTES = 1024 * 1024
+
+# Per-thread cache of compiled XSD schemas, keyed by absolute .xsd path.
+# lxml reports validation errors through the schema's own error_log, so a
+# schema object cannot be shared by threads validating at once; each thread
+# compiles its own copy once and reuses it. An entry remembers the file mtime
+# it was compiled from and is rebuilt transparently when the schema file
+# changes on disk, or when clear_schema_cache bumps the generation.
+_local = threading.local()
+_schema_generation = 0
+
+
+def get_schema(xsd_file_path):
+    """
+    Return this thread's compiled etree.XMLSchema for an XSD file, compiling
+    it on first use or when the file's mtime differs from the cached copy.
+    """
+    cache_key = os.path.abspath(xsd_file_path)
+    mtime = os.stat(xsd_file_path).st_mtime_ns
+
+    schemas = getattr(_local, "schemas", None)
+    if schemas is None:
+        schemas = _local.schemas = {}
+    entry = schemas.get(cache_key)
+    if entry is None or entry[0] != (mtime, _schema_generation):
+        with open(xsd_file_path, 'rb') as xsd_file:
+            xmlschema_doc = etree.parse(xsd_file)
+        entry = schemas[cache_key] = ((mtime, _schema_generation), etree.XMLSchema(xmlschema_doc))
+    return entry[1]
+
+
+def clear_schema_cache():
+    """Makes every thread recompile its schemas on next use."""
+    global _schema_generation
+    _schema_generation += 1
+
+
+class XMLLimitError(etree.XMLSyntaxError):
+    """A document over one of the XML_MAX_* limits; handled like any other syntax error."""
+
+    def __init__(self, message):
+        super().__init__(message, 0, 0, 0)
+
+    def __str__(self):
+        return self.msg
+
+
+class DocumentLimits:
+    """
+    Limits of one document: its size, counted by feed() from the raw bytes
+    before the parser sees them, and its element count and nesting depth,
+    counted by ends() from the parser's own start and end events. Both raise
+    XMLLimitError as soon as a limit is crossed, which abandons the parse at
+    the first start event past it.
+    """
+
+    def __init__(self, max_bytes=None, max_depth=None, max_elements=None):
+        self.max_bytes = XML_MAX_BYTES if max_bytes is None else max_bytes
+        self.max_depth = XML_MAX_DEPTH if max_depth is None else max_depth
+        self.max_elements = XML_MAX_ELEMENTS if max_elements is None else max_elements
+        self.size = 0
+        self.elements = 0
+        self.depth = 0
+
+    def feed(self, chunk):
+        self.size += len(chunk)
+        if self.size > self.max_bytes:
+            raise XMLLimitError(f"Document exceeds the limit of {self.max_bytes} bytes")
+
+    def ends(self, events):
+        """
+        Counts the (event, element) pairs of a parser reporting "start" and
+        "end" events and yields the element of each end event.
+        """
+        depth, elements = self.depth, self.elements
+        try:
+            for event, element in events:
+                if event == "start":
+                    depth += 1
+                    elements += 1
+                    if depth > self.max_depth:
+                        raise XMLLimitError(f"Document nesting exceeds the limit of {self.max_depth} levels")
+                    if elements > self.max_elements:
+                        raise XMLLimitError(f"Document exceeds the limit of {self.max_elements} elements")
+                else:
+                    depth -= 1
+                    yield element
+        finally:
+            self.depth, self.elements = depth, elements
+
+    def count(self, events):
+        """Like ends(), for events whose elements are not needed."""
+        for _ in self.ends(events):
+            pass
+
+
+class LimitedReader:
+    """
+    File object wrapper that counts every block read from source against the
+    size limit of DocumentLimits, for iterparse; the parse itself passes its
+    events through the same limits' ends(). check, if given, is called before
+    each block and may raise to abandon the parse.
+    """
+
+    def __init__(self, source, limits=None, check=None):
+        self._source = source
+        self._limits = DocumentLimits() if limits is None else limits
+        self._check = check
+        self._block = b""
+        self._offset = 0
+
+    def read(self, size=-1):
+        if self._offset >= len(self._block):
+            if self._check is not None:
+                self._check()
+            self._block = self._source.read(PARSE_CHUNK_BYTES)
+            self._offset = 0
+            self._limits.feed(self._block)
+        end = len(self._block) if size is None or size < 0 else self._offset + size
+        data = self._block[self._offset:end]
+        self._offset += len(data)
+        return data
+
+
+def get_parser():
+    """
+    This thread's parser for uploaded documents, created on first use and
+    reused for every parse on the thread (lxml parsers are not thread-safe).
+    It reports start and end events for DocumentLimits. Blank text between
+    elements is dropped, which no check or XSD reads.
+    """
+    parser = getattr(_local, "parser", None)
+    if parser is None:
+        parser = _local.parser = etree.XMLPullParser(
+            events=("start", "end"), remove_blank_text=True, **PARSER_OPTIONS
+        )
+    return parser
+
+
+def parse_document(source, base_url=None, check=None):
+    """
+    Parses source, a binary file object, with this thread's parser, feeding it
+    PARSE_CHUNK_BYTES at a time and counting its bytes and events against
+    DocumentLimits. base_url names the document in error messages. Raises XMLLimitError or etree.XMLSyntaxError;
+    check, if given, is called before each chunk and may raise to abandon the parse.
+    """
+    parser = get_parser()
+    limits = DocumentLimits()
+    try:
+        while True:
+            if check is not None:
+                check()
+            chunk = source.read(PARSE_CHUNK_BYTES)
+            if not chunk:
+                break
+            limits.feed(chunk)
+            parser.feed(chunk)
+            limits.count(parser.read_events())
+        root = parser.close()
+        limits.count(parser.read_events())
+    except Exception:
+        # Closing and draining the events left over resets the parser for the thread's next document
+        try:
+            parser.close()
+        except etree.XMLSyntaxError:
+            pass
+        for _ in parser.read_events():
+            pass
+        raise
+    tree = root.getroottree()
+    if base_url:
+        tree.docinfo.URL = base_url
+    return tree
+
+
 def validate(xml_file_path, xsd_file_path):
     """
     Validate an XML file against a given XSD schema.
@@ -8,18 +200,31 @@ def validate(xml_file_path, xsd_file_path):
         (bool, list[str]) → (is_valid, list_of_errors)
     """
     try:
-        # Load schema
-        with open(xsd_file_path, 'rb') as xsd_file:
-            xmlschema_doc = etree.parse(xsd_file)
-            xmlschema = etree.XMLSchema(xmlschema_doc)
-
         # Load XML
         with open(xml_file_path, 'rb') as xml_file:
-            xml_doc = etree.parse(xml_file)
+            xml_doc = parse_document(xml_file, xml_file_path)
+
+        return validate_tree(xml_doc, xsd_file_path)
+
+    except Exception as e:
+        return False, [f"Exception during validation: {e}"]
+
+
+def validate_tree(xml_doc, xsd_file_path, max_errors=None):
+    """
+    Validate an already parsed XML document against a given XSD schema,
+    formatting at most max_errors errors (all if None).
+
+    Returns:
+        (bool, list[str]) → (is_valid, list_of_errors)
+    """
+    try:
+        # Load schema (compiled once per thread, see get_schema)
+        schema = get_schema(xsd_file_path)
 
         # Validate
-        is_valid = xmlschema.validate(xml_doc)
-        errors = [str(error) for error in xmlschema.error_log]
+        is_valid = schema.validate(xml_doc)
+        errors = [str(error) for error in islice(schema.error_log, max_errors)]
 
         return is_valid, errors
 
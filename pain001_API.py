@@ -7,6 +7,12 @@ from database import engine, DATABASE_URL
 #for the sales_rep
 from routes import client_on_boarding, file_validation, auth_routes
 from fastapi.middleware.cors import CORSMiddleware
+from utils.file_validation_util import warm_schema_cache
+from utils.business_calendar import warm_business_calendars
+from utils.cutoff_schedule import warm_cutoff_schedules
+from utils.validation_pool import validation_pool
+from utils.message_id_index import message_id_index
+from utils.end_to_end_id_index import end_to_end_id_index
 
 # from utils.seed_states import seed_states
 # from utils.seed_countries import seed_countries_if_needed
@@ -21,6 +27,19 @@ app.include_router(auth_routes.router)
 app.include_router(file_validation.router)
 app.include_router(client_on_boarding.router)
 
+@app.on_event("startup")
+def warm_validation_caches():
+    warm_schema_cache()
+    validation_pool.initializer = warm_schema_cache
+    warm_business_calendars()
+    warm_cutoff_schedules()
+
+@app.on_event("shutdown")
+def stop_validation_pool():
+    validation_pool.shutdown()
+    message_id_index.close()
+    end_to_end_id_index.close()
+
 # @app.on_event("startup")
 # def startup_tasks():
 #     seed_countries_if_needed()
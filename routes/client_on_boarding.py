@@ -369,12 +369,12 @@ def save_integration_settings(request: IntegrationSaveRequest, db: Session = Dep
 from fastapi import APIRouter, Depends, HTTPException
 from sqlalchemy.orm import Session
 from database import get_db
-from models.on_boarding_models import Company, ValidationPreferences
+from models.on_boarding_models import Company, ValidationPreferences, ValidationProfileSettings
 from schemas.on_boarding_schemas import XMLValidationPreferenceRequest
 from services.audit_service import log_audit
 
 
-@router.post("/validation-preferences", summary="Set XML validation preferences")
+@router.post("/validation-preferences", summary="Set or update XML validation preferences")
 def set_validation_preferences(payload: XMLValidationPreferenceRequest, db: Session = Depends(get_db)):
     try:
         # 🔍 Check if company exists
@@ -382,28 +382,37 @@ def set_validation_preferences(payload: XMLValidationPreferenceRequest, db: Sess
         if not company:
             raise HTTPException(status_code=404, detail="Company not found")
 
-        # ❌ Prevent duplicate preferences
-        existing = db.query(ValidationPreferences).filter(
+        # 🔁 Update the existing preferences or insert new ones
+        preference = db.query(ValidationPreferences).filter(
             ValidationPreferences.company_id == payload.company_id
         ).first()
-        if existing:
-            raise HTTPException(status_code=400, detail="Validation preferences already set for this company.")
+        created = preference is None
+        if created:
+            preference = ValidationPreferences(company_id=payload.company_id)
 
-        # ✅ Insert into validation_preferences
-        preference = ValidationPreferences(
-            company_id=payload.company_id,
-            validation_option=payload.xml_validation
-        )
-        db.add(preference)
+        preference.validation_option = payload.xml_validation
 
-        # 🔁 Update step_in_progress to 5
-        company.step_in_progress = 5
+        # The validation profile lives in its own table; omitted fields go back to the platform defaults
+        profile = db.query(ValidationProfileSettings).filter(
+            ValidationProfileSettings.company_id == payload.company_id
+        ).first()
+        if profile is None:
+            profile = ValidationProfileSettings(company_id=payload.company_id)
+        profile.enabled_checks = payload.enabled_checks
+        profile.allowed_currencies = payload.allowed_currencies
+        profile.allowed_purpose_codes = payload.allowed_purpose_codes
+        db.add(profile)
+
+        if created:
+            db.add(preference)
+            # 🔁 Update step_in_progress to 5
+            company.step_in_progress = 5
 
         # 🪵 Add audit log
         log_audit(
             db=db,
-            audit_title="Validation Preferences Set",  # Replace with user ID later if needed
-            message=f"Validation preferences set to '{payload.xml_validation}' for Company ID {payload.company_id}"
+            audit_title="Validation Preferences Set" if created else "Validation Preferences Updated",  # Replace with user ID later if needed
+            message=f"Validation preferences {'set' if created else 'updated'} to '{payload.xml_validation}' for Company ID {payload.company_id}"
         )
 
         db.commit()
@@ -412,6 +421,9 @@ def set_validation_preferences(payload: XMLValidationPreferenceRequest, db: Sess
             "company_id": payload.company_id
         }
 
+    except HTTPException:
+        db.rollback()
+        raise
     except Exception as e:
         db.rollback()
         raise HTTPException(status_code=500, detail=f"Failed to save validation preferences: {str(e)}")
@@ -1,80 +1,283 @@
-from fastapi import FastAPI, UploadFile, File, HTTPException,APIRouter
+from fastapi import FastAPI, UploadFile, File, HTTPException,APIRouter, Query, Depends, Request
+from typing import List, Optional
 from fastapi.responses import FileResponse, JSONResponse
-import shutil
+from starlette.concurrency import run_in_threadpool
+import asyncio
+import logging
 import os
+import shutil
 import uuid
-from utils.file_validation_util import validate_and_compare, write_annotated_html, write_individual_report, get_version_from_filename, get_version_from_xml, prompt_for_version  # adjust imports
-from datetime import datetime
+from services.file_validation_service import (
+    run_file_validation, read_upload, discard_upload, parse_structured_errors, FileValidationError, IncrementalUpload
+)
+from services.batch_validation_service import stage_batch_uploads, validate_batch
+from services.validation_job_service import create_job, get_job, run_validation_job
+from utils.validation_pool import validation_pool, PoolSaturatedError
+from utils.result_cache import result_cache
+from utils.check_registry import check_registry
+from utils.time_budget import TimeBudget, cancel_validation, forget_validation
+from services.auth_service import get_optional_current_user
+from services.validation_profile_service import get_validation_profile, get_company_id_for_user
+from database import get_db
+from sqlalchemy.orm import Session
+from redis.exceptions import RedisError
 
 # app = FastAPI()
 
 router = APIRouter(prefix="/files", tags=["Files"])
 
+# Only uploads too large to validate in memory and batch members are spooled
+# here, and each request removes its own files when it is done
 UPLOAD_DIR = "temp_uploads"
 os.makedirs(UPLOAD_DIR, exist_ok=True)
 
+# How often a request waiting on its validation checks whether the client is still there
+DISCONNECT_POLL_SECONDS = 0.5
+
+def parse_check_names(checks: Optional[str]):
+    """Comma separated check names from the query string, validated against the registry."""
+    if not checks:
+        return None
+    names = [name.strip() for name in checks.split(",") if name.strip()]
+    try:
+        check_registry.select(names)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"{e}. Available checks: {check_registry.names()}")
+    return names
+
+
+async def await_validation(request: Request, source, filename, company_id, check_names, profile, upload_pass=None,
+                           max_errors=None, fail_fast=False):
+    """
+    Runs run_file_validation on a slot reserved with try_acquire under a fresh
+    TimeBudget, and cancels it if the client disconnects before it returns.
+    The worker stops at its next step and frees the slot itself.
+    """
+    budget = TimeBudget()
+    task = asyncio.ensure_future(validation_pool.run(
+        run_file_validation, source, filename, None, company_id, None, check_names, profile, upload_pass, budget,
+        max_errors, fail_fast, reserved=True
+    ))
+    task.add_done_callback(lambda _: forget_validation(budget.token))
+    try:
+        while True:
+            done, _ = await asyncio.wait({task}, timeout=DISCONNECT_POLL_SECONDS)
+            if done:
+                return task.result()
+            if await request.is_disconnected():
+                logging.info(f"Client went away; cancelling validation of {filename}")
+                cancel_validation(budget.token)
+                return await asyncio.shield(task)
+    except asyncio.CancelledError:
+        cancel_validation(budget.token)
+        raise
+
+
 @router.post("/validate")
-async def validate_file(file: UploadFile = File(...)):
+async def validate_file(
+    request: Request,
+    file: UploadFile = File(...),
+    checks: Optional[str] = Query(None, description="Comma separated subset of checks to run, e.g. mod10,purpose_code"),
+    max_errors: Optional[int] = Query(None, ge=1, description="Stop collecting errors after this many; the response notes the truncation"),
+    fail_fast: bool = Query(False, description="Stop at the first failing check and report only its first error, unless max_errors allows more"),
+    user=Depends(get_optional_current_user),
+    db: Session = Depends(get_db),
+):
     unique_id = uuid.uuid4().hex
     ext = os.path.splitext(file.filename)[1].lower()
     if ext not in [".xml", ".csv"]:
         raise HTTPException(status_code=400, detail="Only XML or CSV files are supported.")
+    check_names = parse_check_names(checks)
+
+    # Authenticated client users get their company's validation profile
+    company_id = await run_in_threadpool(get_company_id_for_user, db, user)
+    profile = await run_in_threadpool(get_validation_profile, db, company_id)
+
+    # Refuse fast when the pool is full instead of queueing without bound
+    try:
+        validation_pool.try_acquire()
+    except PoolSaturatedError as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "5"})
+
+    spool_path = os.path.join(UPLOAD_DIR, f"{unique_id}_{os.path.basename(file.filename)}")
+    try:
+        source = await run_in_threadpool(read_upload, file.file, spool_path)
+    except FileValidationError as e:
+        validation_pool.release()
+        await run_in_threadpool(discard_upload, spool_path)
+        return JSONResponse(status_code=e.status_code, content={"error": e.error})
+    except Exception:
+        validation_pool.release()
+        await run_in_threadpool(discard_upload, spool_path)
+        raise
+
+    # Parsing, validation and report generation all run on the validation pool
+    try:
+        return await await_validation(
+            request, source, file.filename, company_id, check_names, profile, None, max_errors, fail_fast
+        )
+    except FileValidationError as e:
+        return JSONResponse(status_code=e.status_code, content={"error": e.error})
+    finally:
+        await run_in_threadpool(discard_upload, source)
 
-    file_path = os.path.join(UPLOAD_DIR, f"{unique_id}_{file.filename}")
-    with open(file_path, "wb") as buffer:
-        shutil.copyfileobj(file.file, buffer)
-
-    # Get version
-    if ext == ".csv":
-        version = get_version_from_filename(file.filename) or prompt_for_version(file.filename)
-        if not version:
-            return JSONResponse(status_code=400, content={"error": "Could not determine version from filename."})
-        from utils.file_validation_util import generate_xml_from_csv
-        xml_path = generate_xml_from_csv(file_path, version)
-        if not xml_path:
-            return JSONResponse(status_code=500, content={"error": "Failed to generate XML from CSV."})
-    else:
-        version = get_version_from_xml(file_path) or prompt_for_version(file.filename)
-        if not version:
-            return JSONResponse(status_code=400, content={"error": "Could not determine version from XML."})
-        xml_path = file_path
-
-    # Run validation
-    passed, errors, diffs, extra_info = validate_and_compare(xml_path, version)
-
-    # Generate reports
-    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    html_path = write_annotated_html(xml_path, errors, "See console summary", output_dir="files/pain_001_output_reports")
-    csv_report_path = write_individual_report(
-        os.path.basename(file.filename), version,
-        "CSV" if ext == ".csv" else "XML", passed, errors, diffs
+
+@router.post("/validate-stream")
+async def validate_file_stream(
+    request: Request,
+    filename: str = Query(..., description="Name of the uploaded XML file"),
+    checks: Optional[str] = Query(None, description="Comma separated subset of checks to run, e.g. mod10,purpose_code"),
+    max_errors: Optional[int] = Query(None, ge=1, description="Stop collecting errors after this many; the response notes the truncation"),
+    fail_fast: bool = Query(False, description="Stop at the first failing check and report only its first error, unless max_errors allows more"),
+    user=Depends(get_optional_current_user),
+    db: Session = Depends(get_db),
+):
+    """
+    Same result as /files/validate for an XML file sent as the raw request
+    body. Validation runs on each chunk as it arrives, so a malformed file is
+    refused before the rest of it is read and a good one only waits for the
+    whole-document checks once the last byte is in.
+    """
+    filename = os.path.basename(filename)
+    if os.path.splitext(filename)[1].lower() != ".xml":
+        raise HTTPException(status_code=400, detail="Only XML files can be validated while uploading; use /files/validate for CSV.")
+    check_names = parse_check_names(checks)
+
+    company_id = await run_in_threadpool(get_company_id_for_user, db, user)
+    profile = await run_in_threadpool(get_validation_profile, db, company_id)
+
+    try:
+        validation_pool.try_acquire()
+    except PoolSaturatedError as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "5"})
+
+    upload = IncrementalUpload(
+        os.path.join(UPLOAD_DIR, f"{uuid.uuid4().hex}_{filename}"), filename, profile, max_errors, fail_fast
     )
+    try:
+        async for chunk in request.stream():
+            if chunk:
+                await run_in_threadpool(upload.feed, chunk)
+        upload_pass = await run_in_threadpool(upload.finish)
+    except FileValidationError as e:
+        validation_pool.release()
+        await run_in_threadpool(upload.discard)
+        return JSONResponse(status_code=e.status_code, content={"error": e.error})
+    except Exception:
+        validation_pool.release()
+        await run_in_threadpool(upload.discard)
+        raise
+
+    try:
+        return await await_validation(
+            request, upload_pass.source, filename, company_id, check_names, profile, upload_pass, max_errors, fail_fast
+        )
+    except FileValidationError as e:
+        return JSONResponse(status_code=e.status_code, content={"error": e.error})
+    finally:
+        await run_in_threadpool(discard_upload, upload_pass.source)
+
+
+@router.post("/validate-jobs", status_code=202)
+async def create_validation_job(
+    file: UploadFile = File(...),
+    max_errors: Optional[int] = Query(None, ge=1, description="Stop collecting errors after this many; the result notes the truncation"),
+    fail_fast: bool = Query(False, description="Stop at the first failing check and report only its first error, unless max_errors allows more"),
+):
+    unique_id = uuid.uuid4().hex
+    ext = os.path.splitext(file.filename)[1].lower()
+    if ext not in [".xml", ".csv"]:
+        raise HTTPException(status_code=400, detail="Only XML or CSV files are supported.")
+
+    try:
+        validation_pool.try_acquire()
+    except PoolSaturatedError as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "5"})
+
+    spool_path = os.path.join(UPLOAD_DIR, f"{unique_id}_{os.path.basename(file.filename)}")
+    try:
+        source = await run_in_threadpool(read_upload, file.file, spool_path)
+        job = await run_in_threadpool(create_job, file.filename)
+    except FileValidationError as e:
+        validation_pool.release()
+        await run_in_threadpool(discard_upload, spool_path)
+        return JSONResponse(status_code=e.status_code, content={"error": e.error})
+    except RedisError:
+        validation_pool.release()
+        await run_in_threadpool(discard_upload, spool_path)
+        raise HTTPException(status_code=503, detail="Validation job store is unavailable.")
+    except Exception:
+        validation_pool.release()
+        await run_in_threadpool(discard_upload, spool_path)
+        raise
+
+    # Fire and forget: the job records its own progress and result, and removes a spooled upload
+    validation_pool.submit_reserved(run_validation_job, job["job_id"], source, file.filename, max_errors, fail_fast)
 
-    # Build response
     return {
-        "status": "PASSED" if passed else "FAILED",
-        "filename": file.filename,
-        "version": version,
-        "errors": parse_structured_errors(errors),
-        "info_messages": extra_info.get("info_messages", []),
-        "checks": {
-            "NbOfTxs": extra_info.get("nboftxs_passed"),
-            "CtrlSum": extra_info.get("ctrlsum_passed"),
-            "Purpose Code": extra_info.get("purpose_code_passed"),
-            "UTF-8 Encoding": extra_info.get("utf8_encoding_passed"),
-            "Currency Code": extra_info.get("currency_code_passed"),
-            "Duplicate Message ID": extra_info.get("duplicate_msgid_passed"),
-            "IBAN checksum": extra_info.get("iban_passed"),
-            "MmbId": extra_info.get("mmbid_passed"),
-            "Country Code": extra_info.get("country_code_passed"),
-            "Duplicate EndToEndId": extra_info.get("duplicate_e2e_passed"),
-            "Payment Dates": extra_info.get("payment_date_results", {})
-        },
-        "html_report_url": f"/files/download/html/{os.path.basename(html_path)}",
-        "csv_report_url": f"/files/download/csv/{os.path.basename(csv_report_path)}"
+        "job_id": job["job_id"],
+        "status": job["status"],
+        "status_url": f"/files/validate-jobs/{job['job_id']}"
     }
 
 
+@router.get("/validate-jobs/{job_id}")
+async def get_validation_job(job_id: str):
+    try:
+        job = await run_in_threadpool(get_job, job_id)
+    except RedisError:
+        raise HTTPException(status_code=503, detail="Validation job store is unavailable.")
+    if not job:
+        raise HTTPException(status_code=404, detail="Validation job not found.")
+    return job
+
+
+@router.post("/validate-batch")
+async def validate_batch_files(files: List[UploadFile] = File(...)):
+    """Validates many XML/CSV files, sent as multipart parts and/or ZIP archives, in one request."""
+    try:
+        validation_pool.try_acquire()
+    except PoolSaturatedError as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "5"})
+
+    batch_dir = os.path.join(UPLOAD_DIR, f"batch_{uuid.uuid4().hex}")
+    try:
+        members, skipped = await run_in_threadpool(
+            stage_batch_uploads, [(f.filename, f.file) for f in files], batch_dir
+        )
+    except FileValidationError as e:
+        validation_pool.release()
+        await run_in_threadpool(shutil.rmtree, batch_dir, True)
+        return JSONResponse(status_code=e.status_code, content={"error": e.error})
+    except Exception:
+        validation_pool.release()
+        await run_in_threadpool(shutil.rmtree, batch_dir, True)
+        raise
+
+    if not members:
+        validation_pool.release()
+        await run_in_threadpool(shutil.rmtree, batch_dir, True)
+        raise HTTPException(status_code=400, detail={"error": "No XML or CSV files found in the batch.", "skipped": skipped})
+
+    # The slot reserved above runs the first member; the others take their own slots
+    try:
+        return await validate_batch(members, skipped)
+    finally:
+        await run_in_threadpool(shutil.rmtree, batch_dir, True)
+
+
+@router.get("/validate/checks")
+async def list_validation_checks():
+    return [
+        {"name": check.name, "enabled": check.enabled, "outputs": list(check.outputs), "xpaths": list(check.xpaths)}
+        for check in check_registry
+    ]
+
+
+@router.get("/validate/metrics")
+async def validation_pool_metrics():
+    return {**validation_pool.metrics(), "result_cache": result_cache.stats()}
+
 
 @router.get("/download/html/{filename}")
 async def download_html(filename: str):
@@ -89,34 +292,3 @@ async def download_csv(filename: str):
     if not os.path.exists(file_path):
         raise HTTPException(status_code=404, detail="CSV report not found.")
     return FileResponse(path=file_path, media_type="text/csv", filename=filename)
-
-
-
-import re
-
-def parse_structured_errors(errors: list):
-    line_errors = []
-    additional_error_details = []
-
-    for err in errors:
-        match = re.search(r"Line (\d+)\s*-\s*(.*)", err)
-        if match:
-            line_no = int(match.group(1))
-            message = match.group(2).strip()
-            # Attempt to extract a value (like a duplicate ID or date) after "Found:"
-            found_match = re.search(r"Found: ([^.\n]*)", message)
-            found_value = found_match.group(1).strip() if found_match else None
-
-            line_errors.append({
-                "line_no": line_no,
-                "line_name": f"Line {line_no}",
-                "message": message,
-                "found": found_value
-            }) 
-        else:
-            additional_error_details.append(err.strip())
-    return {
-        "line_errors": line_errors,
-        "additional_error_details": additional_error_details
-    }
-
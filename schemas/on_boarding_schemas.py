@@ -60,6 +60,7 @@ class UserRegisterRequest(BaseModel):
 from pydantic import BaseModel, Field, HttpUrl, EmailStr, validator
 from typing import Optional, List
 from models.on_boarding_enums import EntityTypeEnum, OwnershipEnum, ContactTypeEnum, XMLValidationOptionEnum
+from utils.validators import is_valid_country, unknown_check_names, unknown_currencies, unknown_purpose_codes
 
 class AddressSchema(BaseModel):
     address_line_1: str
@@ -77,6 +78,12 @@ class AddressSchema(BaseModel):
             raise ValueError("ZIP code must be 5 digits or ZIP+4 format (e.g., 12345 or 12345-6789).")
         return v
 
+    @validator("country")
+    def validate_country(cls, v):
+        if not is_valid_country(v):
+            raise ValueError("Country must be an ISO 3166 country code or country name.")
+        return v
+
 
 class ContactSchema(BaseModel):
     contact_type: ContactTypeEnum
@@ -197,6 +204,43 @@ class IntegrationSaveRequest(BaseModel):
 class XMLValidationPreferenceRequest(BaseModel):
     company_id: int
     xml_validation: XMLValidationOptionEnum
+    # Optional validation profile; omitted fields keep the platform defaults
+    enabled_checks: Optional[List[str]] = None
+    allowed_currencies: Optional[List[str]] = None
+    allowed_purpose_codes: Optional[List[str]] = None
+
+    @validator("enabled_checks")
+    def validate_enabled_checks(cls, v):
+        if v is None:
+            return v
+        if not v:
+            raise ValueError("enabled_checks must name at least one check; omit it to run every check.")
+        unknown = unknown_check_names(v)
+        if unknown:
+            raise ValueError(f"Unknown validation checks: {', '.join(unknown)}.")
+        return v
+
+    @validator("allowed_currencies")
+    def validate_allowed_currencies(cls, v):
+        if v is None:
+            return v
+        if not v:
+            raise ValueError("allowed_currencies must list at least one currency; omit it to allow every currency.")
+        unknown = unknown_currencies(v)
+        if unknown:
+            raise ValueError(f"Unknown ISO 4217 currency codes: {', '.join(unknown)}.")
+        return [code.strip().upper() for code in v]
+
+    @validator("allowed_purpose_codes")
+    def validate_allowed_purpose_codes(cls, v):
+        if v is None:
+            return v
+        if not v:
+            raise ValueError("allowed_purpose_codes must list at least one code; omit it to allow every purpose code.")
+        unknown = unknown_purpose_codes(v)
+        if unknown:
+            raise ValueError(f"Unknown purpose codes: {', '.join(unknown)}.")
+        return [code.strip().upper() for code in v]
 
 
 from pydantic import BaseModel, Field
@@ -3,7 +3,7 @@ from sqlalchemy.orm import Session
 from utils.jwt_util import decode_token  
 from database import get_db
 from models.on_boarding_models import User
-from utils.jwt_util import oauth2_scheme  
+from utils.jwt_util import oauth2_scheme, optional_oauth2_scheme
 
 def get_current_user(
     token: str = Depends(oauth2_scheme), 
@@ -26,6 +26,16 @@ def get_current_user(
     return user
 
 
+def get_optional_current_user(
+    token: str = Depends(optional_oauth2_scheme),
+    db: Session = Depends(get_db)
+):
+    """The authenticated user, or None when no Authorization header was sent."""
+    if not token:
+        return None
+    return get_current_user(token, db)
+
+
 def has_permission(user: User, permission_name: str) -> bool:
     if not user.role or not user.role.role_permissions:
         return False
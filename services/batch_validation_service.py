@@ -0,0 +1,294 @@
+import asyncio
+import logging
+import os
+import time
+import zipfile
+
+from utils.message_id_index import InMemoryMessageIdIndex
+from utils.file_validation_util import read_message_id, render_xml_from_csv, get_version_from_filename
+from utils.validation_pool import validation_pool, VALIDATION_POOL_WORKERS
+from pain001.xmlutils import XML_MAX_BYTES
+from services.file_validation_service import run_file_validation, save_upload, FileValidationError
+
+# BATCH_MAX_PARALLEL: most members of one batch validated at once; each holds
+# its own validation pool slot while it runs
+# BATCH_MAX_FILES: largest number of files accepted in one batch (after ZIP expansion)
+# BATCH_MAX_MB: most megabytes one batch may stage on disk, ZIP members uncompressed;
+# each file is also held to XML_MAX_MB
+BATCH_MAX_PARALLEL = int(os.getenv("BATCH_MAX_PARALLEL", VALIDATION_POOL_WORKERS))
+BATCH_MAX_FILES = int(os.getenv("BATCH_MAX_FILES", 500))
+BATCH_MAX_BYTES = int(os.getenv("BATCH_MAX_MB", 1024)) * 1024 * 1024
+
+SUPPORTED_EXTENSIONS = (".xml", ".csv")
+
+
+class BatchBudget:
+    """
+    Files and bytes one batch has staged so far. Going over BATCH_MAX_FILES,
+    BATCH_MAX_BYTES or, for one file, XML_MAX_BYTES raises
+    FileValidationError (413) before the offending bytes reach the disk.
+    """
+
+    def __init__(self):
+        self.files = 0
+        self.size = 0
+
+    def add_file(self, filename: str, size=0):
+        self.files += 1
+        if self.files > BATCH_MAX_FILES:
+            raise FileValidationError(413, f"A batch may contain at most {BATCH_MAX_FILES} files.")
+        self.check(filename, size)
+
+    def check(self, filename: str, size: int):
+        if size > XML_MAX_BYTES:
+            raise FileValidationError(413, f"{filename} exceeds the limit of {XML_MAX_BYTES} bytes.")
+        if self.size + size > BATCH_MAX_BYTES:
+            raise FileValidationError(413, f"Batch exceeds the limit of {BATCH_MAX_BYTES} bytes.")
+
+    def copy(self, source, file_path: str, filename: str):
+        """Copies one member to file_path, checking the limits as the bytes arrive."""
+        size = 0
+        with open(file_path, "wb") as target:
+            while chunk := source.read(1024 * 1024):
+                size += len(chunk)
+                self.check(filename, size)
+                target.write(chunk)
+        self.size += size
+
+
+def expand_zip(zip_path: str, target_dir: str, budget: BatchBudget = None):
+    """
+    Extracts the XML/CSV members of a ZIP upload into target_dir, within
+    budget. A member whose declared size is over a limit is refused before
+    anything of it is extracted, and one that inflates past its declared
+    size is stopped as it is copied.
+
+    Returns (members, skipped) where members is a list of (file_path, filename).
+    Directory structure inside the archive is flattened, which also keeps
+    members from escaping target_dir.
+    """
+    budget = BatchBudget() if budget is None else budget
+    members, skipped = [], []
+    with zipfile.ZipFile(zip_path) as archive:
+        for info in archive.infolist():
+            if info.is_dir():
+                continue
+            filename = os.path.basename(info.filename)
+            if not filename.lower().endswith(SUPPORTED_EXTENSIONS):
+                skipped.append(f"{info.filename} - Unsupported file type.")
+                continue
+            budget.add_file(info.filename, info.file_size)
+            file_path = os.path.join(target_dir, f"{len(members)}_{filename}")
+            with archive.open(info) as source:
+                budget.copy(source, file_path, info.filename)
+            members.append((file_path, filename))
+    return members, skipped
+
+
+def stage_batch_uploads(uploads: list, target_dir: str):
+    """
+    Saves multipart uploads, given as (filename, file object) pairs, into
+    target_dir, expanding any ZIP archives. Returns (members, skipped). A
+    batch over its limits (see BatchBudget) raises FileValidationError (413);
+    the caller removes target_dir.
+    """
+    os.makedirs(target_dir, exist_ok=True)
+    budget = BatchBudget()
+    members, skipped = [], []
+    for index, (filename, source) in enumerate(uploads):
+        filename = os.path.basename(filename or "")
+        ext = os.path.splitext(filename)[1].lower()
+        file_path = os.path.join(target_dir, f"upload{index}_{filename}")
+        if ext == ".zip":
+            save_upload(source, file_path, BATCH_MAX_BYTES)
+            try:
+                zip_dir = os.path.join(target_dir, f"zip{index}")
+                os.makedirs(zip_dir, exist_ok=True)
+                zip_members, zip_skipped = expand_zip(file_path, zip_dir, budget)
+            except zipfile.BadZipFile:
+                skipped.append(f"{filename} - Invalid ZIP archive.")
+                continue
+            finally:
+                os.remove(file_path)
+            members.extend(zip_members)
+            skipped.extend(zip_skipped)
+        elif ext in SUPPORTED_EXTENSIONS:
+            budget.add_file(filename)
+            budget.copy(source, file_path, filename)
+            members.append((file_path, filename))
+        else:
+            skipped.append(f"{filename} - Unsupported file type.")
+    return members, skipped
+
+
+async def _run_members(fn, arg_lists, reserved=False):
+    """
+    Runs fn(*args) for every args in arg_lists on the validation pool and
+    returns the results in order. Every call holds its own pool slot, so a
+    batch is bounded by the pool like any other validation: lanes beyond the
+    first only start if a slot is free, and each waits for a slot before its
+    next call. reserved means the caller already holds the first slot.
+    """
+    results = [None] * len(arg_lists)
+    pending = list(enumerate(arg_lists))[::-1]
+
+    async def lane(reserved):
+        while pending:
+            index, args = pending.pop()
+            if not reserved:
+                await validation_pool.acquire()
+            reserved = False
+            results[index] = await validation_pool.run(fn, *args, reserved=True)
+
+    lanes = [lane(reserved)]
+    while len(lanes) < min(BATCH_MAX_PARALLEL, len(arg_lists)) and validation_pool.reserve_if_free():
+        lanes.append(lane(True))
+    await asyncio.gather(*lanes)
+    return results
+
+
+def _read_batch_member_message_id(file_path: str, filename: str):
+    """The MsgId of one batch member, read ahead of its validation; None if it has none or cannot be read."""
+    source = file_path
+    try:
+        if filename.lower().endswith(".csv"):
+            version = get_version_from_filename(filename)
+            source = render_xml_from_csv(file_path, version) if version else None
+        return read_message_id(source) if source is not None else None
+    except Exception as e:
+        # The member's own validation reports whatever went wrong
+        logging.warning(f"Could not read the Message ID of batch member {filename}: {e}")
+        return None
+
+
+class BatchEndToEndIds:
+    """
+    EndToEndId index of one batch member: it reports nothing and keeps the
+    member's ids (id -> first line), which validate_batch compares across
+    the members of the batch.
+    """
+
+    def __init__(self):
+        self.first_lines = {}
+
+    def record_many(self, filename: str, entries) -> dict:
+        return self.lookup_many(entries)
+
+    def lookup_many(self, entries) -> dict:
+        for end_to_end_id, line in entries:
+            self.first_lines.setdefault(end_to_end_id, line)
+        return {}
+
+
+def _validate_batch_member(file_path: str, filename: str, msg_id, other_files):
+    """Validates one batch member on the validation pool; returns (filename, payload, EndToEndIds, error)."""
+    # A fresh index per member keeps the duplicate MsgId check scoped to the
+    # batch. It is seeded with the other members that use the same MsgId, so
+    # the duplicate is reported by the check itself, reports included.
+    seen_ids = InMemoryMessageIdIndex()
+    for other_file in other_files:
+        seen_ids.record(msg_id, other_file)
+    seen_e2e_ids = BatchEndToEndIds()
+    try:
+        payload = run_file_validation(file_path, filename, seen_ids, seen_end_to_end_ids=seen_e2e_ids)
+    except FileValidationError as e:
+        return filename, None, {}, e.error
+    except Exception as e:
+        logging.exception(f"Batch member {filename} failed")
+        return filename, None, {}, f"Unexpected error: {e}"
+    return filename, payload, seen_e2e_ids.first_lines, None
+
+
+def _flag_batch_end_to_end_ids(outcomes):
+    """
+    Adds an error to every member that shares an EndToEndId with another
+    member of the batch and returns {EndToEndId: [filenames]}. These errors
+    are only known once every member ran, so they are in the payloads but
+    not in the members' CSV and HTML reports.
+    """
+    members_by_id = {}
+    for index, (_, payload, first_lines, _) in enumerate(outcomes):
+        for end_to_end_id in first_lines:
+            members_by_id.setdefault(end_to_end_id, []).append(index)
+
+    duplicates = {}
+    for end_to_end_id, indexes in members_by_id.items():
+        if len(indexes) < 2:
+            continue
+        duplicates[end_to_end_id] = [outcomes[index][0] for index in indexes]
+        for index in indexes:
+            filename, payload, first_lines, _ = outcomes[index]
+            others = [outcomes[other][0] for other in indexes if other != index]
+            line = first_lines[end_to_end_id]
+            payload["errors"]["line_errors"].append({
+                "line_no": line,
+                "line_name": f"Line {line}",
+                "message": f"EndToEndId '{end_to_end_id}' is also used in this batch. (Also used in files: {others})",
+                "found": None,
+            })
+            payload["checks"]["Duplicate EndToEndId"] = False
+            if payload["status"] == "PASSED":
+                payload["status"] = "FAILED"
+    return duplicates
+
+
+async def validate_batch(members: list, skipped: list = None) -> dict:
+    """
+    Validates every (file_path, filename) in members concurrently on the
+    validation pool and returns one consolidated summary plus the per-file
+    /files/validate payloads. The caller holds one pool slot for the batch.
+    Duplicate MsgIds and EndToEndIds are detected across the files of this
+    batch only: the MsgIds are read first and each member is validated
+    against the others, while EndToEndIds are compared once every member ran.
+    """
+    start = time.time()
+    skipped = list(skipped or [])
+
+    msg_ids = await _run_members(_read_batch_member_message_id, members, reserved=True)
+    members_by_msg_id = {}
+    for index, msg_id in enumerate(msg_ids):
+        if msg_id:
+            members_by_msg_id.setdefault(msg_id, []).append(index)
+    duplicates = {msg_id: indexes for msg_id, indexes in members_by_msg_id.items() if len(indexes) > 1}
+
+    outcomes = await _run_members(_validate_batch_member, [
+        (file_path, filename, msg_id,
+         [members[other][1] for other in duplicates.get(msg_id, []) if other != index])
+        for index, ((file_path, filename), msg_id) in enumerate(zip(members, msg_ids))
+    ])
+
+    duplicate_end_to_end_ids = _flag_batch_end_to_end_ids(outcomes)
+
+    results = []
+    passed_count = failed_count = error_count = 0
+    for filename, payload, _, error in outcomes:
+        if error is not None:
+            error_count += 1
+            results.append({"status": "ERROR", "filename": filename, "error": error})
+            continue
+
+        if payload["status"] == "PASSED":
+            passed_count += 1
+        else:
+            failed_count += 1
+        results.append(payload)
+
+    return {
+        "summary": {
+            "total": len(members),
+            "passed": passed_count,
+            "failed": failed_count,
+            "errored": error_count,
+            "skipped": skipped,
+            "duplicate_message_ids": {
+                msg_id: [members[index][1] for index in indexes] for msg_id, indexes in duplicates.items()
+            },
+            "duplicate_end_to_end_ids": duplicate_end_to_end_ids,
+            "notes": [
+                "EndToEndIds repeated across files of the batch are reported in the results but not in the "
+                "files' CSV and HTML reports."
+            ] if duplicate_end_to_end_ids else [],
+            "elapsed_seconds": round(time.time() - start, 2),
+        },
+        "results": results,
+    }
@@ -0,0 +1,336 @@
+import hashlib
+import io
+import os
+import re
+import time
+import uuid
+
+from lxml import etree
+
+from utils.file_validation_util import (
+    IncrementalStreamPass,
+    Utf8Validator,
+    ValidationContext,
+    error_cap,
+    errors_to_collect,
+    feed_root_sniffer,
+    version_from_root,
+    validate_and_compare,
+    write_annotated_html,
+    write_individual_report,
+    get_version_from_filename,
+    get_version_from_xml,
+    render_xml_from_csv,
+    REPORTS_DIR,
+    SCHEMA_DIR,
+    STREAMING_THRESHOLD_BYTES,
+    VERSION_SNIFF_BYTES,
+)
+from utils.check_registry import check_registry
+from utils.time_budget import TimeBudget
+from pain001.xmlutils import DocumentLimits, XMLLimitError, PARSER_OPTIONS, XML_MAX_BYTES
+
+
+class FileValidationError(Exception):
+    """A validation request that cannot be processed; carries the HTTP status to answer with."""
+
+    def __init__(self, status_code: int, error: str):
+        super().__init__(status_code, error)
+        self.status_code = status_code
+        self.error = error
+
+
+def save_upload(source, file_path: str, max_bytes=XML_MAX_BYTES):
+    """Copies an upload to file_path; one over max_bytes raises FileValidationError (413)."""
+    size = 0
+    with open(file_path, "wb") as buffer:
+        while chunk := source.read(1024 * 1024):
+            size += len(chunk)
+            if size > max_bytes:
+                raise FileValidationError(413, f"File exceeds the limit of {max_bytes} bytes.")
+            buffer.write(chunk)
+
+
+def read_upload(source, spool_path: str):
+    """
+    The bytes of an upload, which is how files up to STREAMING_THRESHOLD_BYTES
+    are validated. A larger upload is written to spool_path for the streaming
+    validator instead and spool_path is returned; see discard_upload. An
+    upload over XML_MAX_BYTES raises FileValidationError (413).
+    """
+    buffer = io.BytesIO()
+    size = 0
+    f = None
+    try:
+        while chunk := source.read(1024 * 1024):
+            size += len(chunk)
+            if size > XML_MAX_BYTES:
+                raise FileValidationError(413, f"File exceeds the limit of {XML_MAX_BYTES} bytes.")
+            if f is None and size > STREAMING_THRESHOLD_BYTES:
+                f = open(spool_path, "wb")
+                f.write(buffer.getbuffer())
+                buffer = None
+            (f or buffer).write(chunk)
+    finally:
+        if f is not None:
+            f.close()
+    return spool_path if f is not None else buffer.getvalue()
+
+
+def discard_upload(source):
+    """Removes an upload that read_upload or IncrementalUpload spooled to disk."""
+    if isinstance(source, str) and os.path.exists(source):
+        os.remove(source)
+
+
+class UploadPass:
+    """Picklable outcome of an IncrementalUpload, handed to run_file_validation on the validation pool."""
+
+    def __init__(self, source, version, sha256, size, xsd_result, pass_results, elapsed_ms):
+        self.source = source  # the upload's bytes, or the path it was spooled to
+        self.version = version
+        self.sha256 = sha256
+        self.size = size
+        self.xsd_result = xsd_result
+        self.pass_results = pass_results
+        self.elapsed_ms = elapsed_ms
+
+
+class IncrementalUpload:
+    """
+    Validates an XML upload chunk by chunk while the request body is still
+    arriving. Each chunk is buffered and hashed; the version is sniffed from
+    the root element as soon as its start tag has arrived, after which the
+    chunks drive the streaming pass (XSD, well-formedness and every check that
+    needs a single element at a time). The UTF-8 check runs on the chunks too,
+    as do the XML_MAX_* size, depth and element limits. A malformed document,
+    one over a limit (413) or an undetectable version raises
+    FileValidationError from feed(), so the caller can refuse the upload
+    before reading the rest of it.
+
+    Like read_upload, the upload stays in memory unless it outgrows
+    STREAMING_THRESHOLD_BYTES, in which case it is spooled to spool_path.
+    max_errors and fail_fast cap the errors each check of the pass collects,
+    as validate_and_compare will.
+    """
+
+    def __init__(self, spool_path: str, filename: str, profile=None, max_errors=None, fail_fast=False):
+        self.spool_path = spool_path
+        self.filename = filename
+        self.profile = profile
+        self.max_errors = errors_to_collect(error_cap(max_errors, fail_fast))
+        self.version = None
+        self._buffer = io.BytesIO()
+        self._file = None
+        self._sha256 = hashlib.sha256()
+        self._utf8 = Utf8Validator()
+        self._limits = DocumentLimits()
+        self._size = 0
+        self._sniffer = etree.XMLPullParser(events=("start",), **PARSER_OPTIONS)
+        self._pass = None
+        self._elapsed = 0.0
+
+    def _write(self, chunk):
+        self._limits.feed(chunk)
+        if self._file is None and self._size + len(chunk) > STREAMING_THRESHOLD_BYTES:
+            self._file = open(self.spool_path, "wb")
+            self._file.write(self._buffer.getbuffer())
+            self._buffer = None
+        (self._file or self._buffer).write(chunk)
+        self._sha256.update(chunk)
+        self._utf8.feed(chunk)
+        self._size += len(chunk)
+
+    def _replay(self):
+        if self._file is None:
+            yield self._buffer.getvalue()
+            return
+        self._file.flush()
+        with open(self.spool_path, "rb") as f:
+            while data := f.read(1024 * 1024):
+                yield data
+
+    def _sniff(self, chunk):
+        root = feed_root_sniffer(self._sniffer, chunk)
+        if root is None:
+            if self._size >= VERSION_SNIFF_BYTES:
+                raise FileValidationError(400, "Could not determine version from XML.")
+            return
+        self.version = version_from_root(root, self.filename, self.filename)
+        if not self.version:
+            raise FileValidationError(400, "Could not determine version from XML.")
+        profile = self.profile
+        self._pass = IncrementalStreamPass(
+            os.path.join(SCHEMA_DIR, f"{self.version}.xsd"), self._replay,
+            profile.allowed_currencies if profile is not None else None,
+            profile.allowed_purpose_codes if profile is not None else None,
+            max_errors=self.max_errors,
+        )
+        for data in self._replay():
+            self._pass.feed(data)
+
+    def feed(self, chunk: bytes):
+        start = time.perf_counter()
+        try:
+            self._write(chunk)
+            if self._pass is None:
+                self._sniff(chunk)
+            else:
+                self._pass.feed(chunk)
+        except XMLLimitError as e:
+            raise FileValidationError(413, f"{e.msg}.")
+        except etree.XMLSyntaxError as e:
+            raise FileValidationError(400, f"Line {e.lineno} - XML is not well-formed: {e.msg}")
+        finally:
+            self._elapsed += time.perf_counter() - start
+
+    def finish(self) -> UploadPass:
+        """Called after the last chunk; closes the streaming pass and the spool file, if any."""
+        start = time.perf_counter()
+        try:
+            if self._pass is None:
+                raise FileValidationError(400, "Could not determine version from XML.")
+            try:
+                xsd_result, pass_results = self._pass.close()
+            except etree.XMLSyntaxError as e:
+                raise FileValidationError(400, f"Line {e.lineno} - XML is not well-formed: {e.msg}")
+        finally:
+            if self._file is not None:
+                self._file.close()
+        pass_results["utf8_encoding"] = self._utf8.close()
+        self._elapsed += time.perf_counter() - start
+        return UploadPass(
+            self.spool_path if self._file is not None else self._buffer.getvalue(), self.version,
+            self._sha256.hexdigest(), self._size, xsd_result, pass_results, round(self._elapsed * 1000, 3)
+        )
+
+    def discard(self):
+        if self._file is not None:
+            self._file.close()
+            discard_upload(self.spool_path)
+        self._buffer = None
+
+
+def run_file_validation(source, filename: str, seen_message_ids=None, company_id=None,
+                        seen_end_to_end_ids=None, checks=None, profile=None, upload_pass=None,
+                        budget=None, max_errors=None, fail_fast=False) -> dict:
+    """
+    Runs the full pipeline for one uploaded file: version detection, CSV to XML
+    generation, validation and report generation. This is the blocking part of
+    /files/validate and is meant to run on the validation pool, so it only takes
+    and returns picklable values.
+
+    source is the upload's bytes (see read_upload) or the path of a file on
+    disk. Bytes, and the XML generated from a CSV, are validated in memory;
+    the HTML and CSV reports are the only files written.
+
+    seen_message_ids and seen_end_to_end_ids optionally scope the duplicate
+    MsgId and EndToEndId checks to the caller; otherwise ids are recorded in
+    company_id's scope of the shared indexes (see validate_and_compare).
+
+    checks optionally names the registered checks to run and profile applies
+    a company validation profile; the response's checks map only reports the
+    checks that ran.
+
+    upload_pass is the UploadPass of an XML file that was validated while it
+    was uploaded; its version is used as is and only the remaining checks run.
+
+    budget is the run's TimeBudget (see validate_and_compare); the reports are
+    its last two stages. If any stage was skipped the status is INCOMPLETE and
+    skipped_stages lists them; a skipped report has no URL.
+
+    max_errors and fail_fast limit the errors collected and reported (see
+    validate_and_compare); truncated tells whether they cut anything. The
+    reports only ever hold the errors in the response.
+    """
+    budget = TimeBudget() if budget is None else budget
+    if profile is not None:
+        checks = profile.select_checks(checks)
+    selected = check_registry.select(checks)
+    ext = os.path.splitext(filename)[1].lower()
+    # Names the document in logs, duplicate id messages and the HTML report
+    document_name = source if isinstance(source, str) else f"{uuid.uuid4().hex}_{os.path.basename(filename)}"
+
+    # Get version
+    if ext == ".csv":
+        version = get_version_from_filename(filename)
+        if not version:
+            raise FileValidationError(400, "Could not determine version from filename.")
+        xml_data = render_xml_from_csv(source, version)
+        if xml_data is None:
+            raise FileValidationError(500, "Failed to generate XML from CSV.")
+        document_name = f"{os.path.splitext(os.path.basename(document_name))[0]}_{version}.xml"
+    else:
+        version = upload_pass.version if upload_pass is not None else get_version_from_xml(source, filename)
+        if not version:
+            raise FileValidationError(400, "Could not determine version from XML.")
+        xml_data = None if isinstance(source, str) else source
+
+    # Run validation
+    passed, errors, diffs, extra_info = validate_and_compare(
+        ValidationContext(document_name, data=xml_data), version, seen_message_ids, company_id, seen_end_to_end_ids,
+        [check.name for check in selected], profile=profile, upload_pass=upload_pass, budget=budget,
+        max_errors=max_errors, fail_fast=fail_fast
+    )
+
+    # Generate reports
+    html_path = csv_report_path = None
+    if budget.expired():
+        budget.skip("html_report")
+    else:
+        html_path = write_annotated_html(
+            document_name, errors, "See console summary", output_dir=REPORTS_DIR, xml_data=xml_data
+        )
+    if budget.expired():
+        budget.skip("csv_report")
+    else:
+        csv_report_path = write_individual_report(
+            os.path.basename(filename), version,
+            "CSV" if ext == ".csv" else "XML", passed, errors, diffs
+        )
+
+    # Build response
+    return {
+        "status": "INCOMPLETE" if budget.skipped else "PASSED" if passed else "FAILED",
+        "filename": filename,
+        "version": version,
+        "errors": parse_structured_errors(errors),
+        "info_messages": extra_info.get("info_messages", []),
+        "checks": {
+            label: extra_info.get(key)
+            for check in selected
+            for label, key in check.outputs.items()
+        },
+        "check_timings_ms": extra_info.get("check_timings_ms", {}),
+        "skipped_stages": list(budget.skipped),
+        "truncated": extra_info.get("truncated", False),
+        "html_report_url": f"/files/download/html/{os.path.basename(html_path)}" if html_path else None,
+        "csv_report_url": f"/files/download/csv/{os.path.basename(csv_report_path)}" if csv_report_path else None
+    }
+
+
+def parse_structured_errors(errors: list):
+    line_errors = []
+    additional_error_details = []
+
+    for err in errors:
+        match = re.search(r"Line (\d+)\s*-\s*(.*)", err)
+        if match:
+            line_no = int(match.group(1))
+            message = match.group(2).strip()
+            # Attempt to extract a value (like a duplicate ID or date) after "Found:"
+            found_match = re.search(r"Found: ([^.\n]*)", message)
+            found_value = found_match.group(1).strip() if found_match else None
+
+            line_errors.append({
+                "line_no": line_no,
+                "line_name": f"Line {line_no}",
+                "message": message,
+                "found": found_value
+            })
+        else:
+            additional_error_details.append(err.strip())
+    return {
+        "line_errors": line_errors,
+        "additional_error_details": additional_error_details
+    }
@@ -0,0 +1,92 @@
+import json
+import logging
+import os
+import uuid
+from datetime import datetime
+
+from redis.exceptions import RedisError
+
+from utils.redis_util import redis_client
+from utils.time_budget import TimeBudget
+from services.file_validation_service import run_file_validation, discard_upload, FileValidationError
+
+# Job records live in Redis so any API worker can answer a status poll,
+# whichever worker accepted the upload and whether or not that request is still open.
+JOB_KEY_PREFIX = "validation_job:"
+JOB_TTL_SECONDS = int(os.getenv("VALIDATION_JOB_TTL_SECONDS", 86400))
+
+# VALIDATION_JOB_TIME_BUDGET_SECONDS: time budget of one job, counted from when
+# it starts running; jobs have no client waiting, so it is longer than a request's
+JOB_TIME_BUDGET_SECONDS = float(os.getenv("VALIDATION_JOB_TIME_BUDGET_SECONDS", 900))
+
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_COMPLETED = "completed"
+JOB_FAILED = "failed"
+
+
+def _job_key(job_id: str) -> str:
+    return f"{JOB_KEY_PREFIX}{job_id}"
+
+
+def _save_job(job: dict):
+    redis_client.setex(_job_key(job["job_id"]), JOB_TTL_SECONDS, json.dumps(job))
+
+
+def get_job(job_id: str):
+    raw = redis_client.get(_job_key(job_id))
+    return json.loads(raw) if raw else None
+
+
+def update_job(job_id: str, **fields):
+    job = get_job(job_id) or {"job_id": job_id}
+    job.update(fields)
+    _save_job(job)
+    return job
+
+
+def _finish_job(job_id: str, **fields):
+    """Records how a job ended; with Redis unavailable it can only be logged."""
+    try:
+        update_job(job_id, finished_at=datetime.utcnow().isoformat(), **fields)
+    except RedisError:
+        logging.exception(f"Could not record the outcome of validation job {job_id}")
+
+
+def create_job(filename: str) -> dict:
+    job = {
+        "job_id": uuid.uuid4().hex,
+        "status": JOB_QUEUED,
+        "filename": filename,
+        "created_at": datetime.utcnow().isoformat(),
+        "started_at": None,
+        "finished_at": None,
+        "result": None,
+        "error": None,
+    }
+    _save_job(job)
+    return job
+
+
+def run_validation_job(job_id: str, source, filename: str, max_errors=None, fail_fast=False):
+    """
+    Pool entry point for a validation job. Records its own progress in Redis,
+    so it works the same from a thread or a separate worker process. source is
+    the upload's bytes or the path it was spooled to, which is removed after.
+    max_errors and fail_fast are passed on to run_file_validation.
+    """
+    try:
+        update_job(job_id, status=JOB_RUNNING, started_at=datetime.utcnow().isoformat())
+        result = run_file_validation(
+            source, filename, budget=TimeBudget(JOB_TIME_BUDGET_SECONDS), max_errors=max_errors, fail_fast=fail_fast
+        )
+    except FileValidationError as e:
+        _finish_job(job_id, status=JOB_FAILED, error={"status_code": e.status_code, "error": e.error})
+        return
+    except Exception as e:
+        logging.exception(f"Validation job {job_id} failed")
+        _finish_job(job_id, status=JOB_FAILED, error={"status_code": 500, "error": str(e)})
+        return
+    finally:
+        discard_upload(source)
+    _finish_job(job_id, status=JOB_COMPLETED, result=result)
@@ -0,0 +1,132 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from models.on_boarding_models import ClientUser, ValidationProfileSettings, ControlTotalApprovalSettings
+from utils.file_validation_util import check_registry
+
+# Profiles are invalidated in-process as soon as a ValidationProfileSettings row is
+# written; other API workers pick the change up once their copy expires.
+VALIDATION_PROFILE_TTL_SECONDS = int(os.getenv("VALIDATION_PROFILE_TTL_SECONDS", 300))
+
+
+class ValidationProfile:
+    """
+    The checks and code lists a company's files are validated with, and the
+    timezone its payment cutoffs are taken in. None for a field means the
+    platform default. Plain attributes only, so a profile can be handed to a
+    process pool worker.
+    """
+
+    def __init__(self, company_id=None, enabled_checks=None, allowed_currencies=None, allowed_purpose_codes=None,
+                 timezone=None):
+        self.company_id = company_id
+        self.timezone = timezone
+        self.enabled_checks = list(enabled_checks) if enabled_checks is not None else None
+        self.allowed_currencies = frozenset(c.upper() for c in allowed_currencies) if allowed_currencies is not None else None
+        self.allowed_purpose_codes = frozenset(allowed_purpose_codes) if allowed_purpose_codes is not None else None
+
+    def select_checks(self, requested=None):
+        """
+        Names of the checks to run: the profile's enabled checks (or every
+        enabled check), narrowed to the requested ones if given.
+        """
+        names = [check.name for check in check_registry.select(self.enabled_checks)]
+        if requested is not None:
+            wanted = set(requested)
+            names = [name for name in names if name in wanted]
+        return names
+
+    def fingerprint(self) -> str:
+        """Stable digest of the rules that change check results, for result cache keys."""
+        rules = {
+            "currencies": sorted(self.allowed_currencies) if self.allowed_currencies is not None else None,
+            "purpose_codes": sorted(self.allowed_purpose_codes) if self.allowed_purpose_codes is not None else None,
+        }
+        return hashlib.sha256(json.dumps(rules).encode("utf-8")).hexdigest()[:16]
+
+
+DEFAULT_PROFILE = ValidationProfile()
+
+_profiles = {}  # company_id -> (loaded_at, ValidationProfile)
+_profiles_lock = threading.Lock()
+
+
+def _profile_from_row(company_id, row, timezone=None) -> ValidationProfile:
+    if row is None:
+        return ValidationProfile(company_id=company_id, timezone=timezone)
+
+    enabled_checks = row.enabled_checks
+    if enabled_checks is not None:
+        known = set(check_registry.names())
+        unknown = [name for name in enabled_checks if name not in known]
+        if unknown:
+            logging.warning(f"Ignoring unknown checks {unknown} in validation preferences of company {company_id}")
+        enabled_checks = [name for name in enabled_checks if name in known] or None
+        if enabled_checks is None:
+            logging.warning(f"No known checks in validation preferences of company {company_id}; running every check")
+
+    return ValidationProfile(
+        company_id=company_id,
+        enabled_checks=enabled_checks,
+        allowed_currencies=row.allowed_currencies,
+        allowed_purpose_codes=row.allowed_purpose_codes,
+        timezone=timezone,
+    )
+
+
+def get_validation_profile(db: Session, company_id) -> ValidationProfile:
+    """
+    Returns the company's cached validation profile, loading it from
+    validation_profile_settings and control_total_approval_settings if needed.
+    """
+    if company_id is None:
+        return DEFAULT_PROFILE
+
+    now = time.time()
+    with _profiles_lock:
+        cached = _profiles.get(company_id)
+    if cached is not None and now - cached[0] < VALIDATION_PROFILE_TTL_SECONDS:
+        return cached[1]
+
+    row = db.query(ValidationProfileSettings).filter(ValidationProfileSettings.company_id == company_id).first()
+    timezone = db.query(ControlTotalApprovalSettings.timezone).filter(
+        ControlTotalApprovalSettings.company_id == company_id
+    ).scalar()
+    profile = _profile_from_row(company_id, row, timezone or None)
+    with _profiles_lock:
+        _profiles[company_id] = (now, profile)
+    return profile
+
+
+def invalidate_validation_profile(company_id=None):
+    """Drops one company's cached profile, or every profile when company_id is None."""
+    with _profiles_lock:
+        if company_id is None:
+            _profiles.clear()
+        else:
+            _profiles.pop(company_id, None)
+
+
+def get_company_id_for_user(db: Session, user):
+    """The company a client user belongs to, or None for anonymous and non-client users."""
+    if user is None:
+        return None
+    client_user = db.query(ClientUser).filter(ClientUser.user_id == user.id).first()
+    return client_user.company_id if client_user else None
+
+
+@event.listens_for(ValidationProfileSettings, "after_insert")
+@event.listens_for(ValidationProfileSettings, "after_update")
+@event.listens_for(ValidationProfileSettings, "after_delete")
+@event.listens_for(ControlTotalApprovalSettings, "after_insert")
+@event.listens_for(ControlTotalApprovalSettings, "after_update")
+@event.listens_for(ControlTotalApprovalSettings, "after_delete")
+def _preferences_changed(mapper, connection, target):
+    invalidate_validation_profile(target.company_id)
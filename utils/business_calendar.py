@@ -0,0 +1,151 @@
+import json
+import logging
+import os
+import threading
+from array import array
+from datetime import date, timedelta
+
+import holidays
+
+# BUSINESS_CALENDAR_YEARS_BACK / _AHEAD: whole years before and after the
+# current one that are precomputed; dates outside fall back to a direct lookup
+BUSINESS_CALENDAR_YEARS_BACK = int(os.getenv("BUSINESS_CALENDAR_YEARS_BACK", 1))
+BUSINESS_CALENDAR_YEARS_AHEAD = int(os.getenv("BUSINESS_CALENDAR_YEARS_AHEAD", 3))
+
+# PAYMENT_RAIL_CALENDARS: JSON object mapping a rail (CHK, WIRE, RTP, ACH,
+# OTHER) to the calendar its execution dates are checked against, e.g.
+# {"WIRE": "TARGET2"}. Rails not listed use US_FED.
+DEFAULT_RAIL_CALENDAR = "US_FED"
+RAIL_CALENDARS = {
+    "CHK": DEFAULT_RAIL_CALENDAR,
+    "WIRE": DEFAULT_RAIL_CALENDAR,
+    "RTP": DEFAULT_RAIL_CALENDAR,
+    "ACH": DEFAULT_RAIL_CALENDAR,
+    "OTHER": DEFAULT_RAIL_CALENDAR,
+    **json.loads(os.getenv("PAYMENT_RAIL_CALENDARS", "{}")),
+}
+
+# Days past the last precomputed year that are still walked, so the
+# next-business-day table has an answer for the last days of December
+_TAIL_DAYS = 31
+
+
+def _us_federal_reserve_holidays(years):
+    """
+    U.S. federal holidays as the Federal Reserve Banks observe them: a holiday
+    on Sunday is observed on Monday, but the banks stay open on the Friday
+    before a Saturday holiday.
+    """
+    observed = holidays.UnitedStates(years=years)
+    return {
+        day: name for day, name in observed.items()
+        if not (day.weekday() == 4 and name.endswith("(observed)"))
+    }
+
+
+def _target2_holidays(years):
+    """TARGET2 closing days as published by the ECB."""
+    return dict(holidays.financial_holidays("XECB", years=years))
+
+
+# name -> (label used in messages, function returning {date: holiday name} for a list of years)
+CALENDAR_SOURCES = {
+    "US_FED": ("U.S. federal holiday", _us_federal_reserve_holidays),
+    "TARGET2": ("TARGET2 holiday", _target2_holidays),
+}
+
+
+class BusinessCalendar:
+    """
+    Business days of one settlement calendar from first_year to last_year,
+    precomputed as a bitmap and a table of the distance from each day to the
+    next business day, so lookups and suggestions are a single index.
+    """
+
+    def __init__(self, name, first_year, last_year):
+        self.name = name
+        self.label, self._source = CALENDAR_SOURCES[name]
+        self.first_year = first_year
+        self.last_year = last_year
+        self.start = date(first_year, 1, 1)
+        days = (date(last_year, 12, 31) - self.start).days + 1 + _TAIL_DAYS
+
+        self._holidays = self._source(list(range(first_year, last_year + 2)))
+        self._business = bytearray(days)
+        for offset in range(days):
+            day = self.start + timedelta(days=offset)
+            self._business[offset] = day.weekday() < 5 and day not in self._holidays
+
+        # Walked backwards: the distance to the next business day on or after each day
+        self._next = array("H", bytes(2 * days))
+        distance = None
+        for offset in range(days - 1, -1, -1):
+            if self._business[offset]:
+                distance = 0
+            elif distance is not None:
+                distance += 1
+            self._next[offset] = distance if distance is not None else 0xFFFF
+
+    def _offset(self, day):
+        offset = (day - self.start).days
+        return offset if 0 <= offset < len(self._business) else None
+
+    def covers(self, day) -> bool:
+        return self._offset(day) is not None
+
+    def is_business_day(self, day) -> bool:
+        offset = self._offset(day)
+        if offset is None:
+            return day.weekday() < 5 and day not in self._source([day.year])
+        return bool(self._business[offset])
+
+    def holiday_name(self, day):
+        """Name of the holiday on day, or None if it is not a holiday in this calendar."""
+        if self._offset(day) is None:
+            return self._source([day.year]).get(day)
+        return self._holidays.get(day)
+
+    def next_business_day(self, day) -> date:
+        """day itself if it is a business day, otherwise the first business day after it."""
+        offset = self._offset(day)
+        if offset is not None and self._next[offset] != 0xFFFF:
+            return day + timedelta(days=self._next[offset])
+        while not self.is_business_day(day):
+            day += timedelta(days=1)
+        return day
+
+
+_calendars = {}
+_calendars_lock = threading.Lock()
+
+
+def get_business_calendar(name, today=None) -> BusinessCalendar:
+    """
+    The precomputed calendar, rebuilt when the year rolls over so the window
+    stays centred on the current year.
+    """
+    year = (today or date.today()).year
+    calendar = _calendars.get(name)
+    if calendar is None or calendar.first_year != year - BUSINESS_CALENDAR_YEARS_BACK:
+        with _calendars_lock:
+            calendar = _calendars.get(name)
+            if calendar is None or calendar.first_year != year - BUSINESS_CALENDAR_YEARS_BACK:
+                calendar = BusinessCalendar(
+                    name, year - BUSINESS_CALENDAR_YEARS_BACK, year + BUSINESS_CALENDAR_YEARS_AHEAD
+                )
+                _calendars[name] = calendar
+    return calendar
+
+
+def calendar_for_rail(rail, today=None) -> BusinessCalendar:
+    name = RAIL_CALENDARS.get(rail, DEFAULT_RAIL_CALENDAR)
+    if name not in CALENDAR_SOURCES:
+        logging.warning(f"Unknown business calendar '{name}' for {rail}; using {DEFAULT_RAIL_CALENDAR}")
+        name = DEFAULT_RAIL_CALENDAR
+    return get_business_calendar(name, today)
+
+
+def warm_business_calendars():
+    """Builds every calendar a rail uses, so the first upload does not pay for it."""
+    for rail in RAIL_CALENDARS:
+        calendar_for_rail(rail)
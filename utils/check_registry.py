@@ -0,0 +1,102 @@
+import os
+
+# VALIDATION_DISABLED_CHECKS: comma separated check names switched off for every request
+VALIDATION_DISABLED_CHECKS = [
+    name.strip() for name in os.getenv("VALIDATION_DISABLED_CHECKS", "").split(",") if name.strip()
+]
+
+# Result shapes a check can return, and how each is split into
+# (errors, info messages, values for the check's outputs)
+RESULT_SHAPES = {
+    # [errors]
+    "errors": lambda result: (result, [], [not result]),
+    # ([errors], [info])
+    "errors_info": lambda result: (result[0], result[1], [not result[0]]),
+    # ([errors], nboftxs_passed, ctrlsum_passed)
+    "control_totals": lambda result: (result[0], [], [result[1], result[2]]),
+    # ([errors], {rail: passed})
+    "payment_dates": lambda result: (result[0], [], [result[1]]),
+}
+
+
+class ValidationCheck:
+    """
+    One business check of the validation pipeline.
+
+    name:      key of the check in the pipeline results
+    run:       run(ctx) -> result, or (result, deferred) for checks with a complete step
+    shape:     one of RESULT_SHAPES
+    outputs:   {response label: extra_info key} for the values the shape yields
+    xpaths:    names of the utils.xpath_table entries the check reads
+    complete:  complete(result, deferred, state) -> result, for checks that depend on
+               state outside the file or on the current time; run on every validation,
+               including ones served from the result cache
+    in_stream_pass: whether stream_validate produces the result in its single pass;
+               otherwise run(ctx) is called separately in streaming mode too
+    complete_last: complete after every other check, with state["file_passed"] telling
+               whether the XSD step and every check passed so far
+    """
+
+    def __init__(self, name, run, shape, outputs=None, xpaths=(), complete=None, in_stream_pass=True,
+                 complete_last=False):
+        if shape not in RESULT_SHAPES:
+            raise ValueError(f"Invalid result shape for check {name}: {shape}")
+        self.name = name
+        self.run = run
+        self.shape = shape
+        self.outputs = dict(outputs or {})
+        self.xpaths = tuple(xpaths)
+        self.complete = complete
+        self.in_stream_pass = in_stream_pass
+        self.complete_last = complete_last
+        self.enabled = True
+
+    def summarize(self, result):
+        """Returns (errors, info messages, {extra_info key: value}) for a result of this check."""
+        errors, info, values = RESULT_SHAPES[self.shape](result)
+        return errors, info, dict(zip(self.outputs.values(), values))
+
+
+class CheckRegistry:
+    """Ordered set of validation checks; the order is the order errors are reported in."""
+
+    def __init__(self):
+        self._checks = {}
+
+    def register(self, check: ValidationCheck):
+        if check.name in self._checks:
+            raise ValueError(f"Check already registered: {check.name}")
+        check.enabled = check.name not in VALIDATION_DISABLED_CHECKS
+        self._checks[check.name] = check
+        return check
+
+    def get(self, name: str) -> ValidationCheck:
+        try:
+            return self._checks[name]
+        except KeyError:
+            raise ValueError(f"Unknown validation check: {name}") from None
+
+    def names(self) -> list:
+        return list(self._checks)
+
+    def enable(self, name: str):
+        self.get(name).enabled = True
+
+    def disable(self, name: str):
+        self.get(name).enabled = False
+
+    def select(self, names=None) -> list:
+        """
+        The checks to run, in registry order: every enabled check by default,
+        or exactly the named ones. Unknown names raise ValueError.
+        """
+        if names is None:
+            return [check for check in self._checks.values() if check.enabled]
+        wanted = {self.get(name).name for name in names}
+        return [check for check in self._checks.values() if check.name in wanted]
+
+    def __iter__(self):
+        return iter(self._checks.values())
+
+
+check_registry = CheckRegistry()
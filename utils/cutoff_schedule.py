@@ -0,0 +1,176 @@
+import json
+import logging
+import os
+import threading
+from array import array
+from datetime import date, datetime, time as dtime, timedelta
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+from utils.business_calendar import (
+    BUSINESS_CALENDAR_YEARS_BACK,
+    BUSINESS_CALENDAR_YEARS_AHEAD,
+    calendar_for_rail,
+)
+
+# CUTOFF_DEFAULT_TIMEZONE: IANA zone for companies without a timezone in
+# their control total approval settings
+CUTOFF_DEFAULT_TIMEZONE = os.getenv("CUTOFF_DEFAULT_TIMEZONE", "UTC")
+
+# RAIL_CUTOFF_WINDOWS: JSON object mapping a rail to its submission windows as
+# [["HH:MM", "HH:MM"], ...] in the company's local time; null means the rail
+# accepts submissions around the clock. ACH windows are the same-day ACH
+# windows and only apply to entries settling on the day they are submitted.
+RAIL_CUTOFF_WINDOWS = {
+    "WIRE": [["09:00", "17:00"]],
+    "RTP": None,
+    "ACH": [["00:00", "10:30"], ["10:30", "14:45"], ["14:45", "16:45"]],
+    **json.loads(os.getenv("RAIL_CUTOFF_WINDOWS", "{}")),
+}
+
+
+def _parse_windows(windows):
+    return [
+        (dtime.fromisoformat(start), dtime.fromisoformat(end)) for start, end in windows
+    ] if windows is not None else None
+
+
+_WINDOW_TIMES = {rail: _parse_windows(windows) for rail, windows in RAIL_CUTOFF_WINDOWS.items()}
+
+
+def describe_windows(rail) -> str:
+    """'09:00–17:00' for the rail's configured windows, adjacent windows merged."""
+    merged = []
+    for start, end in _WINDOW_TIMES.get(rail) or []:
+        if merged and merged[-1][1] == start:
+            merged[-1][1] = end
+        else:
+            merged.append([start, end])
+    return ", ".join(f"{start.strftime('%H:%M')}–{end.strftime('%H:%M')}" for start, end in merged)
+
+
+class CutoffSchedule:
+    """
+    Submission windows of every rail in one timezone, precomputed as UTC
+    epoch seconds for each local day of the business calendar window. The
+    local day of an instant is found from a table of local midnights, so a
+    CreDtTm is checked with an index and two comparisons, DST included.
+    """
+
+    def __init__(self, timezone, first_year, last_year):
+        self.timezone = timezone
+        self.zone = ZoneInfo(timezone)
+        self.first_year = first_year
+        self.start = date(first_year, 1, 1)
+        days = (date(last_year, 12, 31) - self.start).days + 1
+        calendar_day = date(first_year + BUSINESS_CALENDAR_YEARS_BACK, 1, 1)
+
+        # Local midnight of every day, plus the one after the last day
+        self._day_starts = array("q", (
+            int(datetime.combine(self.start + timedelta(days=offset), dtime(0), tzinfo=self.zone).timestamp())
+            for offset in range(days + 1)
+        ))
+
+        # rail -> per local day, the (open, close) epochs of its windows; empty on non-business days
+        self._windows = {}
+        for rail, windows in _WINDOW_TIMES.items():
+            if windows is None:
+                continue
+            calendar = calendar_for_rail(rail, calendar_day)
+            per_day = []
+            for offset in range(days):
+                day = self.start + timedelta(days=offset)
+                per_day.append(tuple(
+                    (self._epoch(day, start), self._epoch(day, end)) for start, end in windows
+                ) if calendar.is_business_day(day) else ())
+            self._windows[rail] = (calendar, per_day)
+
+    def _epoch(self, day, at):
+        return int(datetime.combine(day, at, tzinfo=self.zone).timestamp())
+
+    def _day_index(self, epoch):
+        index = int(epoch - self._day_starts[0]) // 86400
+        if index < 0 or index >= len(self._day_starts) - 1:
+            return None
+        # DST moves a local midnight by at most a few hours, so this steps once at most
+        if epoch < self._day_starts[index]:
+            index -= 1
+        elif epoch >= self._day_starts[index + 1]:
+            index += 1
+        return index if 0 <= index < len(self._day_starts) - 1 else None
+
+    def local_datetime(self, epoch) -> datetime:
+        return datetime.fromtimestamp(epoch, self.zone)
+
+    def local_date(self, epoch) -> date:
+        index = self._day_index(epoch)
+        if index is None:
+            return self.local_datetime(epoch).date()
+        return self.start + timedelta(days=index)
+
+    def _windows_of_day(self, rail, epoch):
+        """(calendar, windows of epoch's local day, local day); windows is None outside the table."""
+        calendar, per_day = self._windows[rail]
+        index = self._day_index(epoch)
+        if index is None:
+            return calendar, None, self.local_date(epoch)
+        return calendar, per_day[index], self.start + timedelta(days=index)
+
+    def in_window(self, rail, epoch) -> bool:
+        """Whether a submission at epoch falls inside one of the rail's windows; always true without cutoffs."""
+        if rail not in self._windows:
+            return True
+        calendar, windows, day = self._windows_of_day(rail, epoch)
+        if windows is None:
+            local = self.local_datetime(epoch).time()
+            return calendar.is_business_day(day) and any(
+                start <= local < end for start, end in _WINDOW_TIMES[rail]
+            )
+        return any(start <= epoch < end for start, end in windows)
+
+    def next_window_open(self, rail, epoch):
+        """Local datetime at which the rail's next window opens after epoch, or None without cutoffs."""
+        if rail not in self._windows:
+            return None
+        calendar, windows, day = self._windows_of_day(rail, epoch)
+        for start, _ in windows or ():
+            if start > epoch:
+                return self.local_datetime(start)
+        next_day = calendar.next_business_day(day + timedelta(days=1))
+        return datetime.combine(next_day, _WINDOW_TIMES[rail][0][0], tzinfo=self.zone)
+
+
+_schedules = {}
+_schedules_lock = threading.Lock()
+
+
+def get_cutoff_schedule(timezone=None, today=None) -> CutoffSchedule:
+    """
+    The cached schedule for an IANA timezone (CUTOFF_DEFAULT_TIMEZONE if None
+    or unknown), rebuilt when the year rolls over like the business calendars.
+    """
+    timezone = timezone or CUTOFF_DEFAULT_TIMEZONE
+    year = (today or date.today()).year
+    first_year = year - BUSINESS_CALENDAR_YEARS_BACK
+    schedule = _schedules.get(timezone)
+    if schedule is None or schedule.first_year != first_year:
+        with _schedules_lock:
+            schedule = _schedules.get(timezone)
+            if schedule is None or schedule.first_year != first_year:
+                try:
+                    schedule = CutoffSchedule(timezone, first_year, year + BUSINESS_CALENDAR_YEARS_AHEAD)
+                except (ZoneInfoNotFoundError, ValueError):
+                    if timezone == CUTOFF_DEFAULT_TIMEZONE:
+                        raise
+                    logging.warning(f"Unknown timezone '{timezone}'; using {CUTOFF_DEFAULT_TIMEZONE} cutoffs")
+                    schedule = _schedules.get(CUTOFF_DEFAULT_TIMEZONE)
+                    if schedule is None or schedule.first_year != first_year:
+                        schedule = CutoffSchedule(
+                            CUTOFF_DEFAULT_TIMEZONE, first_year, year + BUSINESS_CALENDAR_YEARS_AHEAD
+                        )
+                        _schedules[CUTOFF_DEFAULT_TIMEZONE] = schedule
+                _schedules[timezone] = schedule
+    return schedule
+
+
+def warm_cutoff_schedules():
+    get_cutoff_schedule()
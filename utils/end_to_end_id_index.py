@@ -0,0 +1,293 @@
+import hashlib
+import os
+import threading
+import time
+
+import numpy as np
+
+from utils.redis_util import redis_client, REDIS_CONFIGURED
+
+# E2E_INDEX_BACKEND: "redis" (shared by every worker) or "memory" (process-local);
+# defaults to redis only when REDIS_HOST is set
+# E2E_WINDOW_DAYS: how far back an EndToEndId counts as a resubmission
+# E2E_RECORD_FAILED_FILES: also record the ids of files that fail validation;
+# by default they are only looked up, so a corrected file can be resubmitted
+E2E_INDEX_BACKEND = os.getenv("E2E_INDEX_BACKEND", "redis" if REDIS_CONFIGURED else "memory")
+E2E_WINDOW_DAYS = int(os.getenv("E2E_WINDOW_DAYS", 30))
+E2E_RECORD_FAILED_FILES = os.getenv("E2E_RECORD_FAILED_FILES", "false").lower() == "true"
+
+DEFAULT_SCOPE = "default"
+
+# Fewest new ids the in-memory index collects before merging them into its
+# sorted day columns
+_DELTA_MIN_IDS = 65536
+
+# Looks every EndToEndId up in the current and previous generation hashes and,
+# unless ARGV[5] is 0, stores the ones not seen within the window, all in one
+# call so two workers cannot both accept the same id.
+#
+# KEYS: current hash, current files hash, previous hash, previous files hash
+# ARGV: today, window days, filename, ttl, record (1 or 0), then digest/line pairs
+# Hash values are "<day>:<file ref>:<line>"; file refs resolve through the
+# files hash of the same generation so filenames are stored once per file.
+_RECORD_SCRIPT = """
+local today = tonumber(ARGV[1])
+local oldest = today - tonumber(ARGV[2]) + 1
+local record = ARGV[5] == '1'
+local ref = 0
+if record then
+    ref = redis.call('HINCRBY', KEYS[2], '#', 1)
+    redis.call('HSET', KEYS[2], ref, ARGV[3])
+end
+
+local hits = {}
+local fresh = {}
+for i = 6, #ARGV, 2 do
+    local found = false
+    for g = 0, 1 do
+        local value = redis.call('HGET', KEYS[1 + g * 2], ARGV[i])
+        if value then
+            local day, earlier_ref, line = string.match(value, '^(%d+):(%d+):(%d+)$')
+            if tonumber(day) >= oldest then
+                local earlier_file = redis.call('HGET', KEYS[2 + g * 2], earlier_ref) or ''
+                table.insert(hits, (i - 4) / 2)
+                table.insert(hits, earlier_file)
+                table.insert(hits, line)
+                found = true
+                break
+            end
+        end
+    end
+    if record and not found then
+        table.insert(fresh, ARGV[i])
+        table.insert(fresh, today .. ':' .. ref .. ':' .. ARGV[i + 1])
+    end
+end
+
+if record then
+    -- unpack() is limited by the Lua stack, so write in chunks
+    for i = 1, #fresh, 2000 do
+        redis.call('HSET', KEYS[1], unpack(fresh, i, math.min(i + 1999, #fresh)))
+    end
+    redis.call('EXPIRE', KEYS[1], ARGV[4])
+    redis.call('EXPIRE', KEYS[2], ARGV[4])
+end
+return hits
+"""
+
+
+def _scope(company_id) -> str:
+    return DEFAULT_SCOPE if company_id is None else str(company_id)
+
+
+def _digest(end_to_end_id: str) -> bytes:
+    # 8 bytes per id instead of up to 35 characters; collisions are negligible
+    # at tens of millions of ids per company
+    return hashlib.blake2b(end_to_end_id.encode("utf-8"), digest_size=8).digest()
+
+
+def _unique_entries(entries):
+    """Keeps the first line of each EndToEndId; repeats inside a file are reported by the in-file check."""
+    unique = {}
+    for end_to_end_id, line in entries:
+        unique.setdefault(end_to_end_id, line)
+    return list(unique.items())
+
+
+class EndToEndIdScope:
+    """A company's view of an index; this is what the validators record EndToEndIds against."""
+
+    def __init__(self, index, company_id=None):
+        self.index = index
+        self.company_id = company_id
+
+    def record_many(self, filename: str, entries) -> dict:
+        return self.index.record_many(filename, entries, self.company_id)
+
+    def lookup_many(self, entries) -> dict:
+        return self.index.lookup_many(entries, self.company_id)
+
+
+class InMemoryEndToEndIdIndex:
+    """
+    Process-local EndToEndId index with the same rolling window as the Redis
+    index. Each day's ids are kept as two sorted numpy columns, the 64-bit
+    digest and (file ref, line), so a million ids cost roughly 16 MB. New ids
+    collect in a small dict per company that is merged into the day columns
+    once it grows past _DELTA_MIN_IDS or a sixteenth of the ids stored.
+    """
+
+    def __init__(self, window_days=E2E_WINDOW_DAYS):
+        self.window_days = window_days
+        self._days = {}  # scope -> {day: (sorted digests, file ref << 32 | line)}, both uint64
+        self._delta = {}  # scope -> {digest: day << 64 | file ref << 32 | line}, not merged yet
+        self._files = {}  # scope -> {file ref: (day, filename)}
+        self._next_ref = 0
+        self._pruned_day = None
+        self._lock = threading.Lock()
+
+    def record_many(self, filename: str, entries, company_id=None) -> dict:
+        """
+        Records (EndToEndId, line) entries for filename and returns
+        {EndToEndId: (earlier filename, earlier line)} for ids already used
+        within the window.
+        """
+        return self._match(entries, company_id, filename)
+
+    def lookup_many(self, entries, company_id=None) -> dict:
+        """Like record_many, but the ids are only looked up."""
+        return self._match(entries, company_id)
+
+    def _match(self, entries, company_id, filename=None):
+        scope = _scope(company_id)
+        today = int(time.time() // 86400)
+        entries = _unique_entries(entries)
+        digests = np.fromiter(
+            (int.from_bytes(_digest(end_to_end_id), "big") for end_to_end_id, _ in entries), np.uint64, len(entries)
+        )
+        found = {}
+        with self._lock:
+            if self._pruned_day != today:
+                self._prune(today - self.window_days + 1)
+                self._pruned_day = today
+            days = self._days.setdefault(scope, {})
+            delta = self._delta.setdefault(scope, {})
+            files = self._files.setdefault(scope, {})
+            if filename is not None:
+                self._next_ref += 1
+                ref = self._next_ref
+                files[ref] = (today, filename)
+
+            # Every live day and the delta hold an id at most once between them
+            earlier = np.zeros(len(entries), np.uint64)
+            seen = np.zeros(len(entries), bool)
+            for day_digests, day_values in days.values():
+                at = np.minimum(np.searchsorted(day_digests, digests), len(day_digests) - 1)
+                hit = day_digests[at] == digests
+                earlier[hit] = day_values[at[hit]]
+                seen |= hit
+
+            for (end_to_end_id, line), digest, hit, packed in zip(
+                    entries, digests.tolist(), seen.tolist(), earlier.tolist()):
+                if not hit:
+                    packed = delta.get(digest)
+                    if packed is None:
+                        if filename is not None:
+                            line_no = line if isinstance(line, int) else 0
+                            delta[digest] = today << 64 | ref << 32 | line_no
+                        continue
+                found[end_to_end_id] = (files[(packed >> 32) & 0xFFFFFFFF][1], packed & 0xFFFFFFFF)
+
+            if len(delta) >= max(_DELTA_MIN_IDS, sum(len(d) for d, _ in days.values()) // 16):
+                self._merge(scope)
+        return found
+
+    def _merge(self, scope):
+        """Moves the delta of scope into the sorted day columns."""
+        days = self._days[scope]
+        by_day = {}
+        for digest, packed in self._delta[scope].items():
+            by_day.setdefault(packed >> 64, []).append((digest, packed & 0xFFFFFFFFFFFFFFFF))
+        for day, items in by_day.items():
+            added = np.array(items, np.uint64).reshape(-1, 2)
+            day_digests, day_values = days.get(day, (added[:0, 0], added[:0, 1]))
+            day_digests = np.concatenate((day_digests, added[:, 0]))
+            day_values = np.concatenate((day_values, added[:, 1]))
+            order = np.argsort(day_digests, kind="stable")
+            days[day] = (day_digests[order], day_values[order])
+        self._delta[scope] = {}
+
+    def _prune(self, oldest):
+        for scope, days in self._days.items():
+            for day in [day for day in days if day < oldest]:
+                del days[day]
+            delta = self._delta[scope]
+            for digest in [digest for digest, packed in delta.items() if packed >> 64 < oldest]:
+                del delta[digest]
+            files = self._files[scope]
+            for ref in [ref for ref, (day, _) in files.items() if day < oldest]:
+                del files[ref]
+
+    def for_company(self, company_id=None) -> EndToEndIdScope:
+        return EndToEndIdScope(self, company_id)
+
+    def clear(self):
+        with self._lock:
+            self._days.clear()
+            self._delta.clear()
+            self._files.clear()
+
+    def close(self):
+        pass
+
+
+class RedisEndToEndIdIndex:
+    """
+    EndToEndId index shared by every API worker through Redis.
+
+    Ids live in one hash per company and window-sized generation
+    (e2e:<company>:<generation>), keyed by an 8-byte digest. A lookup checks
+    the current and previous generation and filters by the stored day, which
+    gives an exact rolling window while whole generations simply expire. A
+    file's ids are checked and recorded in a single script call.
+    """
+
+    KEY_PREFIX = "e2e:"
+
+    def __init__(self, client=redis_client, window_days=E2E_WINDOW_DAYS):
+        self.client = client
+        self.window_days = window_days
+        self._record_script = client.register_script(_RECORD_SCRIPT)
+
+    def _keys(self, scope, generation):
+        keys = []
+        for g in (generation, generation - 1):
+            keys += [f"{self.KEY_PREFIX}{scope}:{g}", f"{self.KEY_PREFIX}{scope}:{g}:files"]
+        return keys
+
+    def record_many(self, filename: str, entries, company_id=None) -> dict:
+        """
+        Records (EndToEndId, line) entries for filename and returns
+        {EndToEndId: (earlier filename, earlier line)} for ids already used
+        within the window.
+        """
+        return self._match(entries, company_id, filename)
+
+    def lookup_many(self, entries, company_id=None) -> dict:
+        """Like record_many, but the ids are only looked up."""
+        return self._match(entries, company_id)
+
+    def _match(self, entries, company_id, filename=None):
+        entries = _unique_entries(entries)
+        if not entries:
+            return {}
+        today = int(time.time() // 86400)
+        generation = today // self.window_days
+        args = [today, self.window_days, filename or "", self.window_days * 2 * 86400, int(filename is not None)]
+        for end_to_end_id, line in entries:
+            args += [_digest(end_to_end_id), line if isinstance(line, int) else 0]
+
+        hits = self._record_script(keys=self._keys(_scope(company_id), generation), args=args)
+        found = {}
+        for i in range(0, len(hits), 3):
+            end_to_end_id = entries[int(hits[i]) - 1][0]
+            found[end_to_end_id] = (hits[i + 1], int(hits[i + 2]))
+        return found
+
+    def for_company(self, company_id=None) -> EndToEndIdScope:
+        return EndToEndIdScope(self, company_id)
+
+    def close(self):
+        # Every record is written synchronously; the shared client stays open for its other users
+        pass
+
+
+def create_end_to_end_id_index(backend=E2E_INDEX_BACKEND):
+    if backend == "redis":
+        return RedisEndToEndIdIndex()
+    if backend == "memory":
+        return InMemoryEndToEndIdIndex()
+    raise ValueError(f"Invalid EndToEndId index backend: {backend}")
+
+
+end_to_end_id_index = create_end_to_end_id_index()
@@ -3,15 +3,34 @@ import os
 sys.path.append(os.path.abspath(os.path.dirname(__file__)))
 
 import re
+import io
 import csv
+import mmap
+import codecs
+import hashlib
 import zipfile
 import logging
 from lxml import etree
 from xmldiff import main as xmldiff
-from pain001.xmlutils import validate
+from pain001.xmlutils import (
+    validate, validate_tree, get_schema, parse_document, DocumentLimits, LimitedReader, XMLLimitError, PARSER_OPTIONS
+)
+from utils.message_id_index import message_id_index
+from utils.end_to_end_id_index import end_to_end_id_index, E2E_RECORD_FAILED_FILES
+from utils.result_cache import result_cache, file_sha256, RESULT_CACHE_ENABLED
+from utils.check_registry import ValidationCheck, check_registry
+from utils.xpath_table import get_xpath_table, version_of_namespace
+from utils.iban_util import iban_mod97, iban_problem, describe_iban_problem
+from utils.business_calendar import calendar_for_rail
+from utils.cutoff_schedule import get_cutoff_schedule, describe_windows
+from utils.reference_data import get_reference_data
+from utils.time_budget import TimeBudget, BudgetExceeded
+from utils.transaction_columns import (
+    PaymentBlock, extract_transaction_columns, distinct_values, first_occurrences, parse_amount, sum_amounts,
+    sum_amounts_by_block, scaled_to_decimal, format_amount, not_in
+)
 from jinja2 import Template
 import time
-from holidays import UnitedStates
 from colorama import Fore, Style, init
 from datetime import datetime, timedelta, time as dtime
 init(autoreset=True)
@@ -27,10 +46,19 @@ ENABLE_CONSOLE_SUMMARY = True
 ENABLE_ZIP_EXPORT = False
 LOG_LEVEL = logging.INFO
 ALLOW_VERSION_PROMPT = True
+# Bytes read from the start of an upload to find the root element's namespace
+VERSION_SNIFF_BYTES = int(os.getenv("VERSION_SNIFF_BYTES", 65536))
+XSI_NAMESPACE = "http://www.w3.org/2001/XMLSchema-instance"
 SKIP_LOG_TO_TXT = True
 RUN_SESSION_LOG_TO_TXT = True
 ENABLE_XML_DIFF = False
+# Bump whenever a check's rules change so cached results from the old rules are not reused
+VALIDATION_RULESET_VERSION = os.getenv("VALIDATION_RULESET_VERSION", "1")
 ENABLE_HTML_ANNOTATION = True  # New config: Controls whether annotated HTML is generated
+# Files larger than this are validated with the bounded-memory streaming validator
+STREAMING_THRESHOLD_BYTES = int(os.getenv("PAIN001_STREAMING_THRESHOLD_MB", "50")) * 1024 * 1024
+# Bytes decoded at a time by the UTF-8 encoding check
+UTF8_CHECK_CHUNK_BYTES = 1024 * 1024
 
 # Setup logging
 logging.basicConfig(
@@ -43,11 +71,129 @@ logging.basicConfig(
 )
 
 os.makedirs(REPORTS_DIR, exist_ok=True)
-seen_message_ids = {}
+
 html_files_generated = []
 
 # Helpers
 
+class ValidationContext:
+    """
+    Parses a pain.001 document once and shares the tree and namespace map
+    with the XSD step and every business check of a single validation run.
+    Parsing is lazy, so a parse failure surfaces inside whichever check
+    touches the tree first, exactly as it did when each check parsed itself.
+    xpaths is the compiled XPath table for the document's namespace and
+    transactions the column extraction shared by the amount and code checks.
+
+    reference is the reference data snapshot every check of the run uses;
+    allowed_currencies and allowed_purpose_codes narrow its code lists for the
+    currency and purpose code checks (see the company validation profile).
+
+    data optionally holds the document's bytes; nothing is then read from
+    disk and xml_path only names the document in logs and reports.
+
+    budget is the run's TimeBudget, if any; parsing checks it between blocks.
+    max_errors caps the errors each check collects (None for all, see
+    errors_to_collect) and fail_fast stops the run at the first check that fails.
+    """
+
+    def __init__(self, xml_path, allowed_currencies=None, allowed_purpose_codes=None, data=None):
+        self.xml_path = xml_path
+        self.data = data
+        self.reference = get_reference_data()
+        self.allowed_currencies = self.reference.currencies if allowed_currencies is None else allowed_currencies
+        self.allowed_purpose_codes = self.reference.purpose_codes if allowed_purpose_codes is None else allowed_purpose_codes
+        self._tree = None
+        self._ns = None
+        self._xpaths = None
+        self._transactions = None
+        self._parse_error = None
+        self.budget = None
+        self.max_errors = None
+        self.fail_fast = False
+
+    @property
+    def tree(self):
+        if self._tree is None:
+            if self._parse_error is not None:
+                raise self._parse_error
+            try:
+                with self.open() as source:
+                    self._tree = parse_document(source, self.xml_path, self.budget_check())
+            except Exception as e:
+                self._parse_error = e
+                raise
+        return self._tree
+
+    @property
+    def root(self):
+        return self.tree.getroot()
+
+    def budget_check(self):
+        return self.budget.check if self.budget is not None else None
+
+    def open(self):
+        """A binary file object over the document, from memory or from disk."""
+        return open_source(self.data if self.data is not None else self.xml_path)
+
+    def exists(self):
+        return self.data is not None or os.path.exists(self.xml_path)
+
+    def size(self):
+        return len(self.data) if self.data is not None else os.path.getsize(self.xml_path)
+
+    def sha256(self):
+        return hashlib.sha256(self.data).hexdigest() if self.data is not None else file_sha256(self.xml_path)
+
+    @property
+    def ns(self):
+        if self._ns is None:
+            self._ns = {'ns': self.root.nsmap[None]}
+        return self._ns
+
+    @property
+    def xpaths(self):
+        if self._xpaths is None:
+            self._xpaths = get_xpath_table(self.ns['ns'])
+        return self._xpaths
+
+    @property
+    def transactions(self):
+        if self._transactions is None:
+            self._transactions = extract_transaction_columns(self.root, self.ns['ns'])
+        return self._transactions
+
+
+def open_source(source):
+    """A binary file object over source, a file path or the document's bytes."""
+    return io.BytesIO(source) if isinstance(source, (bytes, bytearray)) else open(source, "rb")
+
+
+def error_cap(max_errors=None, fail_fast=False):
+    """Errors each check reports: max_errors, only the first with fail_fast, otherwise all (None)."""
+    return max_errors if max_errors is not None else 1 if fail_fast else None
+
+
+def errors_to_collect(cap):
+    """
+    Errors each check collects for a report capped at cap: one more, so the
+    report is only marked truncated when an error was actually left out.
+    """
+    return None if cap is None else cap + 1
+
+
+def _full(errors, limit):
+    """Whether a check has collected as many errors as limit allows; later ones are not even formatted."""
+    return limit is not None and len(errors) >= limit
+
+
+def as_validation_context(xml_path):
+    """Accepts either a file path or an existing ValidationContext."""
+    if isinstance(xml_path, ValidationContext):
+        return xml_path
+    return ValidationContext(xml_path)
+
+
 def log_check_result(f, description, passed):
     if f:
         if passed:
@@ -62,19 +208,7 @@ def log_check_result(f, description, passed):
 
 def iban_checksum_is_valid(iban):
     """Validate IBAN using ISO 13616 checksum rules."""
-    # 1. Move the four initial characters to the end of the string
-    rearranged = iban[4:] + iban[:4]
-    
-    # 2. Replace each letter in the string with two digits
-    numeric_iban = ''
-    for ch in rearranged:
-        if ch.isdigit():
-            numeric_iban += ch
-        else:
-            numeric_iban += str(ord(ch.upper()) - 55)
-    
-    # 3. Interpret the string as a decimal integer and compute the remainder of that number on division by 97
-    return int(numeric_iban) % 97 == 1
+    return iban_mod97(iban) == 1
 
 
 def aba_routing_mod10_check(value):
@@ -88,9 +222,8 @@ def check_member_id(xml_path):
     errors = []
     info = []
     try:
-        tree = etree.parse(xml_path)
-        ns = {'ns': tree.getroot().nsmap[None]}
-        mmbid_nodes = tree.findall('.//ns:DbtrAgt/ns:FinInstnId/ns:ClrSysMmbId/ns:MmbId', namespaces=ns)
+        ctx = as_validation_context(xml_path)
+        mmbid_nodes = ctx.xpaths.findall("debtor_agent_mmbid", ctx.tree)
         if not mmbid_nodes:
             info.append("No Member IDs (MmbId) found.")
         else:
@@ -99,85 +232,160 @@ def check_member_id(xml_path):
                 if not mmbid.isdigit():
                     line = node.sourceline if node is not None else "Unknown"
                     errors.append(f"Line {line} - Member ID (MmbId) is not numeric: {mmbid}")
+                    if _full(errors, ctx.max_errors):
+                        break
 
     except Exception as e:
         errors.append(f"Error during Member ID check: {str(e)}")
     return errors, info
 
-def check_duplicate_end_to_end_id(xml_path):
+def record_end_to_end_ids(first_lines, seen_end_to_end_ids, current_filename, max_errors=None, record=True):
+    """
+    Registers a file's EndToEndIds (id -> first line) and reports those already
+    used by an earlier file, at most max_errors of them; every id is registered.
+    With record=False the ids are only looked up.
+    """
+    errors = []
+    if record:
+        earlier = seen_end_to_end_ids.record_many(current_filename, first_lines.items())
+    else:
+        earlier = seen_end_to_end_ids.lookup_many(first_lines.items())
+    for end_to_end_id, (earlier_file, earlier_line) in earlier.items():
+        if _full(errors, max_errors):
+            break
+        errors.append(
+            f"Line {first_lines[end_to_end_id]} - EndToEndId '{end_to_end_id}' was already submitted "
+            f"in file '{earlier_file}' (Line {earlier_line})."
+        )
+    return errors
+
+def find_end_to_end_ids(xml_path):
+    """Returns (first line of each EndToEndId, in-file duplicate errors, info)."""
     errors = []
     info = []
+    seen_ids = {}
     try:
-        tree = etree.parse(xml_path)
-        ns = {'ns': tree.getroot().nsmap[None]}
-        seen_ids = {}
-
-        end_to_end_nodes = tree.findall('.//ns:CdtTrfTxInf/ns:PmtId/ns:EndToEndId', namespaces=ns)
-        if not end_to_end_nodes:
+        ctx = as_validation_context(xml_path)
+        columns = ctx.transactions
+        ids, lines = columns.end_to_end_ids.tolist(), columns.end_to_end_lines
+        if not ids:
             info.append("No EndToEndId elements found in file.")
-        
-        for node in end_to_end_nodes:
-            end_to_end_id = node.text.strip()
-            line = node.sourceline if node is not None else "Unknown"
 
-            if end_to_end_id in seen_ids:
-                errors.append(f"Line {line} - Duplicate EndToEndId '{end_to_end_id}' found (also at Line {seen_ids[end_to_end_id]}).")
-            else:
-                seen_ids[end_to_end_id] = line
+        first, repeated = first_occurrences(columns.end_to_end_ids)
+        seen_ids = {ids[i]: lines[i] for i in first.tolist()}
+        for i in repeated[:ctx.max_errors].tolist():
+            errors.append(f"Line {lines[i]} - Duplicate EndToEndId '{ids[i]}' found (also at Line {seen_ids[ids[i]]}).")
 
     except Exception as e:
         errors.append(f"Error during Duplicate EndToEndId check: {str(e)}")
     
+    return seen_ids, errors, info
+
+def check_duplicate_end_to_end_id(xml_path, seen_end_to_end_ids=None, current_filename=None):
+    first_lines, errors, info = find_end_to_end_ids(xml_path)
+    # Resubmissions from earlier files, one index call for the whole file
+    if seen_end_to_end_ids is not None and first_lines:
+        try:
+            errors.extend(record_end_to_end_ids(first_lines, seen_end_to_end_ids, current_filename))
+        except Exception as e:
+            errors.append(f"Error during Duplicate EndToEndId check: {str(e)}")
     return errors, info
 
 
-def check_total_file_control(xml_path):
+def compare_control_totals(nb_of_txs_declared, line_nb, ctrl_sum_declared, line_ctrl, nb_of_txs_actual, sum_of_amounts,
+                           scope=None):
+    """
+    Compares the declared NbOfTxs/CtrlSum against the counted transactions and
+    the exact (Decimal) sum of their amounts. scope names the PmtInf the totals
+    belong to; None means the group header totals of the whole file.
+    """
     errors = []
     nboftxs_passed = True
     ctrlsum_passed = True
-    try:
-        tree = etree.parse(xml_path)
-        root = tree.getroot()
-        ns = {'ns': root.nsmap[None]}
+    found_in = "in the file" if scope is None else f"in {scope}"
+    amounts_of = "transaction amounts" if scope is None else f"the transaction amounts of {scope}"
+
+    # NbOfTxs Check
+    if nb_of_txs_declared:
+        if int(nb_of_txs_declared) != nb_of_txs_actual:
+            errors.append(f"Line {line_nb} - NbOfTxs mismatch: Declared {nb_of_txs_declared}, Found {nb_of_txs_actual} transactions {found_in}.")
+            nboftxs_passed = False
+
+    # CtrlSum Check
+    if ctrl_sum_declared:
+        declared = parse_amount(ctrl_sum_declared)
+        if declared is None:
+            raise ValueError(f"could not convert CtrlSum to an amount: '{ctrl_sum_declared}'")
+        declared_sum = scaled_to_decimal(declared)
+        if declared_sum <= 0:
+            errors.append(f"Line {line_ctrl} - CtrlSum must be greater than 0. Found: {format_amount(declared_sum)}")
+            ctrlsum_passed = False
+        if declared_sum != sum_of_amounts:
+            errors.append(f"Line {line_ctrl} - CtrlSum mismatch: Declared {format_amount(declared_sum)}, Calculated {format_amount(sum_of_amounts)} from {amounts_of}.")
+            ctrlsum_passed = False
 
-        nb_of_txs_element = tree.find('.//ns:NbOfTxs', namespaces=ns)
-        nb_of_txs_declared = nb_of_txs_element.text.strip() if nb_of_txs_element is not None else None
+    return errors, nboftxs_passed, ctrlsum_passed
 
-        ctrl_sum_element = tree.find('.//ns:CtrlSum', namespaces=ns)
-        ctrl_sum_declared = ctrl_sum_element.text.strip() if ctrl_sum_element is not None else None
+def compare_control_levels(group_header, file_totals, block_totals):
+    """
+    Runs compare_control_totals for the group header against file_totals and
+    for every PaymentBlock against its own (count, sum) in block_totals.
+    Returns the combined ([errors], nboftxs_passed, ctrlsum_passed).
+    """
+    errors = []
+    nboftxs_passed = True
+    ctrlsum_passed = True
+    levels = [(group_header, file_totals, None)]
+    for block, totals in block_totals:
+        scope = f"PmtInf '{block.pmtinf_id}'" if block.pmtinf_id else f"PmtInf at Line {block.line}"
+        levels.append((block, totals, scope))
+
+    for declared, (nb_of_txs_actual, sum_of_amounts), scope in levels:
+        nb_text, line_nb = declared.nb_of_txs or (None, "Unknown")
+        ctrl_text, line_ctrl = declared.ctrl_sum or (None, "Unknown")
+        try:
+            level_errors, nb_passed, ctrl_passed = compare_control_totals(
+                nb_text, line_nb, ctrl_text, line_ctrl, nb_of_txs_actual, sum_of_amounts, scope
+            )
+        except Exception as e:
+            where = "" if scope is None else f" of {scope}"
+            level_errors, nb_passed, ctrl_passed = [f"Error during total file control check{where}: {str(e)}"], False, False
+        errors.extend(level_errors)
+        nboftxs_passed = nboftxs_passed and nb_passed
+        ctrlsum_passed = ctrlsum_passed and ctrl_passed
 
-        instd_amt_nodes = tree.findall('.//ns:CdtTrfTxInf/ns:Amt/ns:InstdAmt', namespaces=ns)
+    return errors, nboftxs_passed, ctrlsum_passed
 
-        nb_of_txs_actual = len(instd_amt_nodes)
-        sum_of_amounts = 0.0
-        for node in instd_amt_nodes:
-            try:
-                amount = float(node.text.strip())
-                if amount <= 0:
-                    line = node.sourceline if node is not None else "Unknown"
-                    errors.append(f"Line {line} - InstdAmt must be greater than 0. Found: {amount}")
-                sum_of_amounts += amount
-            except Exception:
-                errors.append("Invalid amount format in one of the <InstdAmt> fields.")
+def check_total_file_control(xml_path):
+    """
+    NbOfTxs and CtrlSum of the group header against the whole file and of
+    every PmtInf against its own transactions, all from one column walk.
+    """
+    errors = []
+    nboftxs_passed = True
+    ctrlsum_passed = True
+    try:
+        ctx = as_validation_context(xml_path)
+        columns = ctx.transactions
 
-        # NbOfTxs Check
-        if nb_of_txs_declared:
-            if int(nb_of_txs_declared) != nb_of_txs_actual:
-                line_nb = nb_of_txs_element.sourceline if nb_of_txs_element is not None else "Unknown"
-                errors.append(f"Line {line_nb} - NbOfTxs mismatch: Declared {nb_of_txs_declared}, Found {nb_of_txs_actual} transactions in the file.")
-                nboftxs_passed = False
-
-        # CtrlSum Check
-        if ctrl_sum_declared:
-            declared_sum = float(ctrl_sum_declared)
-            if declared_sum <= 0:
-                line_ctrl = ctrl_sum_element.sourceline if ctrl_sum_element is not None else "Unknown"
-                errors.append(f"Line {line_ctrl} - CtrlSum must be greater than 0. Found: {declared_sum}")
-                ctrlsum_passed = False
-            if round(declared_sum, 2) != round(sum_of_amounts, 2):
-                line_ctrl = ctrl_sum_element.sourceline if ctrl_sum_element is not None else "Unknown"
-                errors.append(f"Line {line_ctrl} - CtrlSum mismatch: Declared {declared_sum}, Calculated {round(sum_of_amounts, 2)} from transaction amounts.")
-                ctrlsum_passed = False
+        # Amounts are checked column-wise; only the flagged ones are visited one by one
+        amounts, valid = columns.scaled_amounts()
+        for i in (~valid | (amounts <= 0)).nonzero()[0][:ctx.max_errors].tolist():
+            if not valid[i]:
+                errors.append("Invalid amount format in one of the <InstdAmt> fields.")
+            else:
+                errors.append(f"Line {columns.amount_lines[i]} - InstdAmt must be greater than 0. Found: {format_amount(scaled_to_decimal(amounts[i]))}")
+
+        counted = amounts * valid
+        file_totals = (len(amounts), sum_amounts(counted))
+        block_totals = zip(
+            columns.payment_blocks,
+            sum_amounts_by_block(counted, columns.amount_blocks, len(columns.payment_blocks)),
+        )
+        control_errors, nboftxs_passed, ctrlsum_passed = compare_control_levels(
+            columns.group_header, file_totals, block_totals
+        )
+        errors.extend(control_errors)
 
     except Exception as e:
         errors.append(f"Error during total file control check: {str(e)}")
@@ -192,17 +400,20 @@ def check_mod10_fields(xml_path):
     errors = []
     info = []
     try:
-        tree = etree.parse(xml_path)
-        ns = {'ns': tree.getroot().nsmap[None]}
-
-        iban_nodes = tree.findall('.//ns:DbtrAcct/ns:Id/ns:IBAN', namespaces=ns)
-        if not iban_nodes:
+        ctx = as_validation_context(xml_path)
+        columns = ctx.transactions
+        if not len(columns.ibans):
             info.append("No IBANs found for Mod10 check.")
         else:
-            for node in iban_nodes:
-                iban = node.text.strip()
-                if not iban_checksum_is_valid(iban):
-                    errors.append(f"Mod10 check failed for IBAN: {iban}")
+            # Each distinct account is checked once (and cached across files)
+            ibans, rows = distinct_values(columns.ibans)
+            problems = [iban_problem(iban) for iban in ibans]
+            for i, distinct in enumerate(rows.tolist()):
+                if problems[distinct] is not None:
+                    iban = ibans[distinct]
+                    errors.append(f"Line {columns.iban_lines[i]} - {describe_iban_problem(iban, problems[distinct])}")
+                    if _full(errors, ctx.max_errors):
+                        break
 
     except Exception as e:
         errors.append(f"Error during Mod10 check: {str(e)}")
@@ -212,16 +423,14 @@ def check_aba_routing(xml_path):
     errors = []
     info = []
     try:
-        tree = etree.parse(xml_path)
-        ns = {'ns': tree.getroot().nsmap[None]}
-
-        bic_nodes = tree.findall('.//ns:DbtrAgt/ns:FinInstnId/ns:BIC', namespaces=ns)
+        ctx = as_validation_context(xml_path)
+        bic_nodes = ctx.xpaths.findall("debtor_agent_bic", ctx.tree)
         found_numeric_bic = False
         for node in bic_nodes:
             bic = node.text.strip()
             if bic.isdigit() and len(bic) == 9:
                 found_numeric_bic = True
-                if not aba_routing_mod10_check(bic):
+                if not aba_routing_mod10_check(bic) and not _full(errors, ctx.max_errors):
                     errors.append(f"ABA Routing Mod10 check failed for BIC: {bic}")
 
         if not found_numeric_bic:
@@ -234,131 +443,238 @@ def check_aba_routing(xml_path):
 def check_purpose_code(xml_path):
     errors = []
     try:
-        tree = etree.parse(xml_path)
-        ns = {'ns': tree.getroot().nsmap[None]}
-
-        # Define valid purpose codes
-        valid_purpose_codes = {
-            "SALA", "PENS", "TAXS", "INTE", "DIVI", "CASH", "GOVT", "SUPP",
-            "INSM", "CBTV", "RLWY", "GASB", "ELEC", "WTER", "TELB", "INFR",
-            "HSPC", "CHAR", "TRAD", "GDSV"
-        }
-
-        purp_nodes = tree.findall('.//ns:Purp/ns:Cd', namespaces=ns)
-        for node in purp_nodes:
-            code = node.text.strip()
-            if code not in valid_purpose_codes:
-                line = node.sourceline if node is not None else "Unknown"
-                errors.append(f"Line {line} - Invalid Purpose Code found: {code}")
+        ctx = as_validation_context(xml_path)
+        columns = ctx.transactions
+        codes = columns.purpose_codes
+        for i in not_in(codes, ctx.allowed_purpose_codes).nonzero()[0][:ctx.max_errors].tolist():
+            errors.append(f"Line {columns.purpose_lines[i]} - Invalid Purpose Code found: {codes[i]}")
 
     except Exception as e:
         errors.append(f"Error during Purpose Code check: {str(e)}")
     return errors
 
+class Utf8Validator:
+    """
+    Checks that consecutive chunks of a document are UTF-8 with an incremental
+    decoder, so at most one chunk is ever decoded and nothing is kept. Stops at
+    the first invalid sequence; errors() then reports its byte offset and line.
+    """
+
+    def __init__(self):
+        self._decoder = codecs.getincrementaldecoder("utf-8")()
+        self.offset = 0       # bytes fed so far
+        self.newlines = 0     # b"\n" in them
+        self.problem = None   # (byte offset, line, reason) of the first invalid sequence
+
+    def feed(self, chunk, final=False):
+        if self.problem is not None:
+            return
+        # Bytes of a sequence split across chunks wait in the decoder; none of them is a newline
+        pending = len(self._decoder.getstate()[0])
+        try:
+            self._decoder.decode(chunk, final)
+        except UnicodeDecodeError as e:
+            offset = self.offset - pending + e.start
+            line = self.newlines + chunk.count(b"\n", 0, max(offset - self.offset, 0)) + 1
+            self.problem = (offset, line, e.reason)
+            return
+        self.offset += len(chunk)
+        self.newlines += chunk.count(b"\n")
+
+    def close(self):
+        """Call after the last chunk: a sequence cut off by the end of the document is invalid too."""
+        self.feed(b"", final=True)
+        return self.errors()
+
+    def errors(self):
+        if self.problem is None:
+            return []
+        offset, line, reason = self.problem
+        return [f"Line {line} - File is not properly UTF-8 encoded: {reason} at byte offset {offset}."]
+
+
 def check_utf8_encoding(xml_path):
+    """
+    Decodes the document UTF8_CHECK_CHUNK_BYTES at a time, from its bytes or
+    from a memory map of the file, so no full-size copy or str is allocated.
+    """
     errors = []
     try:
-        with open(xml_path, "rb") as f:
-            raw_data = f.read()
-        try:
-            raw_data.decode('utf-8')
-        except UnicodeDecodeError:
-            errors.append("File is not properly UTF-8 encoded.")
+        ctx = as_validation_context(xml_path)
+        validator = Utf8Validator()
+        if ctx.data is not None:
+            _feed_utf8_validator(validator, ctx.data)
+        elif os.path.getsize(ctx.xml_path):
+            with open(ctx.xml_path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                _feed_utf8_validator(validator, mapped)
+        errors += validator.close()
     except Exception as e:
         errors.append(f"Error during UTF-8 encoding check: {str(e)}")
     return errors
 
+def _feed_utf8_validator(validator, buffer):
+    for start in range(0, len(buffer), UTF8_CHECK_CHUNK_BYTES):
+        validator.feed(buffer[start:start + UTF8_CHECK_CHUNK_BYTES])
+        if validator.problem is not None:
+            return
+
 def check_currency_codes(xml_path):
     errors = []
     try:
-        tree = etree.parse(xml_path)
-        ns = {'ns': tree.getroot().nsmap[None]}
-
-        # Define valid ISO currency codes
-        valid_currency_codes = {
-            "USD", "EUR", "GBP", "INR", "JPY", "AUD", "CAD", "CHF", "CNY",
-            "SEK", "NZD", "SGD", "HKD", "NOK", "KRW", "TRY", "RUB", "BRL", "ZAR"
-        }
-
-        currency_nodes = tree.findall('.//ns:InstdAmt', namespaces=ns)
-        for node in currency_nodes:
-            currency_attr = node.attrib.get('Ccy')
-            if currency_attr and currency_attr not in valid_currency_codes:
-                line = node.sourceline if node is not None else "Unknown"
-                errors.append(f"Line {line} - Invalid Currency Code found: {currency_attr}")
+        ctx = as_validation_context(xml_path)
+        columns = ctx.transactions
+        currencies = columns.currencies
+        # A missing Ccy attribute is left to the XSD
+        invalid = not_in(currencies, ctx.allowed_currencies) & (currencies != "")
+        for i in invalid.nonzero()[0][:ctx.max_errors].tolist():
+            errors.append(f"Line {columns.amount_lines[i]} - Invalid Currency Code found: {currencies[i]}")
 
     except Exception as e:
         errors.append(f"Error during Currency Code check: {str(e)}")
     return errors
 
-def check_duplicate_message_id(xml_path, seen_message_ids, current_filename):
+def record_message_id(msg_id, line, seen_message_ids, current_filename):
+    """Registers a MsgId as used by current_filename and reports it if it was seen before."""
     errors = []
-    try:
-        tree = etree.parse(xml_path)
-        ns = {'ns': tree.getroot().nsmap[None]}
+    prev_files = seen_message_ids.record(msg_id, current_filename)
+    if prev_files:
+        error_msg = f"Line {line} - Duplicate Message ID '{msg_id}' found. (Already used in files: {prev_files})"
+        errors.append(error_msg)
+    return errors
 
-        msg_id_node = tree.find('.//ns:GrpHdr/ns:MsgId', namespaces=ns)
+def find_message_id(xml_path):
+    """Returns ((MsgId, line) or None, errors) for the group header MsgId."""
+    try:
+        ctx = as_validation_context(xml_path)
+        msg_id_node = ctx.xpaths.find("msg_id", ctx.tree)
         if msg_id_node is not None:
             msg_id = msg_id_node.text.strip()
             line = msg_id_node.sourceline if msg_id_node is not None else "Unknown"
-
-            if msg_id in seen_message_ids:
-                prev_files = seen_message_ids[msg_id]
-                error_msg = f"Line {line} - Duplicate Message ID '{msg_id}' found. (Already used in files: {prev_files})"
-                errors.append(error_msg)
-                seen_message_ids[msg_id].append(current_filename)  # Also add current file
-            else:
-                seen_message_ids[msg_id] = [current_filename]
+            return (msg_id, line), []
 
     except Exception as e:
-        errors.append(f"Error during Duplicate Message ID check: {str(e)}")
+        return None, [f"Error during Duplicate Message ID check: {str(e)}"]
+    return None, []
+
+def read_message_id(source):
+    """
+    The group header MsgId of an XML document, given as a path or its bytes,
+    read with a pull parser that stops there; None if it cannot be read.
+    """
+    try:
+        limits = DocumentLimits()
+        with open_source(source) as f:
+            events = etree.iterparse(LimitedReader(f, limits), events=("start", "end"), **PARSER_OPTIONS)
+            for element in limits.ends(events):
+                if _local_name(element) == "MsgId" and _local_name(element.getparent()) == "GrpHdr":
+                    return (element.text or "").strip() or None
+    except etree.XMLSyntaxError:
+        pass
+    return None
+
+def check_duplicate_message_id(xml_path, seen_message_ids, current_filename):
+    found, errors = find_message_id(xml_path)
+    if found is not None:
+        try:
+            errors.extend(record_message_id(*found, seen_message_ids, current_filename))
+        except Exception as e:
+            errors.append(f"Error during Duplicate Message ID check: {str(e)}")
     return errors
 
-def check_payment_dates(xml_path):
+def pmtinf_date_fields(pmtinf, xpaths):
+    """Pulls the fields the payment date check needs out of one <PmtInf> element."""
+    pmtmtd_node = xpaths.find("pmtinf_pmt_mtd", pmtinf)
+    svclvl_node = xpaths.find("pmtinf_svc_lvl", pmtinf)
+    lclinstrm_node = xpaths.find("pmtinf_lcl_instrm", pmtinf)
+    reqd_exctn_dt_node = xpaths.find("pmtinf_reqd_exctn_dt", pmtinf)
+    return {
+        "pmtmtd": pmtmtd_node.text.strip() if pmtmtd_node is not None else "",
+        "svclvl": svclvl_node.text.strip() if svclvl_node is not None else "",
+        "lclinstrm": lclinstrm_node.text.strip() if lclinstrm_node is not None else "",
+        "reqd_exctn_dt": reqd_exctn_dt_node.text.strip() if reqd_exctn_dt_node is not None else None,
+        "line": reqd_exctn_dt_node.sourceline if reqd_exctn_dt_node is not None else "Unknown",
+    }
+
+def find_payment_date_fields(xml_path):
+    """Returns ((CreDtTm text, PmtInf records) or None, errors) for evaluate_payment_dates."""
+    try:
+        ctx = as_validation_context(xml_path)
+        tree, xpaths = ctx.tree, ctx.xpaths
+        cre_dt_tm_node = xpaths.find("cre_dt_tm", tree)
+        cre_dt_tm_text = cre_dt_tm_node.text.strip() if cre_dt_tm_node is not None else None
+        pmtinf_records = [pmtinf_date_fields(pmtinf, xpaths) for pmtinf in xpaths.findall("pmtinf", tree)]
+    except Exception as e:
+        return None, [f"Error during Payment Date check: {str(e)}"]
+    return (cre_dt_tm_text, pmtinf_records), []
+
+def check_payment_dates(xml_path, timezone=None):
+    fields, errors = find_payment_date_fields(xml_path)
+    if fields is None:
+        return errors, {}
+    return evaluate_payment_dates(*fields, timezone=timezone)
+
+def parse_cre_dt_tm(text, zone):
+    """Epoch seconds of a CreDtTm (or any ISODateTime); a value without a UTC offset is taken as local time in zone."""
+    for fmt in ("%Y-%m-%dT%H:%M:%S.%f%z", "%Y-%m-%dT%H:%M:%S%z", "%Y-%m-%dT%H:%M:%S.%f", "%Y-%m-%dT%H:%M:%S"):
+        try:
+            parsed = datetime.strptime(text, fmt)
+        except ValueError:
+            continue
+        if parsed.tzinfo is None:
+            parsed = parsed.replace(tzinfo=zone)
+        return parsed.timestamp()
+    raise ValueError(f"time data '{text}' does not match format '%Y-%m-%dT%H:%M:%S[.%f][%z]'")
+
+def parse_reqd_exctn_dt(text, schedule):
+    """
+    The execution date of a ReqdExctnDt: a Dt as is, and a DtTm (the 08 and
+    09 versions allow either) as its date in the schedule's timezone.
+    """
+    if "T" in text:
+        return schedule.local_date(parse_cre_dt_tm(text, schedule.zone))
+    return datetime.strptime(text, "%Y-%m-%d").date()
+
+def evaluate_payment_dates(cre_dt_tm_text, pmtinf_records, timezone=None):
+    """
+    Applies the per-rail execution date rules to the PmtInf records produced by
+    pmtinf_date_fields. Shared by the tree-based and the streaming validators.
+
+    timezone is the company's IANA timezone: "today" and the submission
+    windows of each rail (see cutoff_schedule) are taken in that zone.
+    """
     errors = []
     payment_date_results = {}
 
     try:
-        tree = etree.parse(xml_path)
-        ns = {'ns': tree.getroot().nsmap[None]}
-        today = datetime.utcnow().date()
+        schedule = get_cutoff_schedule(timezone)
+        tz_name = schedule.timezone
         now_utc = datetime.utcnow()
+        today = schedule.local_date(time.time())
         timestamp_str = now_utc.strftime("%A, %Y-%m-%d at %H:%M:%S UTC")
-        us_holidays = UnitedStates()
+        suggestions = {}  # calendar name -> formatted next business day from today
 
-        # Parse <CreDtTm> once for WIRE/RTP time-of-day validation
-        cre_dt_tm = None
-        cre_dt_tm_node = tree.find('.//ns:GrpHdr/ns:CreDtTm', namespaces=ns)
-        if cre_dt_tm_node is not None:
+        # Parse <CreDtTm> once for the submission window checks
+        submitted = None
+        if cre_dt_tm_text is not None:
             try:
-                cre_dt_tm = datetime.strptime(cre_dt_tm_node.text.strip(), "%Y-%m-%dT%H:%M:%S.%f%z").astimezone(tz=None)
-            except Exception as e1:
-                try:
-                    cre_dt_tm = datetime.strptime(cre_dt_tm_node.text.strip(), "%Y-%m-%dT%H:%M:%S%z").astimezone(tz=None)
-                except Exception as e2:
-                    errors.append(f"⚠️ Could not parse CreDtTm ('{cre_dt_tm_node.text.strip()}') — error: {e2.__class__.__name__}: {e2}. Skipping business hours check.")
-
-        pmtinf_nodes = tree.findall('.//ns:PmtInf', namespaces=ns)
-        for pmtinf in pmtinf_nodes:
-            pmtmtd_node = pmtinf.find('./ns:PmtMtd', namespaces=ns)
-            pmtmtd = pmtmtd_node.text.strip() if pmtmtd_node is not None else ""
-
-            svclvl_node = pmtinf.find('./ns:PmtTpInf/ns:SvcLvl/ns:Cd', namespaces=ns)
-            svclvl = svclvl_node.text.strip() if svclvl_node is not None else ""
-
-            lclinstrm_node = pmtinf.find('./ns:PmtTpInf/ns:LclInstrm/ns:Cd', namespaces=ns)
-            lclinstrm = lclinstrm_node.text.strip() if lclinstrm_node is not None else ""
-
-            reqd_exctn_dt_node = pmtinf.find('./ns:ReqdExctnDt', namespaces=ns)
-            if reqd_exctn_dt_node is None:
+                submitted = parse_cre_dt_tm(cre_dt_tm_text, schedule.zone)
+            except Exception as e:
+                errors.append(f"⚠️ Could not parse CreDtTm ('{cre_dt_tm_text}') — error: {e.__class__.__name__}: {e}. Skipping business hours check.")
+
+        for record in pmtinf_records:
+            pmtmtd = record["pmtmtd"]
+            svclvl = record["svclvl"]
+            lclinstrm = record["lclinstrm"]
+            line = record["line"]
+
+            if record["reqd_exctn_dt"] is None:
                 errors.append("PaymentInfo missing ReqdExctnDt.")
                 continue
 
             try:
-                reqd_exctn_dt = datetime.strptime(reqd_exctn_dt_node.text.strip(), "%Y-%m-%d").date()
+                reqd_exctn_dt = parse_reqd_exctn_dt(record["reqd_exctn_dt"], schedule)
             except ValueError:
-                line = reqd_exctn_dt_node.sourceline if reqd_exctn_dt_node is not None else "Unknown"
-                errors.append(f"Line {line} - Invalid ReqdExctnDt format (should be YYYY-MM-DD).")
+                errors.append(f"Line {line} - Invalid ReqdExctnDt format (should be YYYY-MM-DD, or YYYY-MM-DDThh:mm:ss for DtTm).")
                 errors.append(f"    ⏱️ Validation attempted on {timestamp_str}.")
                 continue
 
@@ -379,13 +695,12 @@ def check_payment_dates(xml_path):
             if txn_type not in payment_date_results:
                 payment_date_results[txn_type] = True
 
-            line = reqd_exctn_dt_node.sourceline if reqd_exctn_dt_node is not None else "Unknown"
-
-            def next_business_datetime():
-                suggest = today
-                while suggest.weekday() >= 5 or suggest in us_holidays:
-                    suggest += timedelta(days=1)
-                return datetime.combine(suggest, dtime(9, 0)).strftime("%A, %Y-%m-%d at %H:%M:%S UTC")
+            calendar = calendar_for_rail(txn_type, today)
+            if calendar.name not in suggestions:
+                suggest = calendar.next_business_day(today)
+                suggestions[calendar.name] = datetime.combine(suggest, dtime(9, 0)).strftime(f"%A, %Y-%m-%d at %H:%M:%S {tz_name}")
+            next_business = suggestions[calendar.name]
+            holiday = calendar.holiday_name(reqd_exctn_dt)
 
             # === VALIDATION LOGIC ===
 
@@ -400,58 +715,66 @@ def check_payment_dates(xml_path):
                     payment_date_results[txn_type] = False
                     errors.append(f"Line {line} - {txn_type} payment must have execution date as today. Found: {reqd_exctn_dt}")
                     errors.append(f"    ⏱️ Validation attempted on {timestamp_str}.")
-                    errors.append(f"    📌 Suggested next valid execution: {now_utc.replace(hour=9, minute=0, second=0, microsecond=0).strftime('%A, %Y-%m-%d at %H:%M:%S UTC')} (today)")
+                    errors.append(f"    📌 Suggested next valid execution: {datetime.combine(today, dtime(9, 0)).strftime(f'%A, %Y-%m-%d at %H:%M:%S {tz_name}')} (today)")
                 elif reqd_exctn_dt.weekday() >= 5:
                     payment_date_results[txn_type] = False
                     errors.append(f"Line {line} - {txn_type} payment falls on a weekend ({reqd_exctn_dt.strftime('%A')}) which is non-settlement day.")
                     errors.append(f"    ⏱️ Validation attempted on {timestamp_str}.")
-                    errors.append(f"    📌 Suggested next valid execution: {next_business_datetime()} (not a weekend/holiday)")
-                elif reqd_exctn_dt in us_holidays:
+                    errors.append(f"    📌 Suggested next valid execution: {next_business} (not a weekend/holiday)")
+                elif holiday is not None:
                     payment_date_results[txn_type] = False
-                    errors.append(f"Line {line} - {txn_type} payment cannot be processed on U.S. federal holiday: {us_holidays[reqd_exctn_dt]}.")
+                    errors.append(f"Line {line} - {txn_type} payment cannot be processed on {calendar.label}: {holiday}.")
                     errors.append(f"    ⏱️ Validation attempted on {timestamp_str}.")
-                    errors.append(f"    📌 Suggested next valid execution: {next_business_datetime()} (not a weekend/holiday)")
-                elif cre_dt_tm:
-                    submit_time = cre_dt_tm.time()
-                    if submit_time < dtime(9, 0) or submit_time >= dtime(17, 0):
-                        payment_date_results[txn_type] = False
-                        errors.append(f"Line {line} - {txn_type} submission time {submit_time.strftime('%H:%M:%S')} UTC is outside allowed window (09:00–17:00 UTC).")
-                        errors.append(f"    ⏱️ Validation attempted on {timestamp_str}.")
-                        errors.append(f"    📌 Suggested next valid submission time: 09:00:00 UTC on {cre_dt_tm.date().strftime('%A, %Y-%m-%d')}")
+                    errors.append(f"    📌 Suggested next valid execution: {next_business} (not a weekend/holiday)")
+                elif submitted is not None and not schedule.in_window(txn_type, submitted):
+                    payment_date_results[txn_type] = False
+                    submit_time = schedule.local_datetime(submitted)
+                    next_open = schedule.next_window_open(txn_type, submitted)
+                    errors.append(f"Line {line} - {txn_type} submission time {submit_time.strftime('%H:%M:%S')} {tz_name} is outside allowed window ({describe_windows(txn_type)} {tz_name}).")
+                    errors.append(f"    ⏱️ Validation attempted on {timestamp_str}.")
+                    errors.append(f"    📌 Suggested next valid submission time: {next_open.strftime('%H:%M:%S')} {tz_name} on {next_open.strftime('%A, %Y-%m-%d')}")
 
             elif txn_type == "ACH":
                 if reqd_exctn_dt < today:
                     payment_date_results[txn_type] = False
                     errors.append(f"Line {line} - ACH payment must have execution date today or in the future. Found: {reqd_exctn_dt}")
                     errors.append(f"    ⏱️ Validation attempted on {timestamp_str}.")
-                    errors.append(f"    📌 Suggested next valid execution: {next_business_datetime()} (next business day)")
+                    errors.append(f"    📌 Suggested next valid execution: {next_business} (next business day)")
                 elif reqd_exctn_dt.weekday() >= 5:
                     payment_date_results[txn_type] = False
                     errors.append(f"Line {line} - ACH payment falls on a weekend ({reqd_exctn_dt.strftime('%A')}) which is non-settlement day.")
                     errors.append(f"    ⏱️ Validation attempted on {timestamp_str}.")
-                    errors.append(f"    📌 Suggested next valid execution: {next_business_datetime()} (not a weekend/holiday)")
-                elif reqd_exctn_dt in us_holidays:
+                    errors.append(f"    📌 Suggested next valid execution: {next_business} (not a weekend/holiday)")
+                elif holiday is not None:
+                    payment_date_results[txn_type] = False
+                    errors.append(f"Line {line} - ACH payment cannot be scheduled on {calendar.label}: {holiday}.")
+                    errors.append(f"    ⏱️ Validation attempted on {timestamp_str}.")
+                    errors.append(f"    📌 Suggested next valid execution: {next_business} (not a weekend/holiday)")
+                elif (submitted is not None and reqd_exctn_dt == schedule.local_date(submitted)
+                      and not schedule.in_window(txn_type, submitted)):
                     payment_date_results[txn_type] = False
-                    errors.append(f"Line {line} - ACH payment cannot be scheduled on U.S. federal holiday: {us_holidays[reqd_exctn_dt]}.")
+                    submit_time = schedule.local_datetime(submitted)
+                    next_open = schedule.next_window_open(txn_type, submitted)
+                    errors.append(f"Line {line} - Same-day ACH submission time {submit_time.strftime('%H:%M:%S')} {tz_name} is outside the same-day ACH windows ({describe_windows(txn_type)} {tz_name}).")
                     errors.append(f"    ⏱️ Validation attempted on {timestamp_str}.")
-                    errors.append(f"    📌 Suggested next valid execution: {next_business_datetime()} (not a weekend/holiday)")
+                    errors.append(f"    📌 Suggested next valid execution: {next_open.strftime('%A, %Y-%m-%d')} (next same-day ACH window opens {next_open.strftime('%H:%M')} {tz_name})")
 
             else:
                 if reqd_exctn_dt < today:
                     payment_date_results[txn_type] = False
                     errors.append(f"Line {line} - Unknown payment type treated as ACH. Execution date must be today or future. Found: {reqd_exctn_dt}")
                     errors.append(f"    ⏱️ Validation attempted on {timestamp_str}.")
-                    errors.append(f"    📌 Suggested next valid execution: {next_business_datetime()} (next business day)")
+                    errors.append(f"    📌 Suggested next valid execution: {next_business} (next business day)")
                 elif reqd_exctn_dt.weekday() >= 5:
                     payment_date_results[txn_type] = False
                     errors.append(f"Line {line} - Unknown payment type treated as ACH. Execution date falls on weekend ({reqd_exctn_dt.strftime('%A')}).")
                     errors.append(f"    ⏱️ Validation attempted on {timestamp_str}.")
-                    errors.append(f"    📌 Suggested next valid execution: {next_business_datetime()} (not a weekend/holiday)")
-                elif reqd_exctn_dt in us_holidays:
+                    errors.append(f"    📌 Suggested next valid execution: {next_business} (not a weekend/holiday)")
+                elif holiday is not None:
                     payment_date_results[txn_type] = False
-                    errors.append(f"Line {line} - Unknown payment type treated as ACH. Execution date is a U.S. federal holiday ({us_holidays[reqd_exctn_dt]}).")
+                    errors.append(f"Line {line} - Unknown payment type treated as ACH. Execution date is a {calendar.label} ({holiday}).")
                     errors.append(f"    ⏱️ Validation attempted on {timestamp_str}.")
-                    errors.append(f"    📌 Suggested next valid execution: {next_business_datetime()} (not a weekend/holiday)")
+                    errors.append(f"    📌 Suggested next valid execution: {next_business} (not a weekend/holiday)")
 
     except Exception as e:
         errors.append(f"Error during Payment Date check: {str(e)}")
@@ -464,40 +787,494 @@ def check_payment_dates(xml_path):
 def check_country_codes(xml_path):
     errors = []
     try:
-        tree = etree.parse(xml_path)
-        ns = {'ns': tree.getroot().nsmap[None]}
-
-        valid_country_codes = {  # (full set pasted here)
-            "AD", "AE", "AF", "AG", "AI", "AL", "AM", "AO", "AQ", "AR", "AS", "AT", "AU", "AW", "AX", "AZ",
-            "BA", "BB", "BD", "BE", "BF", "BG", "BH", "BI", "BJ", "BL", "BM", "BN", "BO", "BQ", "BR", "BS",
-            "BT", "BV", "BW", "BY", "BZ", "CA", "CC", "CD", "CF", "CG", "CH", "CI", "CK", "CL", "CM", "CN",
-            "CO", "CR", "CU", "CV", "CW", "CX", "CY", "CZ", "DE", "DJ", "DK", "DM", "DO", "DZ", "EC", "EE",
-            "EG", "EH", "ER", "ES", "ET", "FI", "FJ", "FM", "FO", "FR", "GA", "GB", "GD", "GE", "GF", "GG",
-            "GH", "GI", "GL", "GM", "GN", "GP", "GQ", "GR", "GT", "GU", "GW", "GY", "HK", "HM", "HN", "HR",
-            "HT", "HU", "ID", "IE", "IL", "IM", "IN", "IO", "IQ", "IR", "IS", "IT", "JE", "JM", "JO", "JP",
-            "KE", "KG", "KH", "KI", "KM", "KN", "KP", "KR", "KW", "KY", "KZ", "LA", "LB", "LC", "LI", "LK",
-            "LR", "LS", "LT", "LU", "LV", "LY", "MA", "MC", "MD", "ME", "MF", "MG", "MH", "MK", "ML", "MM",
-            "MN", "MO", "MP", "MQ", "MR", "MS", "MT", "MU", "MV", "MW", "MX", "MY", "MZ", "NA", "NC", "NE",
-            "NF", "NG", "NI", "NL", "NO", "NP", "NR", "NU", "NZ", "OM", "PA", "PE", "PF", "PG", "PH", "PK",
-            "PL", "PM", "PN", "PR", "PT", "PW", "PY", "QA", "RE", "RO", "RS", "RU", "RW", "SA", "SB", "SC",
-            "SD", "SE", "SG", "SH", "SI", "SJ", "SK", "SL", "SM", "SN", "SO", "SR", "SS", "ST", "SV", "SX",
-            "SY", "SZ", "TC", "TD", "TF", "TG", "TH", "TJ", "TK", "TL", "TM", "TN", "TO", "TR", "TT", "TV",
-            "TZ", "UA", "UG", "UM", "US", "UY", "UZ", "VA", "VC", "VE", "VG", "VI", "VN", "VU", "WF", "WS",
-            "YE", "YT", "ZA", "ZM", "ZW"
-        }
-
-        ctry_nodes = tree.findall('.//ns:Ctry', namespaces=ns)
-        for node in ctry_nodes:
-            country = node.text.strip()
-            if len(country) != 2 or country.upper() not in valid_country_codes:
-                line = node.sourceline if node is not None else "Unknown"
-                errors.append(f"Line {line} - Invalid Country Code: {country}")
+        ctx = as_validation_context(xml_path)
+        columns = ctx.transactions
+        countries = columns.countries
+        for i in not_in(countries, ctx.reference.countries, length=2, upper=True).nonzero()[0][:ctx.max_errors].tolist():
+            errors.append(f"Line {columns.country_lines[i]} - Invalid Country Code: {countries[i]}")
 
     except Exception as e:
         errors.append(f"Error during Country Code check: {str(e)}")
     return errors
 
-def write_annotated_html(xml_file_path, errors, summary_text, output_dir=REPORTS_DIR):
+_local_names = {}
+
+def _local_name(element):
+    tag = element.tag
+    name = _local_names.get(tag)
+    if name is None:
+        name = tag.rpartition('}')[2] if isinstance(tag, str) else ""
+        _local_names[tag] = name
+    return name
+
+def _parent_names(element, depth):
+    """Local names of the first `depth` ancestors of element, nearest first."""
+    names = []
+    parent = element.getparent()
+    while parent is not None and len(names) < depth:
+        names.append(_local_name(parent))
+        parent = parent.getparent()
+    return names
+
+
+class StreamingChecks:
+    """
+    Accumulates every business check over the end events of one iterparse
+    pass. Each handler only looks at the element it is given and its
+    ancestors, so transactions can be discarded as soon as they have been
+    seen. results() returns the same shapes the check_* functions return;
+    each check stops collecting errors at max_errors.
+    """
+
+    def __init__(self, allowed_currencies=None, allowed_purpose_codes=None, countries=None, max_errors=None):
+        reference = get_reference_data()
+        self.allowed_currencies = reference.currencies if allowed_currencies is None else allowed_currencies
+        self.allowed_purpose_codes = reference.purpose_codes if allowed_purpose_codes is None else allowed_purpose_codes
+        self.countries = reference.countries if countries is None else countries
+        self.max_errors = max_errors
+
+        self.group_header = PaymentBlock()  # declared NbOfTxs/CtrlSum of <GrpHdr>
+        self.nb_of_txs_actual = 0
+        self.scaled_sum = 0          # exact, in units of 10**-AMOUNT_SCALE
+        self.block = None            # the <PmtInf> being read, with its running count and sum
+        self.block_count, self.block_sum = 0, 0
+        self.block_totals = []       # (PaymentBlock, (count, Decimal sum)) per finished <PmtInf>
+        self.amount_errors = []
+
+        self.iban_errors, self.iban_found = [], False
+        self.aba_errors, self.found_numeric_bic = [], False
+        self.mmbid_errors, self.mmbid_found = [], False
+        self.purpose_code_errors = []
+        self.currency_code_errors = []
+        self.country_code_errors = []
+        self.msg_id = None           # (MsgId, line) from <GrpHdr>
+        self.duplicate_e2e_errors, self.end_to_end_ids = [], {}
+        self.cre_dt_tm_text = None
+        self.pmtinf_records = []
+
+        self._handlers = {
+            "NbOfTxs": self._nb_of_txs,
+            "CtrlSum": self._ctrl_sum,
+            "InstdAmt": self._instd_amt,
+            "IBAN": self._iban,
+            "BIC": self._bic,
+            "BICFI": self._bic,  # pain.001.001.04 and later
+            "MmbId": self._mmbid,
+            "Cd": self._purpose_code,
+            "Ctry": self._country,
+            "MsgId": self._msg_id,
+            "CreDtTm": self._cre_dt_tm,
+            "EndToEndId": self._end_to_end_id,
+            "CdtTrfTxInf": self._release,
+            "PmtInf": self._pmtinf,
+            "PmtInfId": self._pmtinf_id,
+        }
+
+    def tags(self):
+        return list(self._handlers)
+
+    def handle(self, element):
+        handler = self._handlers.get(_local_name(element))
+        if handler is not None:
+            handler(element, (element.text or "").strip())
+
+    def _declaring_block(self, element):
+        """The PaymentBlock a <NbOfTxs>/<CtrlSum> belongs to, or None outside GrpHdr and PmtInf."""
+        parent = _parent_names(element, 1)
+        if parent == ["GrpHdr"]:
+            return self.group_header
+        if parent == ["PmtInf"]:
+            return self._current_block()
+        return None
+
+    def _current_block(self):
+        # iterparse only reports end events, so a <PmtInf> is opened by its first child
+        if self.block is None:
+            self.block = PaymentBlock()
+        return self.block
+
+    def _nb_of_txs(self, element, text):
+        block = self._declaring_block(element)
+        if block is not None and block.nb_of_txs is None:
+            block.nb_of_txs = (text, element.sourceline)
+
+    def _ctrl_sum(self, element, text):
+        block = self._declaring_block(element)
+        if block is not None and block.ctrl_sum is None:
+            block.ctrl_sum = (text, element.sourceline)
+
+    def _pmtinf_id(self, element, text):
+        if _parent_names(element, 1) == ["PmtInf"]:
+            self._current_block().pmtinf_id = text
+
+    def _instd_amt(self, element, text):
+        currency_attr = element.attrib.get('Ccy')
+        if (currency_attr and currency_attr not in self.allowed_currencies
+                and not _full(self.currency_code_errors, self.max_errors)):
+            self.currency_code_errors.append(f"Line {element.sourceline} - Invalid Currency Code found: {currency_attr}")
+
+        if _parent_names(element, 2) != ["Amt", "CdtTrfTxInf"]:
+            return
+        self.nb_of_txs_actual += 1
+        self._current_block()
+        self.block_count += 1
+        amount = parse_amount(text)
+        if amount is None:
+            if not _full(self.amount_errors, self.max_errors):
+                self.amount_errors.append("Invalid amount format in one of the <InstdAmt> fields.")
+            return
+        if amount <= 0 and not _full(self.amount_errors, self.max_errors):
+            self.amount_errors.append(f"Line {element.sourceline} - InstdAmt must be greater than 0. Found: {format_amount(scaled_to_decimal(amount))}")
+        self.scaled_sum += amount
+        self.block_sum += amount
+
+    def _iban(self, element, text):
+        if _parent_names(element, 2) in (["Id", "DbtrAcct"], ["Id", "CdtrAcct"]):
+            self.iban_found = True
+            problem = iban_problem(text)
+            if problem is not None and not _full(self.iban_errors, self.max_errors):
+                self.iban_errors.append(f"Line {element.sourceline} - {describe_iban_problem(text, problem)}")
+
+    def _bic(self, element, text):
+        if _parent_names(element, 2) == ["FinInstnId", "DbtrAgt"] and text.isdigit() and len(text) == 9:
+            self.found_numeric_bic = True
+            if not aba_routing_mod10_check(text) and not _full(self.aba_errors, self.max_errors):
+                self.aba_errors.append(f"ABA Routing Mod10 check failed for BIC: {text}")
+
+    def _mmbid(self, element, text):
+        if _parent_names(element, 3) == ["ClrSysMmbId", "FinInstnId", "DbtrAgt"]:
+            self.mmbid_found = True
+            if not text.isdigit() and not _full(self.mmbid_errors, self.max_errors):
+                self.mmbid_errors.append(f"Line {element.sourceline} - Member ID (MmbId) is not numeric: {text}")
+
+    def _purpose_code(self, element, text):
+        if (_parent_names(element, 1) == ["Purp"] and text not in self.allowed_purpose_codes
+                and not _full(self.purpose_code_errors, self.max_errors)):
+            self.purpose_code_errors.append(f"Line {element.sourceline} - Invalid Purpose Code found: {text}")
+
+    def _country(self, element, text):
+        if (len(text) != 2 or text.upper() not in self.countries) and not _full(self.country_code_errors, self.max_errors):
+            self.country_code_errors.append(f"Line {element.sourceline} - Invalid Country Code: {text}")
+
+    def _msg_id(self, element, text):
+        if self.msg_id is None and _parent_names(element, 1) == ["GrpHdr"]:
+            self.msg_id = (text, element.sourceline)
+
+    def _cre_dt_tm(self, element, text):
+        if self.cre_dt_tm_text is None and _parent_names(element, 1) == ["GrpHdr"]:
+            self.cre_dt_tm_text = text
+
+    def _end_to_end_id(self, element, text):
+        if _parent_names(element, 2) != ["PmtId", "CdtTrfTxInf"]:
+            return
+        line = element.sourceline
+        if text in self.end_to_end_ids:
+            if not _full(self.duplicate_e2e_errors, self.max_errors):
+                self.duplicate_e2e_errors.append(f"Line {line} - Duplicate EndToEndId '{text}' found (also at Line {self.end_to_end_ids[text]}).")
+        else:
+            self.end_to_end_ids[text] = line
+
+    def _pmtinf(self, element, text):
+        self.pmtinf_records.append(pmtinf_date_fields(element, get_xpath_table(element.nsmap.get(None))))
+        block = self._current_block()
+        block.line = element.sourceline
+        self.block_totals.append((block, (self.block_count, scaled_to_decimal(self.block_sum))))
+        self.block, self.block_count, self.block_sum = None, 0, 0
+        self._release(element, text)
+
+    def _release(self, element, text):
+        # Drop the subtree we just consumed and the (already emptied) sibling
+        # before it, so the tree never holds more than one transaction.
+        element.clear()
+        previous = element.getprevious()
+        if previous is not None and previous.tag == element.tag:
+            element.getparent().remove(previous)
+
+    def failed(self, error):
+        """Same shapes as results(), for a document that is not well-formed."""
+        def message(label):
+            return [f"Error during {label} check: {str(error)}"]
+        return {
+            "total_file_control": (message("total file control"), False, False),
+            "mod10": (message("Mod10"), []),
+            "aba_routing": (message("ABA Routing"), []),
+            "member_id": (message("Member ID"), []),
+            "purpose_code": message("Purpose Code"),
+            "currency_codes": message("Currency Code"),
+            "duplicate_message_id": message("Duplicate Message ID"),
+            "payment_dates": (message("Payment Date"), {}),
+            "country_codes": message("Country Code"),
+            "duplicate_end_to_end_id": (message("Duplicate EndToEndId"), []),
+            "deferred": {},
+        }
+
+    def results(self):
+        control_errors, nboftxs_passed, ctrlsum_passed = compare_control_levels(
+            self.group_header, (self.nb_of_txs_actual, scaled_to_decimal(self.scaled_sum)), self.block_totals
+        )
+        total_control = (self.amount_errors + control_errors, nboftxs_passed, ctrlsum_passed)
+
+        return {
+            "total_file_control": total_control,
+            "mod10": (self.iban_errors, [] if self.iban_found else ["No IBANs found for Mod10 check."]),
+            "aba_routing": (self.aba_errors, [] if self.found_numeric_bic else ["No 9-digit BICs found for ABA check."]),
+            "member_id": (self.mmbid_errors, [] if self.mmbid_found else ["No Member IDs (MmbId) found."]),
+            "purpose_code": self.purpose_code_errors,
+            "currency_codes": self.currency_code_errors,
+            "duplicate_message_id": [],
+            "payment_dates": ([], {}),
+            "country_codes": self.country_code_errors,
+            "duplicate_end_to_end_id": (
+                self.duplicate_e2e_errors,
+                [] if self.end_to_end_ids else ["No EndToEndId elements found in file."],
+            ),
+            "deferred": {
+                "duplicate_message_id": self.msg_id,
+                "duplicate_end_to_end_id": self.end_to_end_ids,
+                "payment_dates": (self.cre_dt_tm_text, self.pmtinf_records),
+            },
+        }
+
+
+def _stream_pass(ctx, checks, schema=None):
+    # Every start event goes through DocumentLimits; handle() ignores the elements no check reads
+    limits = DocumentLimits()
+    with ctx.open() as source:
+        events = etree.iterparse(
+            LimitedReader(source, limits, ctx.budget_check()), events=("start", "end"), schema=schema,
+            **PARSER_OPTIONS
+        )
+        for element in limits.ends(events):
+            checks.handle(element)
+
+
+def stream_validate(xml_path, xsd_file, checks=None, timings=None):
+    """
+    Bounded-memory validation for very large files.
+
+    Walks the document once with etree.iterparse, feeds every business check
+    from that single pass and discards each <CdtTrfTxInf> and <PmtInf> subtree
+    as soon as it has been consumed, so memory stays flat no matter how many
+    transactions the file holds. The XSD is enforced during the same pass;
+    libxml2 stops at the first schema violation, so a file that fails the
+    schema is walked a second time without it to finish the business checks.
+
+    Returns the results of the selected checks keyed like tree_validate; the
+    MsgId and EndToEndIds are only registered by complete_checks, so a re-run
+    after a schema failure does not flag the file as its own duplicate. The
+    single pass is timed as a whole under "stream_pass". A pass cut short by
+    the context's time budget yields no results: the XSD step (unless already
+    decided) and every check of the pass are reported as skipped.
+
+    xml_path may also be a ValidationContext, whose code lists are applied and
+    whose bytes are read if it holds them; its tree is never parsed.
+    """
+    ctx = as_validation_context(xml_path)
+    checks = check_registry.select() if checks is None else checks
+    timings = {} if timings is None else timings
+    pass_start = time.perf_counter()
+    xsd_result = (True, [])
+    parse_error = None
+    try:
+        schema = get_schema(xsd_file)
+    except Exception as e:
+        schema = None
+        xsd_result = (False, [f"Exception during validation: {e}"])
+
+    streaming = StreamingChecks(
+        ctx.allowed_currencies, ctx.allowed_purpose_codes, ctx.reference.countries, ctx.max_errors
+    )
+    try:
+        _stream_pass(ctx, streaming, schema)
+    except BudgetExceeded:
+        xsd_result = streaming = None
+    except XMLLimitError as e:
+        # Over a limit with or without the schema; there is nothing to re-walk
+        parse_error = e
+        xsd_result = (False, xsd_result[1] + [f"Exception during validation: {e}"])
+    except etree.XMLSyntaxError as e:
+        if schema is not None:
+            xsd_result = (False, [f"XSD validation failed (streaming mode reports the first violation only): {e.msg}"])
+            streaming = StreamingChecks(
+                ctx.allowed_currencies, ctx.allowed_purpose_codes, ctx.reference.countries, ctx.max_errors
+            )
+            try:
+                _stream_pass(ctx, streaming)
+            except BudgetExceeded:
+                streaming = None
+            except etree.XMLSyntaxError as e2:
+                parse_error = e2
+                xsd_result = (False, [f"Exception during validation: {e2}"])
+        else:
+            parse_error = e
+            xsd_result = (False, xsd_result[1] + [f"Exception during validation: {e}"])
+
+    if streaming is None:
+        if xsd_result is None:
+            ctx.budget.skip("xsd")
+        pass_results = {"deferred": {}}
+    else:
+        pass_results = streaming.failed(parse_error) if parse_error is not None else streaming.results()
+    timings["stream_pass"] = round((time.perf_counter() - pass_start) * 1000, 3)
+    return _stream_results(ctx, checks, xsd_result, pass_results, timings)
+
+
+def _stream_results(ctx, checks, xsd_result, pass_results, timings):
+    """
+    Results of the selected checks from a streaming pass; checks outside the
+    pass run against ctx unless pass_results already holds their result.
+    Checks of a pass that did not finish are missing from pass_results and
+    are skipped. With ctx.fail_fast the checks after the first failing one
+    (the XSD step included) are left out and listed in results["not_run"].
+    """
+    results = {"xsd": xsd_result, "deferred": {}, "not_run": []}
+    failed = ctx.fail_fast and xsd_result is not None and not xsd_result[0]
+    for check in checks:
+        if failed:
+            results["not_run"].append(check.name)
+            continue
+        if not check.in_stream_pass and check.name not in pass_results:
+            result = _budgeted(ctx, timings, check.name, check.run, ctx)
+            if result is SKIPPED:
+                continue
+            if check.complete is not None:
+                result, results["deferred"][check.name] = result
+        elif check.name not in pass_results:
+            ctx.budget.skip(check.name)
+            continue
+        else:
+            result = pass_results[check.name]
+            if check.name in pass_results["deferred"]:
+                results["deferred"][check.name] = pass_results["deferred"][check.name]
+        results[check.name] = result
+        failed = ctx.fail_fast and bool(check.summarize(result)[0])
+    return results
+
+
+class _DiscardTarget:
+    """Parser target that keeps nothing, for a bare well-formedness check."""
+
+    def close(self):
+        return None
+
+
+class IncrementalStreamPass:
+    """
+    The streaming pass of stream_validate driven by feed() instead of a file
+    path, so it can run while an upload is still arriving. A chunk that makes
+    the document malformed raises etree.XMLSyntaxError from feed() (or from
+    close() for a truncated document) straight away, and one that takes it
+    over the depth or element limit raises XMLLimitError.
+
+    The schema is enforced as the chunks arrive. libxml2's push parser keeps
+    reporting elements after a schema violation and raises it from close(),
+    but from then on it also reports any syntax error as that violation, so a
+    failure is told apart by re-reading what was received so far, from
+    replay(), with a schema-less parser that builds no tree.
+    """
+
+    def __init__(self, xsd_file, replay, allowed_currencies=None, allowed_purpose_codes=None, countries=None,
+                 max_errors=None):
+        self._replay = replay
+        self._check_options = (allowed_currencies, allowed_purpose_codes, countries, max_errors)
+        self.xsd_result = (True, [])
+        try:
+            schema = get_schema(xsd_file)
+        except Exception as e:
+            schema = None
+            self.xsd_result = (False, [f"Exception during validation: {e}"])
+        self._start(schema)
+
+    def _start(self, schema):
+        self.checks = StreamingChecks(*self._check_options)
+        self._schema = schema
+        self._root_closed = False
+        self._limits = DocumentLimits()
+        # The root's end event tells a complete document from a truncated one, see close()
+        self._parser = etree.XMLPullParser(events=("start", "end"), schema=schema, **PARSER_OPTIONS)
+
+    def _drain(self):
+        for element in self._limits.ends(self._parser.read_events()):
+            if element.getparent() is None:
+                self._root_closed = True
+            else:
+                self.checks.handle(element)
+
+    def _syntax_error(self, complete):
+        """The syntax error in what was fed so far, or None if it is well-formed (so far, unless complete)."""
+        parser = etree.XMLParser(target=_DiscardTarget(), **PARSER_OPTIONS)
+        try:
+            for data in self._replay():
+                parser.feed(data)
+            if complete:
+                parser.close()
+        except etree.XMLSyntaxError as e:
+            return e
+        return None
+
+    def _schema_failed(self, error):
+        self.xsd_result = (False, [f"XSD validation failed (streaming mode reports the first violation only): {error.msg}"])
+
+    def feed(self, data):
+        try:
+            self._parser.feed(data)
+            self._drain()
+        except XMLLimitError:
+            raise
+        except etree.XMLSyntaxError as e:
+            if self._schema is None:
+                raise
+            syntax_error = self._syntax_error(complete=False)
+            if syntax_error is not None:
+                raise syntax_error
+            # A violation the parser could not continue past: finish the checks without the schema
+            self._schema_failed(e)
+            self._start(None)
+            for replayed in self._replay():
+                self._parser.feed(replayed)
+                self._drain()
+
+    def close(self):
+        """Finishes the pass; returns (xsd_result, pass results) in stream_validate's shapes."""
+        try:
+            self._parser.close()
+        except etree.XMLSyntaxError as e:
+            if self._schema is None:
+                raise
+            syntax_error = self._syntax_error(complete=True)
+            if syntax_error is not None:
+                raise syntax_error
+            self._schema_failed(e)
+        self._drain()
+        if self._schema is not None and not self._root_closed:
+            # With a schema libxml2 does not always report a truncated document
+            syntax_error = self._syntax_error(complete=True)
+            if syntax_error is not None:
+                raise syntax_error
+        return self.xsd_result, self.checks.results()
+
+
+def upload_validate(ctx, xsd_file, upload_pass, checks=None, timings=None, full_xsd_errors=False):
+    """
+    Results keyed like stream_validate for a file whose streaming pass already
+    ran while it was uploaded (see IncrementalStreamPass). Only the checks
+    outside the pass still read the file; with full_xsd_errors a schema failure
+    is re-checked against the parsed tree so every violation is reported, as
+    tree_validate would.
+    """
+    checks = check_registry.select() if checks is None else checks
+    timings = {} if timings is None else timings
+    timings["upload_pass"] = upload_pass.elapsed_ms
+    xsd_result = upload_pass.xsd_result
+    if full_xsd_errors and not xsd_result[0]:
+        # Out of time, the pass's first violation still stands
+        full_result = _budgeted(ctx, timings, "xsd", _tree_xsd, ctx, xsd_file)
+        if full_result is not SKIPPED:
+            xsd_result = full_result
+    return _stream_results(ctx, checks, xsd_result, upload_pass.pass_results, timings)
+
+
+def write_annotated_html(xml_file_path, errors, summary_text, output_dir=REPORTS_DIR, xml_data=None):
     """
     Creates a split-pane interactive HTML editor with error line highlights and inline messages.
     Displays full validation summary, supports dark/light mode toggle, and auto-clears errors on edit.
@@ -506,6 +1283,7 @@ def write_annotated_html(xml_file_path, errors, summary_text, output_dir=REPORTS
     :param errors: List of validation errors with line numbers.
     :param summary_text: Full validation summary (str) with ✔️, ⚠️, ℹ️ lines.
     :param output_dir: Where to save the HTML file.
+    :param xml_data: The XML's bytes, if it is not on disk; xml_file_path then only names the report.
     :return: Path to the generated interactive HTML.
     """
     import os
@@ -522,7 +1300,7 @@ def write_annotated_html(xml_file_path, errors, summary_text, output_dir=REPORTS
             line_no = int(match.group(1))
             line_error_map.setdefault(line_no, []).append(err)
 
-    with open(xml_file_path, "r", encoding="utf-8") as f:
+    with io.TextIOWrapper(open_source(xml_data if xml_data is not None else xml_file_path), encoding="utf-8") as f:
         xml_lines = f.readlines()
 
     html_lines = [
@@ -657,17 +1435,108 @@ window.addEventListener("DOMContentLoaded", () => {
 
 
 
-def get_version_from_xml(xml_path):
+def sniff_root_element(xml_path, max_bytes=None):
+    """
+    (namespace, attributes) of the root element, fed to a pull parser in small
+    chunks from the start of the file and never reading past max_bytes
+    (VERSION_SNIFF_BYTES); None if the root start tag is not within them.
+    xml_path may also be the document's bytes.
+    """
+    max_bytes = VERSION_SNIFF_BYTES if max_bytes is None else max_bytes
+    parser = etree.XMLPullParser(events=("start",), **PARSER_OPTIONS)
+    read = 0
+    with open_source(xml_path) as f:
+        while read < max_bytes:
+            chunk = f.read(min(4096, max_bytes - read))
+            if not chunk:
+                break
+            read += len(chunk)
+            root = feed_root_sniffer(parser, chunk)
+            if root is not None:
+                return root
+    return None
+
+def feed_root_sniffer(parser, chunk):
+    """
+    Feeds chunk to a pull parser reporting "start" events; (namespace,
+    attributes) of the root element once its start tag has been read, else None.
+    """
+    try:
+        parser.feed(chunk)
+    except etree.XMLSyntaxError:
+        # A syntax error later in the chunk does not matter once the root tag was read
+        for _, element in parser.read_events():
+            return etree.QName(element).namespace, dict(element.attrib)
+        raise
+    for _, element in parser.read_events():
+        return etree.QName(element).namespace, dict(element.attrib)
+    return None
+
+def _supported_version_in(text):
+    match = re.search(r"pain\.001\.001\.(\d{2})", text or "")
+    if match and f"pain.001.001.{match.group(1)}" in SUPPORTED_VERSIONS:
+        return f"pain.001.001.{match.group(1)}"
+    return None
+
+def get_version_from_xml(xml_path, filename=None):
+    """
+    Detects the pain.001 version from the root element's namespace without
+    parsing the document. A pain.001 namespace decides on its own; otherwise
+    the xsi schema location and then filename are tried. Never prompts.
+    xml_path may also be the document's bytes.
+    """
+    source_name = filename if isinstance(xml_path, (bytes, bytearray)) else xml_path
     try:
-        tree = etree.parse(xml_path)
-        root = tree.getroot()
-        namespace = root.nsmap[None]
-        version = namespace.split('.')[-1]
-        logging.info(f"Detected version '{version}' from XML: {xml_path}")
-        return f"pain.001.001.{version}"
-    except Exception as e:
-        logging.warning(f"Failed to parse version from XML {xml_path}: {e}")
-        return None
+        root = sniff_root_element(xml_path)
+    except (OSError, etree.XMLSyntaxError) as e:
+        logging.warning(f"Failed to read the root element of {source_name}: {e}")
+        root = None
+    return version_from_root(root, source_name, filename)
+
+def version_from_root(root, source_name, filename=None):
+    """get_version_from_xml for a root element already sniffed from source_name."""
+    candidates = []
+    if root is not None:
+        namespace, attributes = root
+        namespace_version = version_of_namespace(namespace)
+        if namespace_version is not None:
+            version = _supported_version_in(namespace)
+            if version is None:
+                logging.warning(f"Unsupported pain.001 version '{namespace_version}' in XML: {source_name}")
+            else:
+                logging.info(f"Detected version '{version}' from XML: {source_name}")
+            return version
+        candidates.append(("schema location", attributes.get(f"{{{XSI_NAMESPACE}}}schemaLocation")))
+        candidates.append(("schema location", attributes.get(f"{{{XSI_NAMESPACE}}}noNamespaceSchemaLocation")))
+
+    for source, text in candidates:
+        version = _supported_version_in(text)
+        if version is not None:
+            logging.info(f"Detected version '{version}' from the {source} of {source_name}")
+            return version
+    if filename:
+        return get_version_from_filename(filename)
+    logging.warning(f"Failed to detect version from XML {source_name}")
+    return None
+
+SUPPORTED_VERSIONS = [f"pain.001.001.0{v}" for v in range(3, 10)]
+
+def warm_schema_cache():
+    """
+    Compile the XSD of every supported pain.001 version up front so the first
+    request for each version does not pay the schema compile cost. Schemas are
+    cached per thread, so this also runs as the validation pool's worker initializer.
+    """
+    loaded = []
+    for version in SUPPORTED_VERSIONS:
+        xsd_file = os.path.join(SCHEMA_DIR, f"{version}.xsd")
+        try:
+            get_schema(xsd_file)
+            loaded.append(version)
+        except Exception as e:
+            logging.warning(f"Could not pre-compile schema {xsd_file}: {e}")
+    logging.info(f"Schema cache warmed for: {', '.join(loaded) or 'no versions'}")
+    return loaded
 
 def get_version_from_filename(filename):
     for v in range(3, 10):
@@ -692,18 +1561,32 @@ def prompt_for_version(filename):
             return version
         print("❌ Invalid input. Please enter a valid version number between 03 and 09.")
 
-def generate_xml_from_csv(csv_file, version):
+def render_xml_from_csv(csv_source, version):
+    """
+    pain.001 XML bytes rendered from the first row of a CSV, given as a path or
+    as the CSV's bytes, with the version's template; None if that fails.
+    """
     template_path = os.path.join(TEMPLATE_DIR, f"{version}.xml")
-    output_path = os.path.join(XML_DIR, os.path.basename(csv_file).replace(".csv", f"_{version}.xml"))
     try:
         with open(template_path, 'r', encoding='utf-8') as f:
             template_content = f.read()
         template = Template(template_content)
-        with open(csv_file, 'r', encoding='utf-8') as f:
+        with io.TextIOWrapper(open_source(csv_source), encoding='utf-8', newline='') as f:
             reader = csv.DictReader(f)
             data = next(reader)
-        rendered_xml = template.render(**data)
-        with open(output_path, 'w', encoding='utf-8') as f:
+        return template.render(**data).encode('utf-8')
+    except Exception as e:
+        logging.error(f"Failed to render XML for {version} from CSV: {e}")
+        return None
+
+def generate_xml_from_csv(csv_file, version):
+    output_path = os.path.join(XML_DIR, os.path.basename(csv_file).replace(".csv", f"_{version}.xml"))
+    rendered_xml = render_xml_from_csv(csv_file, version)
+    if rendered_xml is None:
+        logging.error(f"Failed to generate XML for {csv_file}")
+        return None
+    try:
+        with open(output_path, 'wb') as f:
             f.write(rendered_xml)
         logging.info(f"Generated XML written to {output_path}")
         return output_path
@@ -726,86 +1609,371 @@ def extract_line_number_from_error(error_message):
         return error_message
 
 
-def validate_and_compare(xml_file, version):
+# Stateful and time-dependent checks: run() extracts what they need from the
+# file, complete() finishes them against the indexes and the clock
+
+def _run_duplicate_message_id(ctx):
+    found, errors = find_message_id(ctx)
+    return errors, found
+
+def _complete_duplicate_message_id(errors, found, state):
+    errors = list(errors)
+    if found is not None:
+        msg_id, line = found
+        try:
+            errors += record_message_id(msg_id, line, state["seen_message_ids"], state["current_filename"])
+        except Exception as e:
+            errors.append(f"Error during Duplicate Message ID check: {str(e)}")
+    return errors
+
+def _run_payment_dates(ctx):
+    fields, errors = find_payment_date_fields(ctx)
+    return (errors, {}), fields
+
+def _complete_payment_dates(result, fields, state):
+    return evaluate_payment_dates(*fields, timezone=state.get("timezone")) if fields is not None else result
+
+def _run_duplicate_end_to_end_id(ctx):
+    first_lines, errors, info = find_end_to_end_ids(ctx)
+    return (errors, info), first_lines
+
+def _complete_duplicate_end_to_end_id(result, first_lines, state):
+    errors, info = result
+    errors = list(errors)
+    if state["seen_end_to_end_ids"] is not None and first_lines:
+        # A rejected file's ids stay free, so its corrected version is not its own duplicate
+        record = state.get("file_passed", True) or E2E_RECORD_FAILED_FILES
+        try:
+            errors += record_end_to_end_ids(
+                first_lines, state["seen_end_to_end_ids"], state["current_filename"], state.get("max_errors"), record
+            )
+        except Exception as e:
+            errors.append(f"Error during Duplicate EndToEndId check: {str(e)}")
+    return errors, info
+
+
+# Registration order is the order errors and info messages are reported in
+for _check in (
+    ValidationCheck("total_file_control", check_total_file_control, "control_totals",
+                    outputs={"NbOfTxs": "nboftxs_passed", "CtrlSum": "ctrlsum_passed"},
+                    xpaths=("nb_of_txs", "ctrl_sum", "pmtinf", "pmtinf_id", "pmtinf_nb_of_txs", "pmtinf_ctrl_sum",
+                            "instd_amt")),
+    ValidationCheck("mod10", check_mod10_fields, "errors_info",
+                    outputs={"IBAN checksum": "iban_passed"},
+                    xpaths=("debtor_iban", "creditor_iban")),
+    ValidationCheck("aba_routing", check_aba_routing, "errors_info",
+                    xpaths=("debtor_agent_bic",)),
+    ValidationCheck("purpose_code", check_purpose_code, "errors",
+                    outputs={"Purpose Code": "purpose_code_passed"},
+                    xpaths=("purpose_code",)),
+    ValidationCheck("utf8_encoding", check_utf8_encoding, "errors",
+                    outputs={"UTF-8 Encoding": "utf8_encoding_passed"},
+                    in_stream_pass=False),
+    ValidationCheck("currency_codes", check_currency_codes, "errors",
+                    outputs={"Currency Code": "currency_code_passed"},
+                    xpaths=("instd_amt",)),
+    ValidationCheck("duplicate_message_id", _run_duplicate_message_id, "errors",
+                    outputs={"Duplicate Message ID": "duplicate_msgid_passed"},
+                    xpaths=("msg_id",),
+                    complete=_complete_duplicate_message_id),
+    ValidationCheck("member_id", check_member_id, "errors_info",
+                    outputs={"MmbId": "mmbid_passed"},
+                    xpaths=("debtor_agent_mmbid",)),
+    ValidationCheck("payment_dates", _run_payment_dates, "payment_dates",
+                    outputs={"Payment Dates": "payment_date_results"},
+                    xpaths=("cre_dt_tm", "pmtinf", "pmtinf_pmt_mtd", "pmtinf_svc_lvl", "pmtinf_lcl_instrm",
+                            "pmtinf_reqd_exctn_dt"),
+                    complete=_complete_payment_dates),
+    ValidationCheck("country_codes", check_country_codes, "errors",
+                    outputs={"Country Code": "country_code_passed"},
+                    xpaths=("country",)),
+    ValidationCheck("duplicate_end_to_end_id", _run_duplicate_end_to_end_id, "errors_info",
+                    outputs={"Duplicate EndToEndId": "duplicate_e2e_passed"},
+                    xpaths=("end_to_end_id",),
+                    complete=_complete_duplicate_end_to_end_id, complete_last=True),
+):
+    check_registry.register(_check)
+
+
+def _timed(timings, name, fn, *args):
+    start = time.perf_counter()
+    try:
+        return fn(*args)
+    finally:
+        timings[name] = round((time.perf_counter() - start) * 1000, 3)
+
+
+# Result of a stage that was skipped because the validation's time budget ran out
+SKIPPED = object()
+
+
+def _budgeted(ctx, timings, name, fn, *args):
+    """
+    Like _timed, for one stage of a validation: returns SKIPPED and records
+    the stage in ctx.budget if the budget is already spent or runs out while
+    the stage runs.
+    """
+    budget = ctx.budget
+    if budget is None:
+        return _timed(timings, name, fn, *args)
+    if budget.expired():
+        budget.skip(name)
+        return SKIPPED
+    try:
+        return _timed(timings, name, fn, *args)
+    except BudgetExceeded:
+        budget.skip(name)
+        return SKIPPED
+
+
+def _tree_xsd(ctx, xsd_file):
+    try:
+        return validate_tree(ctx.tree, xsd_file, ctx.max_errors)
+    except BudgetExceeded:
+        raise
+    except Exception as e:
+        return False, [f"Exception during validation: {e}"]
+
+
+def _parse(ctx):
+    try:
+        ctx.tree
+    except BudgetExceeded:
+        raise
+    except Exception:
+        pass  # reported by the XSD step and the checks that read the tree
+
+
+def tree_validate(ctx, xsd_file, checks=None, timings=None):
+    """
+    Parses the document, then runs the XSD step and the selected checks
+    (default: every enabled check) against the shared tree, recording each
+    stage's wall time in milliseconds into timings. Stateful and
+    time-dependent checks are left to complete_checks, with what they need
+    stored under results["deferred"]. Stages the context's time budget leaves
+    no room for are skipped; a skipped XSD step leaves results["xsd"] None.
+    With ctx.fail_fast the checks after the first failing one (the XSD step
+    included) are left out and listed in results["not_run"].
+    """
+    checks = check_registry.select() if checks is None else checks
+    timings = {} if timings is None else timings
+
+    results = {"xsd": None, "deferred": {}, "not_run": []}
+    if _budgeted(ctx, timings, "parse", _parse, ctx) is SKIPPED:
+        # Nothing can run without the tree
+        for name in ["xsd"] + [check.name for check in checks]:
+            ctx.budget.skip(name)
+        return results
+    xsd_result = _budgeted(ctx, timings, "xsd", _tree_xsd, ctx, xsd_file)
+    if xsd_result is not SKIPPED:
+        results["xsd"] = xsd_result
+    failed = ctx.fail_fast and xsd_result is not SKIPPED and not xsd_result[0]
+    for check in checks:
+        if failed:
+            results["not_run"].append(check.name)
+            continue
+        result = _budgeted(ctx, timings, check.name, check.run, ctx)
+        if result is SKIPPED:
+            continue
+        if check.complete is not None:
+            result, results["deferred"][check.name] = result
+        results[check.name] = result
+        failed = ctx.fail_fast and bool(check.summarize(result)[0])
+    return results
+
+
+def complete_checks(results, seen_message_ids, seen_end_to_end_ids, current_filename, timezone=None, max_errors=None):
+    """
+    Finishes the checks that depend on state outside the file (the MsgId and
+    EndToEndId indexes) or on the current time (payment dates) from the fields
+    the validators left in results["deferred"]. Everything else in results is
+    a pure function of the file, which is what makes it safe to cache.
+    timezone is the company timezone the payment date checks run in and
+    max_errors the errors each check collects (see errors_to_collect). Checks marked
+    complete_last complete after the others and learn whether the file passed.
+    """
+    state = {
+        "seen_message_ids": seen_message_ids,
+        "seen_end_to_end_ids": seen_end_to_end_ids,
+        "current_filename": current_filename,
+        "timezone": timezone,
+        "max_errors": max_errors,
+    }
+    completed = dict(results)
+    last = [name for name in results["deferred"] if check_registry.get(name).complete_last]
+    for name, deferred in results["deferred"].items():
+        if name not in last:
+            completed[name] = check_registry.get(name).complete(results[name], deferred, state)
+    if last:
+        xsd = completed.get("xsd")
+        state["file_passed"] = xsd is not None and xsd[0] and not completed.get("not_run") and not any(
+            check_registry.get(name).summarize(result)[0]
+            for name, result in completed.items() if name not in ("xsd", "deferred", "not_run")
+        )
+    for name in last:
+        completed[name] = check_registry.get(name).complete(results[name], results["deferred"][name], state)
+    return completed
+
+
+def validate_and_compare(xml_file, version, seen_ids=None, company_id=None, seen_e2e_ids=None, checks=None,
+                         profile=None, upload_pass=None, budget=None, max_errors=None, fail_fast=False):
+    """
+    xml_file is a path or a ValidationContext, which may hold the document's
+    bytes so that nothing is read from disk.
+
+    seen_ids and seen_e2e_ids are the MsgId and EndToEndId index scopes the
+    duplicate checks record against. They default to company_id's scope of the
+    shared indexes; batch callers pass their own to scope the checks to the batch.
+    The EndToEndIds of a file that fails are only looked up, not recorded,
+    unless E2E_RECORD_FAILED_FILES is set.
+
+    checks optionally names the registered checks to run (see check_registry);
+    by default every enabled check runs. Per-check wall times in milliseconds
+    are returned in extra_info["check_timings_ms"].
+
+    profile optionally applies a company validation profile: only its enabled
+    checks run (narrowed further by checks), its currency and purpose code
+    lists replace the defaults and payment dates are checked in its timezone.
+
+    upload_pass optionally carries the streaming pass that already ran while
+    xml_file was uploaded (sha256, xsd_result, pass_results and elapsed_ms,
+    see services.file_validation_service.UploadPass); the file is then not
+    walked again.
+
+    budget is the TimeBudget of the run (a fresh one of
+    VALIDATION_TIME_BUDGET_SECONDS by default). Each stage checks it before it
+    starts; once it is spent the remaining stages are skipped, the partial
+    result is not cached, nothing is recorded in the MsgId and EndToEndId
+    indexes and extra_info["skipped_stages"] lists what did not run.
+
+    max_errors caps the errors each check collects and the errors returned;
+    fail_fast stops at the first failing check (the XSD step included), which
+    then only collects its first error unless max_errors allows more. When
+    either cut something, extra_info["truncated"] is true and the last error
+    says so.
+    """
+    if profile is not None:
+        checks = profile.select_checks(checks)
+    if seen_ids is None:
+        seen_ids = message_id_index.for_company(company_id)
+    if seen_e2e_ids is None:
+        seen_e2e_ids = end_to_end_id_index.for_company(company_id)
+    selected = check_registry.select(checks)
     xsd_file = os.path.join(SCHEMA_DIR, f"{version}.xsd")
     reference_file = os.path.join(REFERENCE_DIR, f"ref_{version[-2:]}.xml")
-    
-    if not os.path.exists(xml_file):
+
+    # Parse once; the XSD step and every check below share this context
+    ctx = as_validation_context(xml_file)
+    xml_file = ctx.xml_path
+    ctx.budget = budget = TimeBudget() if budget is None else budget
+    cap = error_cap(max_errors, fail_fast)
+    ctx.max_errors = errors_to_collect(cap)
+    ctx.fail_fast = fail_fast
+    if profile is not None:
+        if profile.allowed_currencies is not None:
+            ctx.allowed_currencies = profile.allowed_currencies
+        if profile.allowed_purpose_codes is not None:
+            ctx.allowed_purpose_codes = profile.allowed_purpose_codes
+
+    if not ctx.exists():
         logging.error(f"File not found for validation: {xml_file}")
         return False, ["Generated XML not found."], [], {}
 
-    # 1. XSD validation
-    valid, xsd_errors = validate(xml_file, xsd_file)
-    validation_errors = [extract_line_number_from_error(e) for e in xsd_errors] if not valid else []
-
-    # 2. Additional Structure and Logical Checks
-    total_control_errors, nboftxs_passed, ctrlsum_passed = check_total_file_control(xml_file)
-    mod10_errors, mod10_info = check_mod10_fields(xml_file)
-    aba_errors, aba_info = check_aba_routing(xml_file)
-    mmbid_errors, mmbid_info = check_member_id(xml_file)   # <-- NEW
-
-    # 3. New Checks (the 4 you added)
-    purpose_code_errors = check_purpose_code(xml_file)
-    utf8_encoding_errors = check_utf8_encoding(xml_file)
-    currency_code_errors = check_currency_codes(xml_file)
-    duplicate_msgid_errors = check_duplicate_message_id(xml_file, seen_message_ids, os.path.basename(xml_file))
-    payment_date_errors, payment_date_results = check_payment_dates(xml_file)
-    country_code_errors = check_country_codes(xml_file)
-    duplicate_e2e_errors, duplicate_e2e_info = check_duplicate_end_to_end_id(xml_file)
-
-    purpose_code_passed = len(purpose_code_errors) == 0
-    utf8_encoding_passed = len(utf8_encoding_errors) == 0
-    currency_code_passed = len(currency_code_errors) == 0
-    duplicate_msgid_passed = len(duplicate_msgid_errors) == 0
-    iban_passed = len(mod10_errors) == 0                 # <-- NEW
-    mmbid_passed = len(mmbid_errors) == 0                 # <-- NEW
-    country_code_passed = len(country_code_errors) == 0
-    duplicate_e2e_passed = len(duplicate_e2e_errors) == 0
-
-    # 4. Collect all errors together
-    real_errors = (
-        validation_errors +
-        total_control_errors +
-        mod10_errors +
-        aba_errors +
-        purpose_code_errors +
-        utf8_encoding_errors +
-        currency_code_errors +
-        duplicate_msgid_errors +
-        mmbid_errors +
-        payment_date_errors +
-        country_code_errors +
-        duplicate_e2e_errors
-    )
-    
+    streaming = ctx.size() > STREAMING_THRESHOLD_BYTES
+
+    # A byte-identical file validated before reuses its file-only results; the
+    # stateful and time-dependent checks still run in complete_checks below
+    cache_key = None
+    cached = None
+    if RESULT_CACHE_ENABLED:
+        cache_key = result_cache.make_key(
+            upload_pass.sha256 if upload_pass is not None else ctx.sha256(), version, VALIDATION_RULESET_VERSION, ctx.reference.version,
+            "upload" if upload_pass is not None else "stream" if streaming else "tree",
+            ",".join(check.name for check in selected),
+            profile.fingerprint() if profile is not None else "",
+            f"{cap}:{fail_fast}"
+        )
+        cached = result_cache.get(cache_key)
+
+    timings = {}
+    if cached is not None:
+        logging.info(f"Reusing cached validation results for {xml_file}")
+        results, differences = cached
+    else:
+        # Very large files are validated in a single bounded-memory pass
+        if upload_pass is not None:
+            results = upload_validate(ctx, xsd_file, upload_pass, selected, timings, full_xsd_errors=not streaming)
+        elif streaming:
+            logging.info(f"{xml_file} exceeds {STREAMING_THRESHOLD_BYTES} bytes; validating in streaming mode")
+            results = stream_validate(ctx, xsd_file, selected, timings)
+        else:
+            results = tree_validate(ctx, xsd_file, selected, timings)
+        differences = []
+        if ENABLE_XML_DIFF and os.path.exists(reference_file):
+            if budget.expired():
+                budget.skip("xml_diff")
+            elif ctx.data is not None:
+                with open(reference_file, "rb") as f:
+                    differences = xmldiff.diff_texts(f.read(), ctx.data)
+            else:
+                differences = xmldiff.diff_files(reference_file, xml_file)
+        if cache_key is not None and not budget.skipped:
+            result_cache.put(cache_key, (results, differences))
+
+    if budget.expired() and results["deferred"]:
+        # A validation that ran out of time records no ids it might be retried with
+        results = {name: result for name, result in results.items() if name not in results["deferred"]}
+        for name in results["deferred"]:
+            budget.skip(name)
+        results["deferred"] = {}
+    results = _timed(timings, "complete_checks", complete_checks, results, seen_ids, seen_e2e_ids, os.path.basename(xml_file),
+                     profile.timezone if profile is not None else None, ctx.max_errors)
+    if timings:
+        logging.debug(f"Check timings for {xml_file} (ms): {timings}")
+
+    # XSD validation; a skipped XSD step counts as not passed
+    valid, xsd_errors = results["xsd"] if results["xsd"] is not None else (False, [])
+    real_errors = [extract_line_number_from_error(e) for e in xsd_errors[:cap]] if not valid else []
+    truncated = not valid and cap is not None and len(xsd_errors) > cap
+
+    # Business checks, in registry order
+    info_messages = []
+    extra_info = {}
+    for check in selected:
+        if check.name not in results:
+            continue  # skipped, see extra_info["skipped_stages"], or not run with fail_fast
+        errors, info, values = check.summarize(results[check.name])
+        # Each check collects one error past the cap, which only exists if the cap cut something
+        truncated = truncated or (cap is not None and len(errors) > cap)
+        real_errors += errors[:cap]
+        info_messages += info
+        extra_info.update(values)
+
     # Sort errors by line number
     def extract_line_number(error):
         match = re.search(r"Line (\d+)", error)
         return int(match.group(1)) if match else 99999  # If no line info, push it last
 
     real_errors = sorted(real_errors, key=extract_line_number)
-
-    # 5. Info messages (not real errors)
-    info_messages = mod10_info + aba_info + mmbid_info + duplicate_e2e_info
-
-    # 6. XML Diff (optional)
-    differences = xmldiff.diff_files(reference_file, xml_file) if ENABLE_XML_DIFF and os.path.exists(reference_file) else []
-
-    # 7. Build extra_info for console reporting
-    extra_info = {
-    "nboftxs_passed": nboftxs_passed,
-    "ctrlsum_passed": ctrlsum_passed,
-    "purpose_code_passed": purpose_code_passed,
-    "utf8_encoding_passed": utf8_encoding_passed,
-    "currency_code_passed": currency_code_passed,
-    "duplicate_msgid_passed": duplicate_msgid_passed,
-    "iban_passed": iban_passed,
-    "mmbid_passed": mmbid_passed,
-    "payment_date_results": payment_date_results,
-    "country_code_passed": country_code_passed,
-    "duplicate_e2e_passed": duplicate_e2e_passed,
-    "info_messages": info_messages
-    }
+    if max_errors is not None and len(real_errors) > max_errors:
+        real_errors = real_errors[:max_errors]
+        truncated = True
+    if truncated:
+        real_errors.append(
+            f"Error output truncated to the first {max_errors} errors; the file may contain more." if max_errors is not None
+            else "Error output truncated to the first error of the failing check; the file may contain more."
+        )
+    not_run = results.get("not_run", [])
+    if not_run:
+        real_errors.append(f"Stopped at the first failing check (fail_fast); not run: {', '.join(not_run)}.")
+    if budget.skipped:
+        logging.warning(f"Validation of {xml_file} stopped ({budget.reason}); skipped: {budget.skipped}")
+        real_errors.append(budget.describe())
+
+    extra_info["info_messages"] = info_messages
+    extra_info["check_timings_ms"] = timings
+    extra_info["skipped_stages"] = list(budget.skipped)
+    extra_info["truncated"] = truncated or bool(not_run)
 
     return valid and not real_errors, real_errors, differences, extra_info
 
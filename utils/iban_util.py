@@ -0,0 +1,96 @@
+import os
+import re
+import string
+from functools import lru_cache
+
+# IBAN_CACHE_SIZE: distinct IBANs whose verdict is kept in memory
+IBAN_CACHE_SIZE = int(os.getenv("IBAN_CACHE_SIZE", 65536))
+
+# BBAN structure per country from the SWIFT IBAN registry, in the registry's
+# notation: <length>!n digits, !a upper case letters, !c letters or digits.
+# The full IBAN length is 4 (country code and check digits) plus the BBAN length.
+IBAN_BBAN_FORMATS = {
+    "AD": "4!n4!n12!c", "AE": "3!n16!n", "AL": "8!n16!c", "AT": "5!n11!n", "AZ": "4!a20!c",
+    "BA": "3!n3!n8!n2!n", "BE": "3!n7!n2!n", "BG": "4!a4!n2!n8!c", "BH": "4!a14!c", "BI": "5!n5!n11!n2!n",
+    "BR": "8!n5!n10!n1!a1!c", "BY": "4!c4!n16!c", "CH": "5!n12!c", "CR": "4!n14!n", "CY": "3!n5!n16!c",
+    "CZ": "4!n6!n10!n", "DE": "8!n10!n", "DJ": "5!n5!n11!n2!n", "DK": "4!n9!n1!n", "DO": "4!c20!n",
+    "EE": "2!n2!n11!n1!n", "EG": "4!n4!n17!n", "ES": "4!n4!n1!n1!n10!n", "FI": "3!n11!n", "FK": "2!a12!n",
+    "FO": "4!n9!n1!n", "FR": "5!n5!n11!c2!n", "GB": "4!a6!n8!n", "GE": "2!a16!n", "GI": "4!a15!c",
+    "GL": "4!n9!n1!n", "GR": "3!n4!n16!c", "GT": "4!c20!c", "HR": "7!n10!n", "HU": "3!n4!n1!n15!n1!n",
+    "IE": "4!a6!n8!n", "IL": "3!n3!n13!n", "IQ": "4!a3!n12!n", "IS": "4!n2!n6!n10!n", "IT": "1!a5!n5!n12!c",
+    "JO": "4!a4!n18!c", "KW": "4!a22!c", "KZ": "3!n13!c", "LB": "4!n20!c", "LC": "4!a24!c",
+    "LI": "5!n12!c", "LT": "5!n11!n", "LU": "3!n13!c", "LV": "4!a13!c", "LY": "3!n3!n15!n",
+    "MC": "5!n5!n11!c2!n", "MD": "2!c18!c", "ME": "3!n13!n2!n", "MK": "3!n10!c2!n", "MN": "4!n12!n",
+    "MR": "5!n5!n11!n2!n", "MT": "4!a5!n18!c", "MU": "4!a2!n2!n12!n3!n3!a", "NI": "4!a20!n", "NL": "4!a10!n",
+    "NO": "4!n6!n1!n", "OM": "3!n16!c", "PK": "4!a16!c", "PL": "8!n16!n", "PS": "4!a21!c",
+    "PT": "4!n4!n11!n2!n", "QA": "4!a21!c", "RO": "4!a16!c", "RS": "3!n13!n2!n", "RU": "9!n5!n15!c",
+    "SA": "2!n18!c", "SC": "4!a2!n2!n16!n3!a", "SD": "2!n12!n", "SE": "3!n16!n1!n", "SI": "5!n8!n2!n",
+    "SK": "4!n6!n10!n", "SM": "1!a5!n5!n12!c", "SO": "4!n3!n12!n", "ST": "8!n11!n2!n", "SV": "4!a20!n",
+    "TL": "3!n14!n2!n", "TN": "2!n3!n13!n2!n", "TR": "5!n1!n16!c", "UA": "6!n19!c", "VA": "3!n15!n",
+    "VG": "4!a16!n", "XK": "4!n10!n2!n", "YE": "4!a4!n18!c",
+}
+
+_CHARACTER_CLASSES = {"n": "[0-9]", "a": "[A-Z]", "c": "[A-Za-z0-9]"}
+
+
+def _compile_bban(spec):
+    """'4!a6!n' -> (10, regex matching four letters and six digits)."""
+    parts = re.findall(r"(\d+)!([nac])", spec)
+    pattern = "".join(f"{_CHARACTER_CLASSES[kind]}{{{count}}}" for count, kind in parts)
+    return sum(int(count) for count, _ in parts), re.compile(pattern)
+
+
+# country -> (IBAN length, compiled BBAN pattern), built once at import
+IBAN_REGISTRY = {}
+for _country, _spec in IBAN_BBAN_FORMATS.items():
+    _bban_length, _bban_pattern = _compile_bban(_spec)
+    IBAN_REGISTRY[_country] = (4 + _bban_length, _bban_pattern)
+
+# A -> 10 ... Z -> 35, as ISO 13616 maps letters for the checksum
+_LETTER_DIGITS = str.maketrans({
+    letter: str(value) for value, letter in enumerate(string.ascii_uppercase, start=10)
+})
+
+
+def iban_mod97(iban: str) -> int:
+    """
+    ISO 13616 remainder of an IBAN. The letter expansion is a single
+    str.translate and the ~70 digit number a single int(); in CPython that
+    is about twice as fast as folding the remainder in fixed-size chunks.
+    """
+    return int((iban[4:] + iban[:4]).upper().translate(_LETTER_DIGITS)) % 97
+
+
+@lru_cache(maxsize=IBAN_CACHE_SIZE)
+def iban_problem(iban: str):
+    """
+    Returns None for a valid IBAN, otherwise the reason it is invalid. Cached,
+    since payroll files repeat the same accounts thousands of times.
+    """
+    if len(iban) < 5 or not iban.isascii() or not iban.isalnum():
+        return "malformed"
+    country = iban[:2]
+    entry = IBAN_REGISTRY.get(country)
+    if entry is None:
+        return "unknown_country"
+    length, bban_pattern = entry
+    if len(iban) != length:
+        return "length"
+    if not iban[2:4].isdigit() or not bban_pattern.fullmatch(iban, 4):
+        return "structure"
+    if iban_mod97(iban) != 1:
+        return "checksum"
+    return None
+
+
+def describe_iban_problem(iban: str, problem: str) -> str:
+    """Human readable reason for an iban_problem() result."""
+    if problem == "checksum":
+        return f"Mod10 check failed for IBAN: {iban}"
+    if problem == "unknown_country":
+        return f"IBAN country code '{iban[:2]}' is not in the IBAN registry: {iban}"
+    if problem == "length":
+        return f"IBAN for {iban[:2]} must be {IBAN_REGISTRY[iban[:2]][0]} characters, found {len(iban)}: {iban}"
+    if problem == "structure":
+        return f"IBAN does not match the {iban[:2]} account format: {iban}"
+    return f"IBAN is malformed: {iban}"
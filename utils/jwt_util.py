@@ -23,6 +23,8 @@ pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 # === TOKEN EXTRACTOR ===
 # oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/login")
 oauth2_scheme = APIKeyHeader(name="Authorization")
+# For endpoints that also serve anonymous callers
+optional_oauth2_scheme = APIKeyHeader(name="Authorization", auto_error=False)
 
 # ================================
 # 🔐 Password Utilities
@@ -0,0 +1,314 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+
+from redis.client import NEVER_DECODE
+from redis.exceptions import RedisError
+
+from utils.redis_util import redis_client, REDIS_CONFIGURED
+
+# MSGID_INDEX_BACKEND: "redis" (shared by every worker, survives restarts) or
+# "memory" (process-local); defaults to redis only when REDIS_HOST is set
+# MSGID_WINDOW_DAYS: how long a MsgId stays reserved unless the company has its own window
+# MSGID_COMPANY_WINDOW_DAYS: JSON object of company_id -> window in days, e.g. {"12": 30}
+# MSGID_BLOOM_ENABLED: answer "never seen" from a local Bloom filter without a Redis round trip
+# MSGID_BLOOM_BITS / MSGID_BLOOM_HASHES: size of each Bloom filter generation
+# MSGID_BLOOM_SYNC_SECONDS: how often the local filters are synced with Redis
+MSGID_INDEX_BACKEND = os.getenv("MSGID_INDEX_BACKEND", "redis" if REDIS_CONFIGURED else "memory")
+MSGID_WINDOW_DAYS = int(os.getenv("MSGID_WINDOW_DAYS", 90))
+MSGID_COMPANY_WINDOW_DAYS = {str(k): int(v) for k, v in json.loads(os.getenv("MSGID_COMPANY_WINDOW_DAYS", "{}")).items()}
+MSGID_BLOOM_ENABLED = os.getenv("MSGID_BLOOM_ENABLED", "false").lower() == "true"
+MSGID_BLOOM_BITS = int(os.getenv("MSGID_BLOOM_BITS", 8 * 1024 * 1024))
+MSGID_BLOOM_HASHES = int(os.getenv("MSGID_BLOOM_HASHES", 7))
+MSGID_BLOOM_SYNC_SECONDS = float(os.getenv("MSGID_BLOOM_SYNC_SECONDS", 5))
+
+DEFAULT_SCOPE = "default"
+
+# Returns the filenames that used the MsgId before, appends the current one and
+# marks the id in the company's Bloom bitmap, all in one round trip. The key
+# expiry is only set when the id is first seen so the window is counted from
+# first use.
+_RECORD_SCRIPT = """
+local previous = redis.call('LRANGE', KEYS[1], 0, -1)
+if redis.call('RPUSH', KEYS[1], ARGV[1]) == 1 then
+    redis.call('EXPIRE', KEYS[1], ARGV[2])
+end
+for i = 4, #ARGV do
+    redis.call('SETBIT', KEYS[2], ARGV[i], 1)
+end
+redis.call('EXPIRE', KEYS[2], ARGV[3])
+return previous
+"""
+
+
+def _scope(company_id) -> str:
+    return DEFAULT_SCOPE if company_id is None else str(company_id)
+
+
+def window_seconds(company_id=None) -> int:
+    days = MSGID_COMPANY_WINDOW_DAYS.get(_scope(company_id), MSGID_WINDOW_DAYS)
+    return days * 86400
+
+
+def set_company_window(company_id, days: int):
+    """Overrides the duplicate MsgId window for one company."""
+    MSGID_COMPANY_WINDOW_DAYS[_scope(company_id)] = int(days)
+
+
+def bloom_positions(key: str, num_bits: int, num_hashes: int) -> list:
+    # Double hashing over one SHA-256 digest
+    digest = hashlib.sha256(key.encode("utf-8")).digest()
+    h1 = int.from_bytes(digest[:8], "big")
+    h2 = int.from_bytes(digest[8:16], "big") | 1
+    return [(h1 + i * h2) % num_bits for i in range(num_hashes)]
+
+
+class BloomFilter:
+    """
+    Fixed-size Bloom filter. Bit order matches Redis SETBIT (bit 0 is the most
+    significant bit of the first byte) so a bitmap read from Redis can be used as is.
+    """
+
+    def __init__(self, num_bits=MSGID_BLOOM_BITS, num_hashes=MSGID_BLOOM_HASHES, bits=None):
+        self.num_bits = num_bits
+        self.num_hashes = num_hashes
+        self.bits = bytearray(num_bits // 8)
+        if bits:
+            self.merge(bits)
+
+    def positions(self, key: str) -> list:
+        return bloom_positions(key, self.num_bits, self.num_hashes)
+
+    def add(self, key: str):
+        for pos in self.positions(key):
+            self.bits[pos >> 3] |= 0x80 >> (pos & 7)
+
+    def __contains__(self, key: str) -> bool:
+        return all(self.bits[pos >> 3] & (0x80 >> (pos & 7)) for pos in self.positions(key))
+
+    def merge(self, bits: bytes):
+        """ORs a bitmap (e.g. from Redis GET, which may be shorter than the filter) into this one."""
+        size = min(len(bits), len(self.bits))
+        merged = int.from_bytes(self.bits[:size], "big") | int.from_bytes(bits[:size], "big")
+        self.bits[:size] = merged.to_bytes(size, "big")
+
+
+class MessageIdScope:
+    """A company's view of an index; this is what the validators record MsgIds against."""
+
+    def __init__(self, index, company_id=None):
+        self.index = index
+        self.company_id = company_id
+
+    def record(self, msg_id: str, filename: str) -> list:
+        return self.index.record(msg_id, filename, self.company_id)
+
+
+class InMemoryMessageIdIndex:
+    """
+    Process-local MsgId index with the same windows as the Redis index. Used
+    for tests, single-worker development and to scope a batch to itself.
+    """
+
+    PRUNE_EVERY = 1000
+
+    def __init__(self):
+        self._entries = {}  # (scope, msg_id) -> (first_seen, [filenames])
+        self._lock = threading.Lock()
+        self._records = 0
+
+    def record(self, msg_id: str, filename: str, company_id=None) -> list:
+        """Registers msg_id for filename and returns the files that used it within the window."""
+        key = (_scope(company_id), msg_id)
+        now = time.time()
+        with self._lock:
+            self._records += 1
+            if self._records % self.PRUNE_EVERY == 0:
+                self._prune(now)
+            entry = self._entries.get(key)
+            if entry is None or now - entry[0] > window_seconds(company_id):
+                self._entries[key] = (now, [filename])
+                return []
+            previous = list(entry[1])
+            entry[1].append(filename)
+            return previous
+
+    def _prune(self, now):
+        expired = [key for key, (first_seen, _) in self._entries.items()
+                   if now - first_seen > window_seconds(key[0])]
+        for key in expired:
+            del self._entries[key]
+
+    def message_ids(self, company_id=None) -> list:
+        scope = _scope(company_id)
+        with self._lock:
+            return [msg_id for (entry_scope, msg_id) in self._entries if entry_scope == scope]
+
+    def for_company(self, company_id=None) -> MessageIdScope:
+        return MessageIdScope(self, company_id)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def close(self):
+        pass
+
+
+class RedisMessageIdIndex:
+    """
+    MsgId index shared by every API worker through Redis.
+
+    Each MsgId is a list key msgid:<company>:<MsgId> holding the files that used
+    it and expiring one company window after first use. Recording is one
+    atomic script call, so two workers cannot both accept the same MsgId.
+
+    With bloom=True each worker also keeps a local copy of the company's Bloom
+    bitmaps (one per window generation, maintained by the same script). A MsgId
+    the filter has never seen, which is the usual case, is accepted without a
+    round trip and written to Redis by a background thread. The tradeoff is a
+    lag of up to MSGID_BLOOM_SYNC_SECONDS: if another worker accepts the same
+    MsgId within that lag, the duplicate is only logged when the write is
+    flushed rather than reported on the file.
+    """
+
+    KEY_PREFIX = "msgid:"
+    BLOOM_KEY_PREFIX = "msgid_bloom:"
+
+    def __init__(self, client=redis_client, bloom=MSGID_BLOOM_ENABLED,
+                 bloom_bits=MSGID_BLOOM_BITS, bloom_hashes=MSGID_BLOOM_HASHES,
+                 sync_seconds=MSGID_BLOOM_SYNC_SECONDS):
+        self.client = client
+        self.bloom = bloom
+        self.bloom_bits = bloom_bits
+        self.bloom_hashes = bloom_hashes
+        self.sync_seconds = sync_seconds
+        self._record_script = client.register_script(_RECORD_SCRIPT)
+
+        self._lock = threading.Lock()
+        self._filters = {}  # (scope, generation) -> BloomFilter
+        self._pending = []  # record() arguments accepted locally, not yet written
+        self._sync_thread = None
+        self._stopped = threading.Event()
+
+    def _keys(self, scope, msg_id, generation):
+        return [f"{self.KEY_PREFIX}{scope}:{msg_id}", f"{self.BLOOM_KEY_PREFIX}{scope}:{generation}"]
+
+    def _record_remote(self, msg_id, filename, scope, window, generation, client=None):
+        # The bitmap outlives its generation by one window so the previous
+        # generation can still be consulted
+        args = [filename, window, window * 2] + bloom_positions(msg_id, self.bloom_bits, self.bloom_hashes)
+        return self._record_script(keys=self._keys(scope, msg_id, generation), args=args, client=client)
+
+    def record(self, msg_id: str, filename: str, company_id=None) -> list:
+        """Registers msg_id for filename and returns the files that used it within the window."""
+        scope = _scope(company_id)
+        window = window_seconds(company_id)
+        generation = int(time.time() // window)
+
+        if self.bloom:
+            current, previous = self._local_filters(scope, generation)
+            with self._lock:
+                if msg_id not in current and msg_id not in previous:
+                    current.add(msg_id)
+                    self._pending.append((msg_id, filename, scope, window, generation))
+                    return []
+            # Possibly seen: write anything accepted locally first so a repeat
+            # within this worker is found by the lookup
+            self.flush()
+
+        return self._record_remote(msg_id, filename, scope, window, generation)
+
+    def _local_filters(self, scope, generation):
+        with self._lock:
+            current = self._filters.get((scope, generation))
+            previous = self._filters.get((scope, generation - 1))
+        if current is None or previous is None:
+            self._sync_filters([(scope, generation)])
+            self._start_sync_thread()
+            with self._lock:
+                current = self._filters[(scope, generation)]
+                previous = self._filters[(scope, generation - 1)]
+        return current, previous
+
+    def _sync_filters(self, wanted):
+        """Pulls the current and previous generation bitmaps of each (scope, generation) into the local filters."""
+        keys = [(scope, g) for scope, generation in wanted for g in (generation, generation - 1)]
+        pipe = self.client.pipeline(transaction=False)
+        for scope, g in keys:
+            pipe.execute_command("GET", f"{self.BLOOM_KEY_PREFIX}{scope}:{g}", **{NEVER_DECODE: True})
+        bitmaps = pipe.execute()
+        with self._lock:
+            for key, bits in zip(keys, bitmaps):
+                local = self._filters.get(key)
+                if local is None:
+                    local = self._filters[key] = BloomFilter(self.bloom_bits, self.bloom_hashes)
+                if bits:
+                    local.merge(bits)
+
+    def flush(self):
+        """Writes MsgIds accepted by the Bloom front to Redis in one pipeline."""
+        with self._lock:
+            pending, self._pending = self._pending, []
+        if not pending:
+            return
+        pipe = self.client.pipeline(transaction=False)
+        for msg_id, filename, scope, window, generation in pending:
+            self._record_remote(msg_id, filename, scope, window, generation, client=pipe)
+        try:
+            results = pipe.execute()
+        except RedisError:
+            logging.exception("Failed to flush Message IDs to Redis; will retry")
+            with self._lock:
+                self._pending = pending + self._pending
+            return
+        for (msg_id, filename, scope, _, _), previous in zip(pending, results):
+            if previous:
+                logging.warning(
+                    f"Duplicate Message ID '{msg_id}' in {filename} (company {scope}) was accepted by the "
+                    f"Bloom front before another worker's use was synced. (Already used in files: {previous})"
+                )
+
+    def _sync_loop(self):
+        while not self._stopped.wait(self.sync_seconds):
+            try:
+                self.flush()
+                now = time.time()
+                with self._lock:
+                    scopes = {scope for scope, _ in self._filters}
+                wanted = [(scope, int(now // window_seconds(scope)))
+                          for scope in scopes]
+                self._sync_filters(wanted)
+                with self._lock:
+                    current = set(wanted) | {(scope, g - 1) for scope, g in wanted}
+                    for key in [key for key in self._filters if key not in current]:
+                        del self._filters[key]
+            except Exception:
+                logging.exception("Message ID Bloom filter sync failed")
+
+    def _start_sync_thread(self):
+        with self._lock:
+            if self._sync_thread is None:
+                self._sync_thread = threading.Thread(target=self._sync_loop, name="msgid-bloom-sync", daemon=True)
+                self._sync_thread.start()
+
+    def for_company(self, company_id=None) -> MessageIdScope:
+        return MessageIdScope(self, company_id)
+
+    def close(self):
+        self._stopped.set()
+        self.flush()
+
+
+def create_message_id_index(backend=MSGID_INDEX_BACKEND):
+    if backend == "redis":
+        return RedisMessageIdIndex()
+    if backend == "memory":
+        return InMemoryMessageIdIndex()
+    raise ValueError(f"Invalid Message ID index backend: {backend}")
+
+
+message_id_index = create_message_id_index()
@@ -2,6 +2,10 @@
 import redis
 import os
 
+# REDIS_HOST / REDIS_PORT: where the shared Redis runs. Features that can
+# share state through Redis only default to it when REDIS_HOST is set.
+REDIS_CONFIGURED = bool(os.getenv("REDIS_HOST"))
+
 redis_client = redis.Redis(
     host=os.getenv("REDIS_HOST", "localhost"),
     port=int(os.getenv("REDIS_PORT", 6379)),
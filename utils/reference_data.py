@@ -0,0 +1,102 @@
+import hashlib
+import logging
+import os
+import threading
+import time
+
+# REFERENCE_DATA_DIR: directory holding the bundled ISO code lists
+# REFERENCE_DATA_CHECK_SECONDS: how often the files are checked for changes and
+# reloaded; 0 loads them once at import only
+REFERENCE_DATA_DIR = os.getenv(
+    "REFERENCE_DATA_DIR",
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "reference_data"),
+)
+REFERENCE_DATA_CHECK_SECONDS = float(os.getenv("REFERENCE_DATA_CHECK_SECONDS", 30))
+
+CURRENCY_FILE = "iso4217_currencies.tsv"
+COUNTRY_FILE = "iso3166_countries.tsv"
+PURPOSE_CODE_FILE = "external_purpose_codes.tsv"
+REFERENCE_FILES = (CURRENCY_FILE, COUNTRY_FILE, PURPOSE_CODE_FILE)
+
+
+class ReferenceData:
+    """
+    One consistent snapshot of the code lists. A reload builds a new snapshot
+    and swaps it in, so a validation run that holds one never sees a mix.
+    version is a digest of the files, for result cache keys.
+    """
+
+    def __init__(self, currencies, countries, country_names, purpose_codes, version):
+        self.currencies = currencies
+        self.countries = countries
+        self.country_names = country_names  # upper-cased alpha-2, alpha-3 and names
+        self.purpose_codes = purpose_codes
+        self.version = version
+
+    def is_country(self, value) -> bool:
+        """Whether value is an ISO 3166 alpha-2 or alpha-3 code or a country name, ignoring case."""
+        return bool(value) and value.strip().upper() in self.country_names
+
+
+def _rows(text):
+    for line in text.splitlines():
+        if line.strip() and not line.startswith("#"):
+            yield line.rstrip("\n").split("\t")
+
+
+def load_reference_data(directory=REFERENCE_DATA_DIR) -> ReferenceData:
+    texts = {}
+    digest = hashlib.sha256()
+    for name in REFERENCE_FILES:
+        with open(os.path.join(directory, name), "rb") as f:
+            content = f.read()
+        digest.update(content)
+        texts[name] = content.decode("utf-8")
+
+    currencies = frozenset(row[0] for row in _rows(texts[CURRENCY_FILE]))
+    countries = frozenset(row[0] for row in _rows(texts[COUNTRY_FILE]))
+    country_names = frozenset(
+        name.upper()
+        for row in _rows(texts[COUNTRY_FILE])
+        for name in [row[0], row[1], row[3]] + (row[4].split("|") if len(row) > 4 else [])
+        if name
+    )
+    purpose_codes = frozenset(row[0] for row in _rows(texts[PURPOSE_CODE_FILE]))
+    return ReferenceData(currencies, countries, country_names, purpose_codes, digest.hexdigest()[:12])
+
+
+def _file_stamps(directory):
+    stamps = []
+    for name in REFERENCE_FILES:
+        stat = os.stat(os.path.join(directory, name))
+        stamps.append((stat.st_mtime_ns, stat.st_size))
+    return tuple(stamps)
+
+
+_lock = threading.Lock()
+_stamps = _file_stamps(REFERENCE_DATA_DIR)
+_current = load_reference_data()
+_checked_at = time.monotonic()
+
+
+def get_reference_data() -> ReferenceData:
+    """
+    The current snapshot. At most every REFERENCE_DATA_CHECK_SECONDS the files
+    are stat'ed and reloaded if they changed; a file that fails to load keeps
+    the previous snapshot in place.
+    """
+    global _current, _stamps, _checked_at
+    if REFERENCE_DATA_CHECK_SECONDS <= 0 or time.monotonic() - _checked_at < REFERENCE_DATA_CHECK_SECONDS:
+        return _current
+    with _lock:
+        if time.monotonic() - _checked_at >= REFERENCE_DATA_CHECK_SECONDS:
+            try:
+                stamps = _file_stamps(REFERENCE_DATA_DIR)
+                if stamps != _stamps:
+                    _current = load_reference_data()
+                    _stamps = stamps
+                    logging.info(f"Reloaded reference data from {REFERENCE_DATA_DIR} (version {_current.version})")
+            except Exception as e:
+                logging.error(f"Keeping reference data version {_current.version}; reload failed: {e}")
+            _checked_at = time.monotonic()
+    return _current
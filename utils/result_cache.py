@@ -0,0 +1,111 @@
+import hashlib
+import logging
+import os
+import pickle
+import threading
+from collections import OrderedDict
+
+from redis.client import NEVER_DECODE
+from redis.exceptions import RedisError
+
+from utils.redis_util import redis_client
+
+# RESULT_CACHE_ENABLED: reuse the results of a byte-identical file validated before
+# RESULT_CACHE_SIZE: entries kept in the in-process LRU
+# RESULT_CACHE_REDIS: also share entries between workers through Redis
+# RESULT_CACHE_TTL_SECONDS: lifetime of the Redis entries
+RESULT_CACHE_ENABLED = os.getenv("RESULT_CACHE_ENABLED", "true").lower() == "true"
+RESULT_CACHE_SIZE = int(os.getenv("RESULT_CACHE_SIZE", 128))
+RESULT_CACHE_REDIS = os.getenv("RESULT_CACHE_REDIS", "false").lower() == "true"
+RESULT_CACHE_TTL_SECONDS = int(os.getenv("RESULT_CACHE_TTL_SECONDS", 86400))
+
+
+def file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        while chunk := f.read(1024 * 1024):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class ResultCache:
+    """
+    Validation results keyed by file content. An in-process LRU sits in front
+    of an optional Redis tier; entries are pickled for Redis, which only ever
+    holds values this service wrote itself.
+    """
+
+    KEY_PREFIX = "validation_result:"
+
+    def __init__(self, max_entries=RESULT_CACHE_SIZE, client=None, ttl_seconds=RESULT_CACHE_TTL_SECONDS):
+        self.max_entries = max_entries
+        self.client = client
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(sha256: str, *parts) -> str:
+        return ":".join([sha256, *map(str, parts)])
+
+    def get(self, key: str):
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key]
+
+        value = None
+        if self.client is not None:
+            redis_key = f"{self.KEY_PREFIX}{key}"
+            raw = None
+            try:
+                raw = self.client.execute_command("GET", redis_key, **{NEVER_DECODE: True})
+            except RedisError as e:
+                logging.warning(f"Result cache lookup failed: {e}")
+            if raw:
+                try:
+                    value = pickle.loads(raw)
+                except Exception as e:
+                    # Truncated, or written by another version of the code: drop it and count a miss
+                    logging.warning(f"Discarding unreadable result cache entry {redis_key}: {e!r}")
+                    try:
+                        self.client.delete(redis_key)
+                    except RedisError as e:
+                        logging.warning(f"Result cache delete failed: {e}")
+
+        with self._lock:
+            if value is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._store(key, value)
+        return value
+
+    def put(self, key: str, value):
+        with self._lock:
+            self._store(key, value)
+        if self.client is not None:
+            try:
+                self.client.setex(f"{self.KEY_PREFIX}{key}", self.ttl_seconds, pickle.dumps(value))
+            except RedisError as e:
+                logging.warning(f"Result cache store failed: {e}")
+
+    def _store(self, key, value):
+        self._entries[key] = value
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+
+result_cache = ResultCache(client=redis_client if RESULT_CACHE_REDIS else None)
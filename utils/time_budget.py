@@ -0,0 +1,101 @@
+import logging
+import os
+import threading
+import time
+import uuid
+
+from redis.exceptions import RedisError
+
+from utils.redis_util import redis_client
+from utils.validation_pool import VALIDATION_POOL_KIND
+
+# VALIDATION_TIME_BUDGET_SECONDS: wall time one validation may take, waiting
+# for a pool worker included, before its remaining stages are skipped; 0 for no limit
+# VALIDATION_CANCEL_BACKEND: where cancelled validations are recorded, "memory"
+# (seen by a thread pool) or "redis" (seen by worker processes too); defaults
+# to redis for a process pool
+# VALIDATION_CANCEL_POLL_SECONDS: how often a worker asks Redis whether its validation was cancelled
+VALIDATION_TIME_BUDGET_SECONDS = float(os.getenv("VALIDATION_TIME_BUDGET_SECONDS", 120))
+VALIDATION_CANCEL_BACKEND = os.getenv(
+    "VALIDATION_CANCEL_BACKEND", "redis" if VALIDATION_POOL_KIND == "process" else "memory"
+)
+VALIDATION_CANCEL_POLL_SECONDS = float(os.getenv("VALIDATION_CANCEL_POLL_SECONDS", 0.5))
+
+CANCEL_KEY_PREFIX = "validation_cancel:"
+CANCEL_TTL_SECONDS = 3600
+
+_cancelled = set()
+_cancelled_lock = threading.Lock()
+
+
+class BudgetExceeded(Exception):
+    """Raised inside a stage whose validation ran out of time or was cancelled; the stage is then skipped."""
+
+
+class TimeBudget:
+    """
+    Deadline and cancellation token of one validation. It is picklable, so it
+    travels to a process pool worker with the rest of the arguments. Every
+    stage asks expired() before it starts, and long parses call check()
+    between blocks; once the budget is spent each remaining stage is skipped
+    and recorded in skipped, and the caller gets what finished so far.
+    """
+
+    def __init__(self, seconds=None, token=None):
+        self.seconds = VALIDATION_TIME_BUDGET_SECONDS if seconds is None else seconds
+        self.deadline = time.time() + self.seconds if self.seconds > 0 else None
+        self.token = token or uuid.uuid4().hex
+        self.reason = None  # "timeout" or "cancelled" once spent
+        self.skipped = []
+        self._polled_at = 0.0
+
+    def expired(self) -> bool:
+        if self.reason is None:
+            if self.deadline is not None and time.time() >= self.deadline:
+                self.reason = "timeout"
+            elif self._cancelled():
+                self.reason = "cancelled"
+        return self.reason is not None
+
+    def _cancelled(self):
+        if self.token in _cancelled:
+            return True
+        if VALIDATION_CANCEL_BACKEND != "redis" or time.monotonic() - self._polled_at < VALIDATION_CANCEL_POLL_SECONDS:
+            return False
+        self._polled_at = time.monotonic()
+        try:
+            return bool(redis_client.exists(f"{CANCEL_KEY_PREFIX}{self.token}"))
+        except RedisError as e:
+            logging.warning(f"Could not check validation {self.token} for cancellation: {e}")
+            return False
+
+    def check(self):
+        """Raises BudgetExceeded once the budget is spent; for loops inside a stage."""
+        if self.expired():
+            raise BudgetExceeded(self.reason)
+
+    def skip(self, stage):
+        if stage not in self.skipped:
+            self.skipped.append(stage)
+
+    def describe(self) -> str:
+        """Why the validation is incomplete and what it left out, for the error list."""
+        cause = "was cancelled" if self.reason == "cancelled" else f"exceeded its time budget of {self.seconds:g}s"
+        return f"Validation {cause}; skipped: {', '.join(self.skipped)}."
+
+
+def cancel_validation(token):
+    """Asks the validation holding token to stop at its next step."""
+    with _cancelled_lock:
+        _cancelled.add(token)
+    if VALIDATION_CANCEL_BACKEND == "redis":
+        try:
+            redis_client.setex(f"{CANCEL_KEY_PREFIX}{token}", CANCEL_TTL_SECONDS, 1)
+        except RedisError as e:
+            logging.warning(f"Could not record the cancellation of validation {token}: {e}")
+
+
+def forget_validation(token):
+    """Drops the cancellation record of a validation that has returned."""
+    with _cancelled_lock:
+        _cancelled.discard(token)
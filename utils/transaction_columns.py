@@ -0,0 +1,254 @@
+from decimal import Decimal, InvalidOperation
+
+import numpy as np
+
+# Amounts are held as integers in units of 10**-AMOUNT_SCALE; pain.001 amounts
+# allow at most 5 fraction digits and 18 digits in total.
+AMOUNT_SCALE = 5
+_SCALE_FACTOR = 10 ** AMOUNT_SCALE
+_MAX_WHOLE_DIGITS = 13
+_INT64_MAX = np.iinfo(np.int64).max
+
+
+def parse_amount(text):
+    """One amount as a scaled integer, or None if it is not a finite amount with at most 5 decimals."""
+    try:
+        amount = Decimal(text.strip())
+    except (InvalidOperation, AttributeError):
+        return None
+    if not amount.is_finite():
+        return None
+    scaled = amount.scaleb(AMOUNT_SCALE)
+    if scaled != scaled.to_integral_value():
+        return None
+    return int(scaled)
+
+
+def parse_amounts(texts):
+    """
+    Returns (scaled int64 amounts, mask of the ones that parsed) for a column
+    of amount texts. Plain unsigned decimals are converted in bulk; anything
+    else (signs, exponents, junk) falls back to parse_amount one by one.
+    """
+    text = np.char.strip(np.asarray(texts, dtype=str))
+    scaled = np.zeros(len(text), dtype=np.int64)
+    if not len(text):
+        return scaled, np.zeros(0, dtype=bool)
+
+    parts = np.char.partition(text, ".")
+    whole, frac = parts[:, 0], parts[:, 2]
+    frac_len = np.char.str_len(frac)
+    plain = (
+        np.char.isdigit(whole)
+        & (np.char.str_len(whole) <= _MAX_WHOLE_DIGITS)
+        & ((frac_len == 0) | np.char.isdigit(frac))
+        & (frac_len <= AMOUNT_SCALE)
+    )
+    try:
+        padded = np.char.ljust(frac[plain], AMOUNT_SCALE, "0")
+        scaled[plain] = whole[plain].astype(np.int64) * _SCALE_FACTOR + padded.astype(np.int64)
+    except ValueError:
+        # Unicode digits numpy counts as digits but cannot convert
+        plain[:] = False
+
+    valid = plain.copy()
+    for i in np.flatnonzero(~plain):
+        amount = parse_amount(str(text[i]))
+        if amount is not None and abs(amount) <= _INT64_MAX:
+            scaled[i] = amount
+            valid[i] = True
+    return scaled, valid
+
+
+def _sum_fits_int64(scaled):
+    return not len(scaled) or int(np.abs(scaled).max()) * len(scaled) < _INT64_MAX
+
+
+def sum_amounts(scaled) -> Decimal:
+    """Exact sum of scaled amounts; falls back to Python integers if int64 could overflow."""
+    if not len(scaled):
+        return Decimal(0)
+    if _sum_fits_int64(scaled):
+        total = int(scaled.sum())
+    else:
+        total = sum(int(amount) for amount in scaled)
+    return Decimal(total).scaleb(-AMOUNT_SCALE)
+
+
+def sum_amounts_by_block(scaled, blocks, block_count):
+    """
+    Per block (number of amounts, exact Decimal sum) for amounts tagged with
+    their block index; amounts outside any block (index -1) are ignored.
+    """
+    inside = blocks >= 0
+    scaled, blocks = scaled[inside], blocks[inside]
+    counts = np.bincount(blocks, minlength=block_count)
+    if _sum_fits_int64(scaled):
+        totals = np.zeros(block_count, dtype=np.int64)
+        np.add.at(totals, blocks, scaled)
+        totals = totals.tolist()
+    else:
+        totals = [0] * block_count
+        for block, amount in zip(blocks.tolist(), scaled.tolist()):
+            totals[block] += amount
+    return [(int(count), Decimal(total).scaleb(-AMOUNT_SCALE)) for count, total in zip(counts, totals)]
+
+
+def scaled_to_decimal(amount) -> Decimal:
+    return Decimal(int(amount)).scaleb(-AMOUNT_SCALE)
+
+
+def format_amount(amount: Decimal) -> str:
+    """Plain notation with at least two decimals and no trailing zeros beyond them."""
+    whole, _, frac = f"{amount:f}".partition(".")
+    return f"{whole}.{frac.rstrip('0').ljust(2, '0')}"
+
+
+class PaymentBlock:
+    """The declared totals of one <PmtInf>; nb_of_txs and ctrl_sum are (text, line) or None."""
+
+    def __init__(self, pmtinf_id=None, line=None):
+        self.pmtinf_id = pmtinf_id
+        self.line = line
+        self.nb_of_txs = None
+        self.ctrl_sum = None
+
+
+class TransactionColumns:
+    """
+    The per-transaction fields the amount and code checks read, one column
+    per field with the source line of every value next to it. Columns are
+    independent: purpose codes are optional and countries come from every
+    postal address, so row i of one column is not row i of another.
+
+    amount_blocks holds the index into payment_blocks of each amount's
+    <PmtInf>; group_header holds the file-level declared totals. ibans holds
+    the debtor and creditor account IBANs.
+    """
+
+    def __init__(self, amounts, amount_lines, currencies, end_to_end_ids, end_to_end_lines,
+                 purpose_codes, purpose_lines, countries, country_lines,
+                 amount_blocks=(), payment_blocks=(), group_header=None, ibans=(), iban_lines=()):
+        self.amounts = np.asarray(amounts, dtype=str)
+        self.amount_lines = amount_lines
+        self.amount_blocks = np.asarray(amount_blocks, dtype=np.intp)
+        self.payment_blocks = list(payment_blocks)
+        self.group_header = group_header or PaymentBlock()
+        self.currencies = np.asarray(currencies, dtype=str)
+        self.end_to_end_ids = np.asarray(end_to_end_ids, dtype=str)
+        self.end_to_end_lines = end_to_end_lines
+        self.purpose_codes = np.asarray(purpose_codes, dtype=str)
+        self.purpose_lines = purpose_lines
+        self.countries = np.asarray(countries, dtype=str)
+        self.country_lines = country_lines
+        self.ibans = np.asarray(ibans, dtype=str)
+        self.iban_lines = list(iban_lines)
+        self._scaled = None
+
+    def scaled_amounts(self):
+        """(scaled int64 amounts, parsed mask), computed once."""
+        if self._scaled is None:
+            self._scaled = parse_amounts(self.amounts)
+        return self._scaled
+
+
+def not_in(column, allowed, length=None, upper=False):
+    """
+    Mask of the column values missing from the allowed code set, optionally
+    compared upper-cased and also flagging values that are not length long.
+    """
+    values = np.char.upper(column) if upper else column
+    mask = ~np.isin(values, np.array(list(allowed), dtype=str))
+    if length is not None:
+        mask |= np.char.str_len(column) != length
+    return mask
+
+
+def distinct_values(column):
+    """(distinct values as a list, index of each row's value in that list)."""
+    if not len(column):
+        return [], np.zeros(0, dtype=np.intp)
+    values, inverse = np.unique(column, return_inverse=True)
+    return values.tolist(), inverse
+
+
+def first_occurrences(column):
+    """(indices of the first occurrence of each value, indices of the repeats), both in column order."""
+    if not len(column):
+        return np.zeros(0, dtype=np.intp), np.zeros(0, dtype=np.intp)
+    _, first = np.unique(column, return_index=True)
+    first.sort()
+    repeated = np.ones(len(column), dtype=bool)
+    repeated[first] = False
+    return first, np.flatnonzero(repeated)
+
+
+def extract_transaction_columns(root, namespace) -> TransactionColumns:
+    """
+    Collects amounts, currencies, EndToEndIds, purpose codes and countries in
+    a single walk of the document, along with the declared NbOfTxs/CtrlSum of
+    the group header and of every <PmtInf>, the <PmtInf> each amount belongs
+    to and the IBANs of the debtor and creditor accounts. InstdAmt and EndToEndId only occur inside <CdtTrfTxInf> in
+    pain.001, and Cd is only taken under <Purp>; countries come from every
+    postal address in the message.
+    """
+    def qualified(name):
+        return f"{{{namespace}}}{name}" if namespace else name
+
+    instd_amt, end_to_end_id, cd, ctry, purp = (
+        qualified(name) for name in ("InstdAmt", "EndToEndId", "Cd", "Ctry", "Purp")
+    )
+    pmtinf, pmtinf_id, nb_of_txs, ctrl_sum = (
+        qualified(name) for name in ("PmtInf", "PmtInfId", "NbOfTxs", "CtrlSum")
+    )
+    iban = qualified("IBAN")
+    iban_accounts = {qualified("DbtrAcct"), qualified("CdtrAcct")}
+
+    amounts, amount_lines, currencies, amount_blocks = [], [], [], []
+    end_to_end_ids, end_to_end_lines = [], []
+    purpose_codes, purpose_lines = [], []
+    countries, country_lines = [], []
+    ibans, iban_lines = [], []
+    group_header = PaymentBlock()
+    payment_blocks = []
+    block = None  # the <PmtInf> being walked; GrpHdr comes before the first one
+
+    # Per-element attribute access dominates the cost, so each element is touched once
+    for element in root.iter(instd_amt, end_to_end_id, cd, ctry, iban, pmtinf, pmtinf_id, nb_of_txs, ctrl_sum):
+        tag = element.tag
+        if tag == instd_amt:
+            amounts.append(element.text or "")
+            amount_lines.append(element.sourceline)
+            currencies.append(element.get("Ccy") or "")
+            amount_blocks.append(len(payment_blocks) - 1)
+        elif tag == end_to_end_id:
+            end_to_end_ids.append((element.text or "").strip())
+            end_to_end_lines.append(element.sourceline)
+        elif tag == ctry:
+            countries.append((element.text or "").strip())
+            country_lines.append(element.sourceline)
+        elif tag == iban:
+            if element.getparent().getparent().tag in iban_accounts:
+                ibans.append((element.text or "").strip())
+                iban_lines.append(element.sourceline)
+        elif tag == cd:
+            if element.getparent().tag == purp:
+                purpose_codes.append((element.text or "").strip())
+                purpose_lines.append(element.sourceline)
+        elif tag == pmtinf:
+            block = PaymentBlock(line=element.sourceline)
+            payment_blocks.append(block)
+        elif tag == pmtinf_id:
+            if block is not None and block.pmtinf_id is None:
+                block.pmtinf_id = (element.text or "").strip()
+        else:
+            target = group_header if block is None else block
+            declared = ((element.text or "").strip(), element.sourceline)
+            if tag == nb_of_txs and target.nb_of_txs is None:
+                target.nb_of_txs = declared
+            elif tag == ctrl_sum and target.ctrl_sum is None:
+                target.ctrl_sum = declared
+
+    return TransactionColumns(amounts, amount_lines, currencies, end_to_end_ids, end_to_end_lines,
+                              purpose_codes, purpose_lines, countries, country_lines,
+                              amount_blocks, payment_blocks, group_header, ibans, iban_lines)
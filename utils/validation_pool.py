@@ -0,0 +1,164 @@
+import asyncio
+import logging
+import os
+import threading
+import time
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+
+# VALIDATION_POOL_KIND: "thread" (default) or "process"
+# VALIDATION_POOL_WORKERS: number of workers, defaults to the CPU count
+# VALIDATION_POOL_QUEUE: how many jobs may wait for a free worker before new ones are rejected
+VALIDATION_POOL_KIND = os.getenv("VALIDATION_POOL_KIND", "thread")
+VALIDATION_POOL_WORKERS = int(os.getenv("VALIDATION_POOL_WORKERS", os.cpu_count() or 2))
+VALIDATION_POOL_QUEUE = int(os.getenv("VALIDATION_POOL_QUEUE", 16))
+
+
+class PoolSaturatedError(Exception):
+    """Raised when every worker is busy and the wait queue is full."""
+
+
+def _timed_call(fn, submitted_at, *args):
+    # Runs inside the worker (thread or process) so the timings are measured
+    # where the work actually happens.
+    started_at = time.time()
+    result = fn(*args)
+    return started_at - submitted_at, time.time() - started_at, result
+
+
+class ValidationPool:
+    """
+    Bounded executor for CPU/IO heavy validation work.
+
+    At most max_workers jobs run at once and at most max_queue more may wait;
+    anything beyond that is refused immediately with PoolSaturatedError so the
+    caller can answer 503 instead of letting requests pile up. initializer, if
+    set before the first job, runs once in every worker as it starts.
+    """
+
+    def __init__(self, kind=VALIDATION_POOL_KIND, max_workers=VALIDATION_POOL_WORKERS, max_queue=VALIDATION_POOL_QUEUE,
+                 initializer=None):
+        if kind not in ("thread", "process"):
+            raise ValueError(f"Invalid validation pool kind: {kind}")
+        self.kind = kind
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self.initializer = initializer
+
+        self._executor = None
+        self._slots = threading.BoundedSemaphore(max_workers + max_queue)
+        self._lock = threading.Lock()
+
+        self._in_flight = 0
+        self._submitted = 0
+        self._completed = 0
+        self._failed = 0
+        self._rejected = 0
+        self._total_run_seconds = 0.0
+        self._total_wait_seconds = 0.0
+        self._max_run_seconds = 0.0
+
+    def _get_executor(self):
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    executor_cls = ProcessPoolExecutor if self.kind == "process" else ThreadPoolExecutor
+                    self._executor = executor_cls(max_workers=self.max_workers, initializer=self.initializer)
+                    logging.info(f"Validation pool started: {self.kind} x{self.max_workers}, queue {self.max_queue}")
+        return self._executor
+
+    def try_acquire(self):
+        """Reserve a slot for one job, or raise PoolSaturatedError if none is free."""
+        if not self.reserve_if_free():
+            with self._lock:
+                self._rejected += 1
+            raise PoolSaturatedError(
+                f"Validation pool is saturated ({self.max_workers} running, {self.max_queue} queued)."
+            )
+
+    def reserve_if_free(self) -> bool:
+        """Reserve a slot if one is free; unlike try_acquire a busy pool is not counted as a rejection."""
+        if not self._slots.acquire(blocking=False):
+            return False
+        with self._lock:
+            self._in_flight += 1
+        return True
+
+    async def acquire(self, poll_seconds=0.05):
+        """Wait for a free slot and reserve it; for work that was already accepted, like the rest of a batch."""
+        while not self.reserve_if_free():
+            await asyncio.sleep(poll_seconds)
+
+    def release(self):
+        """Give back a slot reserved with try_acquire that will not be used."""
+        with self._lock:
+            self._in_flight -= 1
+        self._slots.release()
+
+    def submit_reserved(self, fn, *args):
+        """Submit a job for a slot already taken with try_acquire."""
+        with self._lock:
+            self._submitted += 1
+        try:
+            future = self._get_executor().submit(_timed_call, fn, time.time(), *args)
+        except Exception:
+            self.release()
+            raise
+
+        outer = Future()
+
+        def _done(inner):
+            try:
+                wait_seconds, run_seconds, result = inner.result()
+            except Exception as e:
+                with self._lock:
+                    self._failed += 1
+                self.release()
+                outer.set_exception(e)
+                return
+            with self._lock:
+                self._completed += 1
+                self._total_run_seconds += run_seconds
+                self._total_wait_seconds += wait_seconds
+                self._max_run_seconds = max(self._max_run_seconds, run_seconds)
+            self.release()
+            outer.set_result(result)
+
+        future.add_done_callback(_done)
+        return outer
+
+    def submit(self, fn, *args):
+        self.try_acquire()
+        return self.submit_reserved(fn, *args)
+
+    async def run(self, fn, *args, reserved=False):
+        """Await fn(*args) on the pool without blocking the event loop."""
+        future = self.submit_reserved(fn, *args) if reserved else self.submit(fn, *args)
+        return await asyncio.wrap_future(future)
+
+    def metrics(self):
+        with self._lock:
+            finished = self._completed or 1
+            return {
+                "kind": self.kind,
+                "max_workers": self.max_workers,
+                "max_queue": self.max_queue,
+                "in_flight": self._in_flight,
+                "running": min(self._in_flight, self.max_workers),
+                "queue_depth": max(0, self._in_flight - self.max_workers),
+                "submitted": self._submitted,
+                "completed": self._completed,
+                "failed": self._failed,
+                "rejected": self._rejected,
+                "avg_run_seconds": round(self._total_run_seconds / finished, 4),
+                "max_run_seconds": round(self._max_run_seconds, 4),
+                "avg_wait_seconds": round(self._total_wait_seconds / finished, 4),
+            }
+
+    def shutdown(self, wait=True):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=wait)
+
+
+validation_pool = ValidationPool()
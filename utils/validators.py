@@ -1,6 +1,7 @@
 import re
 from urllib.parse import urlparse
 from sqlalchemy.orm import validates
+from utils.reference_data import get_reference_data
 
 def is_valid_password(password: str) -> bool:
     """
@@ -48,8 +49,25 @@ def is_valid_state(value: str) -> bool:
     return bool(value and value.isalpha() and 2 <= len(value) <= 100)
 
 def is_valid_country(value: str) -> bool:
-    """Basic country validation."""
-    return bool(value and value.isalpha() and 2 <= len(value) <= 100)
+    """ISO 3166 alpha-2 or alpha-3 code or country name, per the bundled reference data."""
+    return get_reference_data().is_country(value)
+
+def unknown_check_names(names) -> list:
+    """The names that are not registered validation checks."""
+    # Importing the validation pipeline registers its checks
+    from utils.file_validation_util import check_registry
+    known = set(check_registry.names())
+    return [name for name in names if name not in known]
+
+def unknown_currencies(codes) -> list:
+    """The codes that are not ISO 4217 currencies, per the bundled reference data."""
+    currencies = get_reference_data().currencies
+    return [code for code in codes if code.strip().upper() not in currencies]
+
+def unknown_purpose_codes(codes) -> list:
+    """The codes that are not ISO 20022 external purpose codes, per the bundled reference data."""
+    purpose_codes = get_reference_data().purpose_codes
+    return [code for code in codes if code.strip().upper() not in purpose_codes]
 
 
 def is_valid_email(email: str) -> bool:
@@ -0,0 +1,102 @@
+import threading
+
+from lxml import etree
+
+PAIN001_NAMESPACE_PREFIX = "urn:iso:std:iso:20022:tech:xsd:pain.001.001."
+
+_ROOT = "/ns:Document/ns:CstmrCdtTrfInitn"
+_GRPHDR = f"{_ROOT}/ns:GrpHdr"
+_PMTINF = f"{_ROOT}/ns:PmtInf"
+_TX = f"{_PMTINF}/ns:CdtTrfTxInf"
+
+# Paths anchored on the pain.001 message structure, shared by every version.
+# Names starting with pmtinf_ are relative to one <PmtInf> element.
+BASE_PATHS = {
+    "msg_id": f"{_GRPHDR}/ns:MsgId",
+    "cre_dt_tm": f"{_GRPHDR}/ns:CreDtTm",
+    "nb_of_txs": f"{_GRPHDR}/ns:NbOfTxs",
+    "ctrl_sum": f"{_GRPHDR}/ns:CtrlSum",
+    "pmtinf": _PMTINF,
+    "pmtinf_id": "ns:PmtInfId",
+    "pmtinf_nb_of_txs": "ns:NbOfTxs",
+    "pmtinf_ctrl_sum": "ns:CtrlSum",
+    "pmtinf_pmt_mtd": "ns:PmtMtd",
+    "pmtinf_svc_lvl": "ns:PmtTpInf/ns:SvcLvl/ns:Cd",
+    "pmtinf_lcl_instrm": "ns:PmtTpInf/ns:LclInstrm/ns:Cd",
+    "pmtinf_reqd_exctn_dt": "ns:ReqdExctnDt",
+    "debtor_iban": f"{_PMTINF}/ns:DbtrAcct/ns:Id/ns:IBAN",
+    "creditor_iban": f"{_TX}/ns:CdtrAcct/ns:Id/ns:IBAN",
+    "debtor_agent_bic": f"{_PMTINF}/ns:DbtrAgt/ns:FinInstnId/ns:BIC",
+    "debtor_agent_mmbid": f"{_PMTINF}/ns:DbtrAgt/ns:FinInstnId/ns:ClrSysMmbId/ns:MmbId",
+    "instd_amt": f"{_TX}/ns:Amt/ns:InstdAmt",
+    "purpose_code": f"{_TX}/ns:Purp/ns:Cd",
+    "end_to_end_id": f"{_TX}/ns:PmtId/ns:EndToEndId",
+    # Postal addresses appear under every party and agent, so this one stays a descendant scan
+    "country": f"{_ROOT}//ns:Ctry",
+}
+
+# Version specific replacements for BASE_PATHS, keyed by the last namespace segment
+_BICFI_PATHS = {
+    "debtor_agent_bic": f"{_PMTINF}/ns:DbtrAgt/ns:FinInstnId/ns:BICFI",
+}
+_DATE_CHOICE_PATHS = {
+    **_BICFI_PATHS,
+    # ReqdExctnDt became a Dt / DtTm choice
+    "pmtinf_reqd_exctn_dt": "ns:ReqdExctnDt/ns:Dt | ns:ReqdExctnDt/ns:DtTm",
+}
+VERSION_PATHS = {
+    "04": _BICFI_PATHS,
+    "05": _BICFI_PATHS,
+    "06": _BICFI_PATHS,
+    "07": _BICFI_PATHS,
+    "08": _DATE_CHOICE_PATHS,
+    "09": _DATE_CHOICE_PATHS,
+}
+
+
+def version_of_namespace(namespace):
+    """'09' for urn:iso:std:iso:20022:tech:xsd:pain.001.001.09, None for anything else."""
+    if namespace and namespace.startswith(PAIN001_NAMESPACE_PREFIX):
+        return namespace[len(PAIN001_NAMESPACE_PREFIX):]
+    return None
+
+
+class XPathTable:
+    """
+    The XPaths every check reads, compiled once for one document namespace.
+    Checks ask for entries by name, so version differences such as BIC vs
+    BICFI live here instead of in the checks.
+    """
+
+    def __init__(self, namespace):
+        self.namespace = namespace
+        self.version = version_of_namespace(namespace)
+        self.paths = {**BASE_PATHS, **VERSION_PATHS.get(self.version, {})}
+        if namespace is None:
+            # XPath has no default namespace, so match un-namespaced documents without the prefix
+            self.paths = {name: path.replace("ns:", "") for name, path in self.paths.items()}
+            namespaces = {}
+        else:
+            namespaces = {"ns": namespace}
+        self._xpaths = {name: etree.XPath(path, namespaces=namespaces) for name, path in self.paths.items()}
+
+    def findall(self, name, node):
+        return self._xpaths[name](node)
+
+    def find(self, name, node):
+        found = self._xpaths[name](node)
+        return found[0] if found else None
+
+
+# Compiled XPath objects serialise concurrent calls, so every thread keeps its own tables
+_local = threading.local()
+
+
+def get_xpath_table(namespace) -> XPathTable:
+    tables = getattr(_local, "tables", None)
+    if tables is None:
+        tables = _local.tables = {}
+    table = tables.get(namespace)
+    if table is None:
+        table = tables[namespace] = XPathTable(namespace)
+    return table